@@ -0,0 +1,31 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from rest_framework.authtoken.models import Token
+
+
+@database_sync_to_async
+def get_token_user(key):
+    try:
+        return Token.objects.select_related('user').get(key=key).user
+    except Token.DoesNotExist:
+        return None
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """
+    Xác thực WebSocket bằng DRF token: ws://.../?token=<key>.
+    Nếu không có token hợp lệ thì giữ nguyên scope['user'] (session).
+    """
+
+    async def __call__(self, scope, receive, send):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        key = query.get('token', [None])[0]
+
+        if key:
+            user = await get_token_user(key)
+            if user is not None and user.is_active:
+                scope = dict(scope, user=user)
+
+        return await super().__call__(scope, receive, send)
@@ -14,6 +14,8 @@ from datetime import timedelta, datetime
 from .models import User, Note
 from .serializers import UserSerializer, LoginSerializer, UpdatePasswordSerializer, NoteSerializer
 from apps.rooms.models import Participation
+from apps.rooms.invalidation import user_namespace
+from blueroom.caching import tiered_cache
 
 class UserViewSet(ModelViewSet):
     queryset = User.objects.all()
@@ -59,8 +61,12 @@ class UserViewSet(ModelViewSet):
     @action(detail=False, methods=['get'], url_path='profile')
     def profile(self, request):
         user = request.user
-        serializer = self.get_serializer(user)
-        return Response(serializer.data)
+        data = tiered_cache.get_or_set(
+            f'profile:{user.pk}:{request.build_absolute_uri("/")}',
+            lambda: self.get_serializer(user).data,
+            versions=[user_namespace(user.pk)]
+        )
+        return Response(data)
 
     @action(detail=False, methods=['put'], url_path='profile/update')
     def update_profile(self, request):
@@ -102,8 +108,6 @@ class UserViewSet(ModelViewSet):
             for participation in participations
         ]
 
-        print(participations)
-        
         return Response(history, status=200)
 
 class NoteViewSet(ModelViewSet):
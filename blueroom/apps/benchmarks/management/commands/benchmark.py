@@ -0,0 +1,71 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from apps.benchmarks.runner import Runner, compare
+from apps.benchmarks.seed import seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Chạy benchmark REST + WebSocket trên test database với dữ liệu giả lập, "
+        "in p50/p99, throughput và số query mỗi endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=50)
+        parser.add_argument('--members', type=int, default=10, help="Thành viên mỗi phòng (không tính chủ phòng)")
+        parser.add_argument('--free-users', type=int, default=50, help="User rảnh dùng cho join/leave")
+        parser.add_argument('--subjects', type=int, default=20)
+        parser.add_argument('--messages', type=int, default=500, help="Tin nhắn mỗi phòng")
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument('--scenario', action='append', choices=sorted(Runner.SCENARIOS),
+                            help="Chỉ chạy các kịch bản này (lặp lại được)")
+        parser.add_argument('--json', dest='json_path', help="Ghi kết quả ra file JSON")
+        parser.add_argument('--baseline', help="File JSON của lần chạy trước để so sánh")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="Cho phép p99 chậm hơn baseline bao nhiêu")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            dataset = seed(
+                rooms=options['rooms'],
+                members_per_room=options['members'],
+                free_users=options['free_users'],
+                subjects=options['subjects'],
+                messages_per_room=options['messages'],
+            )
+            summary = Runner(dataset, options['iterations']).run(options['scenario'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{connection.vendor}: {options['rooms']} rooms x {options['members'] + 1} members, "
+            f"{options['messages']} messages/room, {options['iterations']} iterations"
+        )
+        self.stdout.write(f"{'scenario':<24}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'ops/s':>10}{'queries':>10}{'errors':>8}")
+        for name, row in summary.items():
+            self.stdout.write(
+                f"{name:<24}{row['p50_ms']:>10}{row['p99_ms']:>10}{row['mean_ms']:>10}"
+                f"{row['ops_per_s']:>10}{row['queries_per_op']:>10}{row['errors']:>8}"
+            )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(summary, f, indent=2)
+
+        if baseline is not None:
+            regressions = compare(summary, baseline, options['tolerance'])
+            for regression in regressions:
+                self.stderr.write(f"REGRESSION {regression}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) against {options['baseline']}")
@@ -0,0 +1,261 @@
+import asyncio
+import json
+import threading
+import time
+
+from channels.testing import WebsocketCommunicator
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.test import APIClient
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+class QueryCounter:
+    """
+    Đếm mọi câu SQL của process, kể cả các câu chạy trong thread của
+    sync_to_async (mỗi thread có connection riêng).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def _attach(self, connection):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def install(self):
+        connection_created.connect(self._on_connection_created)
+        for connection in connections.all(initialized_only=True):
+            self._attach(connection)
+
+    def uninstall(self):
+        connection_created.disconnect(self._on_connection_created)
+        for connection in connections.all(initialized_only=True):
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+    def _on_connection_created(self, sender, connection, **kwargs):
+        self._attach(connection)
+
+
+class Result:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.queries = 0
+        self.elapsed = 0.0
+        self.errors = 0
+
+    def summary(self):
+        count = len(self.latencies)
+        return {
+            'count': count,
+            'errors': self.errors,
+            'p50_ms': round(percentile(self.latencies, 0.50) * 1000, 3),
+            'p99_ms': round(percentile(self.latencies, 0.99) * 1000, 3),
+            'mean_ms': round(sum(self.latencies) / count * 1000, 3) if count else 0.0,
+            'ops_per_s': round(count / self.elapsed, 1) if self.elapsed else 0.0,
+            'queries_per_op': round(self.queries / count, 2) if count else 0.0,
+        }
+
+
+class Runner:
+    def __init__(self, dataset, iterations, application=None):
+        self.dataset = dataset
+        self.iterations = iterations
+        self.counter = QueryCounter()
+        self.results = {}
+        self._application = application
+
+    @property
+    def application(self):
+        if self._application is None:
+            from blueroom.asgi import application
+            self._application = application
+        return self._application
+
+    def result(self, name):
+        return self.results.setdefault(name, Result(name))
+
+    def client(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.dataset.tokens[user.id]}')
+        return client
+
+    def measure(self, name, func):
+        result = self.result(name)
+        queries = self.counter.count
+        started = time.perf_counter()
+        try:
+            ok = func()
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+
+        result.latencies.append(elapsed)
+        result.elapsed += elapsed
+        result.queries += self.counter.count - queries
+        if not ok:
+            result.errors += 1
+
+    async def ameasure(self, name, coroutine_func):
+        result = self.result(name)
+        queries = self.counter.count
+        started = time.perf_counter()
+        try:
+            ok = await coroutine_func()
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+
+        result.latencies.append(elapsed)
+        result.elapsed += elapsed
+        result.queries += self.counter.count - queries
+        if not ok:
+            result.errors += 1
+
+    # REST
+
+    def rest_room_active(self):
+        client = self.client(self.dataset.free_users[0])
+        for _ in range(self.iterations):
+            self.measure('rest:room-active', lambda: client.get('/api/rooms/room/room-active/').status_code == 200)
+
+    def rest_room_search(self):
+        client = self.client(self.dataset.free_users[0])
+        for i in range(self.iterations):
+            query = f'subject {i % 20}'
+            self.measure(
+                'rest:room-active?query',
+                lambda: client.get('/api/rooms/room/room-active/', {'query': query}).status_code == 200
+            )
+
+    def rest_members_in_room(self):
+        rooms = self.dataset.rooms
+        for i in range(self.iterations):
+            room = rooms[i % len(rooms)]
+            client = self.client(self.dataset.members[room.id][0])
+            self.measure(
+                'rest:members-in-room',
+                lambda: client.get(f'/api/rooms/room/{room.id}/members-in-room/').status_code == 200
+            )
+
+    def rest_join_leave(self):
+        rooms, users = self.dataset.rooms, self.dataset.free_users
+        for i in range(self.iterations):
+            room, user = rooms[i % len(rooms)], users[i % len(users)]
+            client = self.client(user)
+            self.measure('rest:join', lambda: client.post(f'/api/rooms/room/{room.id}/join/').status_code == 200)
+            self.measure('rest:leave', lambda: client.post(f'/api/rooms/room/{room.id}/leave/').status_code == 200)
+
+    def rest_messages(self):
+        rooms = self.dataset.rooms
+        for i in range(self.iterations):
+            room = rooms[i % len(rooms)]
+            client = self.client(self.dataset.members[room.id][0])
+            self.measure('rest:messages', lambda: client.get(f'/api/chat/{room.id}/messages/').status_code == 200)
+
+    # WebSocket
+
+    async def ws_lobby_connect(self):
+        for _ in range(self.iterations):
+            communicator = WebsocketCommunicator(self.application, '/ws/rooms/')
+
+            async def connect():
+                connected, _ = await communicator.connect(timeout=10)
+                message = json.loads(await communicator.receive_from(timeout=10))
+                return connected and message['type'] == 'initial_rooms'
+
+            await self.ameasure('ws:lobby-connect', connect)
+            await communicator.disconnect()
+
+    async def ws_chat_connect(self):
+        rooms = self.dataset.rooms
+        for i in range(self.iterations):
+            room = rooms[i % len(rooms)]
+            user = self.dataset.members[room.id][0]
+            communicator = WebsocketCommunicator(
+                self.application, f'/ws/room/{room.id}/?token={self.dataset.tokens[user.id]}'
+            )
+
+            async def connect():
+                connected, _ = await communicator.connect(timeout=10)
+                message = json.loads(await communicator.receive_from(timeout=10))
+                return connected and message['type'] == 'initial_messages'
+
+            await self.ameasure('ws:chat-connect', connect)
+            await communicator.disconnect()
+
+    async def ws_chat_send(self):
+        room = self.dataset.rooms[0]
+        user = self.dataset.members[room.id][1]
+        communicator = WebsocketCommunicator(
+            self.application, f'/ws/room/{room.id}/?token={self.dataset.tokens[user.id]}'
+        )
+        await communicator.connect(timeout=10)
+        await communicator.receive_from(timeout=10)
+
+        for i in range(self.iterations):
+            async def send():
+                await communicator.send_to(text_data=json.dumps({'type': 'message', 'content': f'bench {i}'}))
+                message = json.loads(await communicator.receive_from(timeout=10))
+                return message['type'] == 'message'
+
+            await self.ameasure('ws:chat-send', send)
+
+        await communicator.disconnect()
+
+    SCENARIOS = {
+        'room-active': 'rest_room_active',
+        'room-search': 'rest_room_search',
+        'members-in-room': 'rest_members_in_room',
+        'join-leave': 'rest_join_leave',
+        'messages': 'rest_messages',
+        'ws-lobby': 'ws_lobby_connect',
+        'ws-chat-connect': 'ws_chat_connect',
+        'ws-chat-send': 'ws_chat_send',
+    }
+
+    def run(self, scenarios=None):
+        self.counter.install()
+        try:
+            for name in scenarios or self.SCENARIOS:
+                method = getattr(self, self.SCENARIOS[name])
+                if asyncio.iscoroutinefunction(method):
+                    asyncio.run(method())
+                else:
+                    method()
+        finally:
+            self.counter.uninstall()
+
+        return {name: result.summary() for name, result in self.results.items()}
+
+
+def compare(summary, baseline, tolerance):
+    """
+    Trả về danh sách regression so với baseline: p99 chậm hơn quá tolerance
+    hoặc số query mỗi thao tác tăng.
+    """
+    regressions = []
+    for name, current in summary.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if previous['p99_ms'] and current['p99_ms'] > previous['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {previous['p99_ms']}ms -> {current['p99_ms']}ms")
+        if current['queries_per_op'] > previous['queries_per_op']:
+            regressions.append(f"{name}: queries/op {previous['queries_per_op']} -> {current['queries_per_op']}")
+    return regressions
@@ -0,0 +1,87 @@
+from django.contrib.auth.hashers import make_password
+from django.utils.timezone import now
+from rest_framework.authtoken.models import Token
+
+from apps.accounts.models import User
+from apps.chat.models import Message
+from apps.rooms.models import Background, Participation, Room, RoomSubject, Subject
+
+PREFIX = 'bench_'
+
+
+class Dataset:
+    def __init__(self, rooms, members, free_users, tokens):
+        self.rooms = rooms
+        self.members = members
+        self.free_users = free_users
+        self.tokens = tokens
+
+
+def seed(rooms=50, members_per_room=10, free_users=50, subjects=20, messages_per_room=500, batch_size=1000):
+    """
+    Sinh dữ liệu giả lập. bulk_create không trả id trên MySQL, nên sau mỗi
+    lần insert các dòng được đọc lại theo tiền tố để lấy khóa chính.
+    """
+    password = make_password('bench-password')
+    created_at = now()
+
+    Subject.objects.bulk_create([Subject(name=f'{PREFIX}subject {i}') for i in range(subjects)])
+    subject_list = list(Subject.objects.filter(name__startswith=PREFIX).order_by('id'))
+
+    Background.objects.bulk_create([Background(bg=f'room-backgrounds/{PREFIX}{i}.jpg') for i in range(3)])
+    background_list = list(Background.objects.filter(bg__startswith=f'room-backgrounds/{PREFIX}').order_by('id'))
+
+    total_users = rooms * (members_per_room + 1) + free_users
+    User.objects.bulk_create([
+        User(username=f'{PREFIX}user{i}', email=f'{PREFIX}user{i}@example.com', password=password)
+        for i in range(total_users)
+    ], batch_size=batch_size)
+    users = list(User.objects.filter(username__startswith=PREFIX).order_by('id'))
+
+    Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users], batch_size=batch_size)
+    tokens = dict(Token.objects.filter(user__in=users).values_list('user_id', 'key'))
+
+    owners = users[:rooms]
+    Room.objects.bulk_create([
+        Room(
+            title=f'{PREFIX}room {i} {subject_list[i % subjects].name}',
+            description=f'Benchmark room number {i}',
+            created_by=owners[i],
+            background=background_list[i % len(background_list)],
+            members=members_per_room + 1,
+            members_max=members_per_room + 1,
+        ) for i in range(rooms)
+    ], batch_size=batch_size)
+    room_list = list(Room.objects.filter(title__startswith=PREFIX).order_by('id'))
+
+    RoomSubject.objects.bulk_create([
+        RoomSubject(room_id=room, subject_id=subject_list[(i + offset) % subjects])
+        for i, room in enumerate(room_list) for offset in (0, 1)
+    ], batch_size=batch_size)
+
+    members = {}
+    participations = []
+    member_users = users[rooms:rooms + rooms * members_per_room]
+    for i, room in enumerate(room_list):
+        room_members = [owners[i]] + member_users[i * members_per_room:(i + 1) * members_per_room]
+        members[room.id] = room_members
+        participations += [Participation(user_id=user, room_id=room, time_in=created_at) for user in room_members]
+    Participation.objects.bulk_create(participations, batch_size=batch_size)
+    User.objects.filter(id__in=[user.id for user in users[:rooms * (members_per_room + 1)]]).update(is_busy=True)
+
+    open_participations = {}
+    for participation in Participation.objects.filter(room_id__in=room_list).order_by('id'):
+        open_participations.setdefault(participation.room_id_id, []).append(participation)
+
+    for room in room_list:
+        room_participations = open_participations[room.id]
+        Message.objects.bulk_create([
+            Message(
+                participation_id=room_participations[i % len(room_participations)],
+                room_id=room,
+                content=f'benchmark message {i}',
+                type='text',
+            ) for i in range(messages_per_room)
+        ], batch_size=batch_size)
+
+    return Dataset(room_list, members, users[rooms * (members_per_room + 1):], tokens)
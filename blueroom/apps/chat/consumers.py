@@ -1,40 +1,68 @@
-from django.contrib.auth import get_user_model
+from django.conf import settings
 from django.forms.models import model_to_dict
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.sync import sync_to_async
 
+import asyncio
 import json
+import uuid
+from urllib.parse import parse_qs
 
 from .models import Message
+from .history import get_history_page, parse_cursor
+from .serializers import attachment_data
+from .writer import message_writer
+from . import signaling
+from apps.rooms import presence
 from apps.rooms.models import Participation
-from apps.accounts.models import User
-from apps.accounts.serializers import UserSerializer
+from apps.rooms.thumbnails import derivative_url, resolve_fields
+from apps.rooms.events import room_group_name
+from blueroom.metrics import ConsumerMetricsMixin
 
+AUTHOR_FIELDS = ['id', 'username', 'email', 'avatar', 'is_admin', 'is_busy', 'is_active']
 
-class ChatConsumer(AsyncWebsocketConsumer):
+
+class ChatConsumer(ConsumerMetricsMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
-        self.room_group_name = f'roomchat_{self.room_id}'
+        self.room_group_name = room_group_name(self.room_id)
+        self.authors = {}
+
+        user = self.scope.get('user')
+        self.user = user if user is not None and user.is_authenticated else None
+        self.participation = None
+        if self.user is not None:
+            self.participation = await self.get_participation(self.user.pk)
+
+        # ?format=msgpack: tín hiệu WebRTC gửi / nhận bằng frame nhị phân
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.binary = query.get('format', [None])[0] == 'msgpack'
+        self.peer_id = str(self.user.pk) if self.user is not None else uuid.uuid4().hex[:12]
+        self.candidates = signaling.CandidateBatcher(self.send_candidates)
+        self.heartbeat = None
 
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
+        await signaling.register_peer(self.room_id, self.peer_id, self.channel_name)
 
         await self.accept()
+        await self.start_presence()
 
-        messages_data = await self.get_messages(self.room_id)
-
-        for message in messages_data:
-            user = await self.get_user(message.get('user'))
-            user_dict = await self.get_user_dict(user)
-            message['user'] = user_dict
+        # Tin nhắn còn trong buffer phải xuống DB trước khi đọc lịch sử
+        await message_writer.flush()
+        messages_data, next_cursor = await self.get_messages(self.room_id)
 
         await self.send(text_data=json.dumps({
             'type': 'initial_messages',
-            'messages': messages_data
+            'messages': messages_data,
+            'next_cursor': next_cursor,
+            'peer': self.peer_id
         }))
+        await self.channel_layer.group_send(self.room_group_name, signaling.signal_event(
+            {'type': 'peer_joined', 'peer': self.peer_id}, encode=True
+        ))
     
 
     async def disconnect(self, close_code):
@@ -42,47 +70,69 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        if hasattr(self, 'peer_id'):
+            if self.heartbeat is not None:
+                # Lần thấy cuối: không kết nối lại trong PRESENCE_TIMEOUT thì bị reaper đóng
+                self.heartbeat.cancel()
+                await presence.atouch(self.room_id, self.user.pk)
+            self.candidates.cancel()
+            await signaling.unregister_peer(self.room_id, self.peer_id, self.channel_name)
+            await self.channel_layer.group_send(self.room_group_name, signaling.signal_event(
+                {'type': 'peer_left', 'peer': self.peer_id}, encode=True
+            ))
+        await message_writer.flush()
 
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        text_data_json = signaling.decode_frame(text_data, bytes_data)
         type = text_data_json.get('type', '')
-        
-        print(text_data_json)
+
         content = text_data_json.get('content')
 
-        if type == 'offer':
-            offer = text_data_json.get('offer')
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'offer',
-                    'offer': offer
-                }
-            )
-        elif type == 'answer':
-            answer = text_data_json.get('answer')
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'answer',
-                    'answer': answer
-                }
-            )
-        elif type == 'candidate':
-            candidate = text_data_json.get('candidate')
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'candidate',
-                    'candidate': candidate
-                }
-            )
+        if type in signaling.SIGNAL_TYPES:
+            await self.signal(type, text_data_json)
+        elif type == 'heartbeat':
+            if self.user is not None:
+                await presence.atouch(self.room_id, self.user.pk)
+        elif type == 'load_older':
+            await self.send_older_messages(text_data_json)
         elif type == 'message':
-            username = text_data_json.get('user')
+            if self.user is None:
+                # Người gửi chỉ lấy từ scope['user'] (?token= hoặc session), không tin field `user` của client
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'message': 'Authentication required: connect with ?token=<key>'
+                }))
+                return
+            if self.participation is None:
+                self.participation = await self.get_participation(self.user.pk)
+
+            if self.participation is None:
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'message': 'You are not a participant of this room'
+                }))
+                return
+            if not self.participation.chat_allow:
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'message': 'You are not allowed to chat in this room'
+                }))
+                return
 
-            user = await self.get_user(username)
-            message = await self.create_message(user, content)
-            user_dict = await self.get_user_dict(user)
+            if not isinstance(content, str) or not content.strip():
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'message': 'Message content must be a non-empty string'
+                }))
+                return
+
+            await message_writer.put(Message(
+                participation_id=self.participation,
+                room_id_id=self.participation.room_id_id,
+                content=content,
+                type='text',
+            ))
+            user_dict = self.authors[self.participation.user_id_id]
 
             await self.channel_layer.group_send(
                 self.room_group_name,
@@ -93,26 +143,87 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 }
             )
 
-    async def offer(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'offer',
-            'offer': event['offer']
-        }))
+    async def start_presence(self):
+        if self.user is None or self.heartbeat is not None:
+            return
+        await presence.atouch(self.room_id, self.user.pk)
+        self.heartbeat = asyncio.create_task(self.send_heartbeats())
+        presence.presence_reaper.start()
+
+    async def send_heartbeats(self):
+        interval = getattr(settings, 'PRESENCE_HEARTBEAT_INTERVAL', 20)
+        while True:
+            await asyncio.sleep(interval)
+            await presence.atouch(self.room_id, self.user.pk)
+
+    async def send_older_messages(self, data):
+        cursor = data.get('before')
+        try:
+            if cursor is None:
+                before = None
+            elif isinstance(cursor, dict):
+                before = parse_cursor(cursor.get('timestamp'), cursor.get('id'))
+            else:
+                raise ValueError("Invalid cursor. 'before' must be an object with 'timestamp' and 'id'.")
+            messages_data, next_cursor = await self.get_messages(self.room_id, before, data.get('limit'))
+        except ValueError as e:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': str(e)
+            }))
+            return
 
-    async def answer(self, event):
         await self.send(text_data=json.dumps({
-            'type': 'answer',
-            'answer': event['answer']
+            'type': 'older_messages',
+            'messages': messages_data,
+            'next_cursor': next_cursor
         }))
 
-    async def candidate(self, event):
+    async def signal(self, type, data):
+        target = data.get('target')
+        payload = {'type': type, 'from': self.peer_id, type: data.get(type)}
+
+        if target is None:
+            # Client cũ không gửi target: vẫn phát cho cả phòng
+            await self.channel_layer.group_send(self.room_group_name, signaling.signal_event(payload, encode=True))
+        elif type == 'candidate':
+            await self.candidates.add(str(target), payload['candidate'])
+        else:
+            # Candidate đang chờ của peer này phải tới trước offer / answer mới
+            await self.candidates.flush(str(target))
+            await self.send_to_peer(str(target), payload)
+
+    async def send_candidates(self, target, candidates):
+        await self.send_to_peer(target, {'type': 'candidates', 'from': self.peer_id, 'candidates': candidates})
+
+    async def send_to_peer(self, target, payload):
+        channel = await signaling.peer_channel(self.room_id, target)
+        if channel is None:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': f'Peer {target} is not in this room'
+            }))
+            return
+        await self.channel_layer.send(channel, signaling.signal_event(payload))
+
+    async def signal_message(self, event):
+        if event['payload'].get('peer') == self.peer_id:
+            return
+        await self.send(**signaling.encode_frame(event['payload'], self.binary, event.get('text')))
+
+    async def room_closed(self, event):
+        self.participation = None
         await self.send(text_data=json.dumps({
-            'type': 'candidate',
-            'candidate': event['candidate']
+            'type': 'room_closed',
+            'room_id': event['room_id']
         }))
 
+    async def participation_changed(self, event):
+        # Rời phòng / bị chặn / đổi quyền chat: nạp lại ở lần gửi tiếp theo
+        if event['user_id'] is None or (self.user is not None and event['user_id'] == self.user.pk):
+            self.participation = None
+
     async def chat_message(self, event):
-        print(event['user'])
         await self.send(text_data=json.dumps({
             'type': 'message',
             'message': event['message'],
@@ -121,41 +232,48 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
 
     @sync_to_async
-    def get_messages(self, room_id):
-        messages = Message.objects.filter(participation_id__room_id=room_id).order_by('timestamp')
-        messages_data = []
+    def get_messages(self, room_id, before=None, limit=None):
+        messages, next_cursor = get_history_page(room_id, before, limit)
+        # Avatar của các tác giả chưa gặp: một lần đọc cache cho cả trang
+        generated = resolve_fields([
+            message.participation_id.user_id.avatar
+            for message in messages
+            if message.participation_id.user_id and message.participation_id.user_id.id not in self.authors
+        ], 'sm')
 
         messages_data = [{
+            'id': message.id,
+            'timestamp': message.timestamp.isoformat(),
             'message': message.content,
-            'user': message.participation_id.user_id.username,
-            'message_type': message.type
+            'user': self.get_author(message.participation_id.user_id, generated),
+            'message_type': message.type,
+            'attachment': attachment_data(message)
         } for message in messages]
 
-        return messages_data
+        return messages_data, next_cursor
 
 
-    @sync_to_async
-    def get_user(self, username):
-        try:
-            user = User.objects.get(username=username)
-            return user
-        except User.DoesNotExist:
+    def get_author(self, user, generated=None):
+        if user is None:
             return None
-        
 
-    @sync_to_async
-    def get_user_dict(self, user):
-        user_dict = model_to_dict(user)
-        if user.avatar:
-            user_dict['avatar'] = user.avatar.url
+        author = self.authors.get(user.id)
+        if author is None:
+            author = model_to_dict(user, fields=AUTHOR_FIELDS)
+            author['avatar'] = derivative_url(user.avatar, 'sm', generated=generated)
+            self.authors[user.id] = author
 
-        return user_dict
+        return author
     
 
     @sync_to_async
-    def create_message(self, user, content):
-        return Message.objects.create(
-                participation_id=Participation.objects.get(room_id=self.room_id, user_id=user, time_out__isnull=True),
-                content=content,
-                type='text',
-            )
\ No newline at end of file
+    def get_participation(self, user_id):
+        participation = (
+            Participation.objects.select_related('user_id')
+            .filter(room_id=self.room_id, user_id=user_id, time_out__isnull=True)
+            .first()
+        )
+        if participation is not None:
+            # URL avatar đọc cache / storage: lấy sẵn trong thread này, không làm trên event loop
+            self.get_author(participation.user_id)
+        return participation
@@ -0,0 +1,173 @@
+"""
+Lưu file chia sẻ trong phòng chat.
+
+Upload được ghi ra file tạm theo từng chunk (TemporaryFileUploadHandler),
+đồng thời tính SHA-256 trên chính các chunk đó. File cùng nội dung chỉ
+được lưu một lần dưới chat-attachments/<2 ký tự đầu>/<sha256>; download
+đọc file theo chunk qua một async generator (dưới ASGI, iterator sync bị
+gom hết vào bộ nhớ trước khi gửi) và hỗ trợ header Range, nên bộ nhớ không
+phụ thuộc kích thước file.
+"""
+import hashlib
+import mimetypes
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.utils.datastructures import MultiValueDict
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, QueryDict, StreamingHttpResponse
+from django.utils.http import content_disposition_header, quote_etag
+
+from .models import SharedFile
+
+UPLOAD_DIR = 'chat-attachments'
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def chunk_size():
+    return getattr(settings, 'SHARED_FILE_CHUNK_SIZE', 64 * 1024)
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Luôn ghi upload ra file tạm (kể cả file nhỏ) và gắn `sha256` vào file
+    khi nhận xong. Upload vượt SHARED_FILE_MAX_SIZE bị dừng ngay khi biết
+    (theo Content-Length, hoặc khi số byte nhận được vượt quá) và
+    `too_large` được bật để view trả 413.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_size = getattr(settings, 'SHARED_FILE_MAX_SIZE', 100 * 1024 * 1024)
+        self.too_large = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > self.max_size:
+            # Không parse body: trả về dữ liệu rỗng
+            self.too_large = True
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return super().handle_raw_input(input_data, META, content_length, boundary, encoding)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_size:
+            self.too_large = True
+            raise StopUpload()
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+def content_hash(uploaded):
+    sha256 = getattr(uploaded, 'sha256', None)
+    if sha256 is None:
+        hasher = hashlib.sha256()
+        for chunk in uploaded.chunks(chunk_size()):
+            hasher.update(chunk)
+        sha256 = hasher.hexdigest()
+        uploaded.seek(0)
+    return sha256
+
+
+def content_type_of(uploaded):
+    if uploaded.content_type not in (None, '', 'application/octet-stream'):
+        return uploaded.content_type
+    return mimetypes.guess_type(uploaded.name)[0] or 'application/octet-stream'
+
+
+def store(uploaded):
+    """
+    Trả về (SharedFile, created). Nội dung đã có thì không ghi lại.
+    """
+    sha256 = content_hash(uploaded)
+    shared = SharedFile.objects.filter(sha256=sha256).first()
+    if shared is not None:
+        return shared, False
+
+    # File tạm được move (không copy) sang storage
+    path = default_storage.save(f'{UPLOAD_DIR}/{sha256[:2]}/{sha256}', uploaded)
+    try:
+        with transaction.atomic():
+            shared = SharedFile.objects.create(sha256=sha256, file=path, size=uploaded.size)
+    except IntegrityError:
+        # Request khác vừa lưu cùng nội dung
+        default_storage.delete(path)
+        return SharedFile.objects.get(sha256=sha256), False
+    return shared, True
+
+
+def parse_range(header, size):
+    """
+    (start, end) của header `Range: bytes=...` (chỉ hỗ trợ một khoảng), None
+    nếu không có hoặc không đọc được, ValueError nếu khoảng nằm ngoài file.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if first == '':
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+async def read_range(name, start, length):
+    # Chỉ đọc file, không đụng DB nên không cần thread của ORM
+    handle = await sync_to_async(default_storage.open, thread_sensitive=False)(name, 'rb')
+    try:
+        await sync_to_async(handle.seek, thread_sensitive=False)(start)
+        while length > 0:
+            chunk = await sync_to_async(handle.read, thread_sensitive=False)(min(chunk_size(), length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        await sync_to_async(handle.close, thread_sensitive=False)()
+
+
+def download_response(request, message):
+    shared = message.attachment
+    etag = quote_etag(shared.sha256)
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+
+    start, end = 0, shared.size - 1
+    status = 200
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range == etag:
+        try:
+            requested = parse_range(request.headers.get('Range'), shared.size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{shared.size}'
+            return response
+        if requested is not None:
+            (start, end), status = requested, 206
+
+    length = end - start + 1 if shared.size else 0
+    response = StreamingHttpResponse(read_range(shared.file.name, start, length), status=status,
+                                     content_type=message.attachment_type)
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Content-Disposition'] = content_disposition_header(False, message.attachment_name)
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{shared.size}'
+    return response
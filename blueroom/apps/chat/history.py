@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import Message
+
+
+def get_page_size(limit=None):
+    default = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+    maximum = getattr(settings, 'CHAT_HISTORY_MAX_PAGE_SIZE', 200)
+
+    if limit in (None, ''):
+        return default
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("'limit' must be an integer.")
+
+    return max(1, min(limit, maximum))
+
+
+def parse_cursor(timestamp, message_id):
+    """
+    Cursor (timestamp, id) của tin nhắn cũ nhất mà client đang có.
+    """
+    if timestamp in (None, '') and message_id in (None, ''):
+        return None
+
+    # Cursor từ socket là JSON tùy ý: chỉ nhận timestamp là chuỗi, id là số nguyên (hoặc chuỗi số)
+    parsed = None
+    if isinstance(timestamp, str) and isinstance(message_id, (int, str)) and not isinstance(message_id, bool):
+        try:
+            parsed = parse_datetime(timestamp)
+            message_id = int(message_id)
+        except ValueError:
+            parsed = None
+
+    if parsed is None:
+        raise ValueError("Invalid cursor. Expected an ISO timestamp and a message id.")
+
+    return parsed, message_id
+
+
+def make_cursor(message):
+    return {
+        'timestamp': message.timestamp.isoformat(),
+        'id': message.id,
+    }
+
+
+def get_history_page(room_id, before=None, limit=None):
+    limit = get_page_size(limit)
+
+    messages = Message.objects.filter(room_id=room_id)
+    if before:
+        timestamp, message_id = before
+        messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+
+    messages = messages.select_related('participation_id__user_id', 'attachment').order_by('-timestamp', '-id')
+    page = list(messages[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    page.reverse()
+
+    next_cursor = make_cursor(page[0]) if has_more and page else None
+    return page, next_cursor
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils.timezone import now
+
+from apps.accounts.models import User
+from apps.chat.models import Message
+from apps.chat.writer import MessageWriteBuffer
+from apps.rooms.models import Room, Participation
+
+
+class Command(BaseCommand):
+    help = "So sánh tốc độ ghi tin nhắn: INSERT từng tin (cũ) và write-behind theo lô. Chạy trên test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--senders', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--flush-interval', type=float, default=0.05)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            room, participations = self.seed(options['senders'])
+
+            direct = asyncio.run(self.run_direct(room, participations, options['messages']))
+            buffered = asyncio.run(self.run_buffered(room, participations, options))
+
+            self.stdout.write(f"messages: {options['messages']}  senders: {options['senders']}")
+            self.stdout.write(f"direct INSERT   : {options['messages'] / direct:10.0f} msg/s  ({direct:.3f}s)")
+            self.stdout.write(f"write-behind    : {options['messages'] / buffered:10.0f} msg/s  ({buffered:.3f}s)")
+            self.stdout.write(f"speedup         : {direct / buffered:10.1f}x")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def seed(self, senders):
+        users = [
+            User.objects.create(username=f'bench{i}', email=f'bench{i}@example.com', password='x')
+            for i in range(senders)
+        ]
+        room = Room.objects.create(title='bench', created_by=users[0])
+        participations = [
+            Participation.objects.create(user_id=user, room_id=room, time_in=now())
+            for user in users
+        ]
+        return room, participations
+
+    async def run_direct(self, room, participations, total):
+        @database_sync_to_async
+        def create_message(user, content):
+            return Message.objects.create(
+                participation_id=Participation.objects.get(room_id=room.id, user_id=user, time_out__isnull=True),
+                room_id=room,
+                content=content,
+                type='text',
+            )
+
+        started = time.perf_counter()
+        for i in range(total):
+            await create_message(participations[i % len(participations)].user_id, f'direct {i}')
+        return time.perf_counter() - started
+
+    async def run_buffered(self, room, participations, options):
+        writer = MessageWriteBuffer(
+            batch_size=options['batch_size'],
+            flush_interval=options['flush_interval'],
+        )
+
+        @database_sync_to_async
+        def build_message(user, content):
+            participation = Participation.objects.get(room_id=room.id, user_id=user, time_out__isnull=True)
+            return Message(participation_id=participation, room_id=room, content=content, type='text')
+
+        started = time.perf_counter()
+        for i in range(options['messages']):
+            user = participations[i % len(participations)].user_id
+            await writer.put(await build_message(user, f'buffered {i}'))
+        await writer.flush()
+        return time.perf_counter() - started
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_room_id(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    Participation = apps.get_model('rooms', 'Participation')
+
+    Message.objects.filter(room_id__isnull=True).update(
+        room_id=Subquery(
+            Participation.objects.filter(id=OuterRef('participation_id')).values('room_id')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+        ('rooms', '0005_participation_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='room_id',
+            field=models.ForeignKey(blank=True, db_column='room_id', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='rooms.room'),
+        ),
+        migrations.RunPython(fill_room_id, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room_id', 'timestamp', 'id'], name='msg_room_timeline_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message_room_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SharedFile',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(max_length=255, upload_to='chat-attachments/')),
+                ('name', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('content_type', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'shared_files',
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='attachment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='chat.sharedfile'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.3 on 2026-10-18 21:12
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_metadata(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    SharedFile = apps.get_model('chat', 'SharedFile')
+
+    shared = SharedFile.objects.filter(id=OuterRef('attachment_id'))
+    Message.objects.filter(attachment__isnull=False).update(
+        attachment_name=Subquery(shared.values('name')[:1]),
+        attachment_type=Subquery(shared.values('content_type')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_shared_files'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='attachment_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='attachment_type',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.RunPython(copy_metadata, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='sharedfile',
+            name='name',
+        ),
+        migrations.RemoveField(
+            model_name='sharedfile',
+            name='content_type',
+        ),
+    ]
@@ -1,23 +1,48 @@
 from django.db import models
 
-from apps.rooms.models import Participation
+from apps.rooms.models import Participation, Room
 
 
 # Create your models here.
 
+class SharedFile(models.Model):
+    # Nội dung được lưu một lần theo SHA-256, mọi tin nhắn chia sẻ cùng file trỏ tới một dòng.
+    # Tên và kiểu file là của từng lần chia sẻ nên nằm trên Message.
+    id = models.BigAutoField(primary_key=True)
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='chat-attachments/', max_length=255)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'shared_files'
+
+    def __str__(self):
+        return self.sha256
+
+
 class Message(models.Model):
     id = models.BigAutoField(primary_key=True)
     participation_id = models.ForeignKey(Participation, on_delete=models.CASCADE, db_column='participation_id', related_name='messages', default=1)
+    # Trùng với participation_id.room_id, lưu thẳng để lấy lịch sử phòng không cần join
+    room_id = models.ForeignKey(Room, on_delete=models.CASCADE, db_column='room_id', related_name='messages', null=True, blank=True)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     type = models.CharField(
         max_length=10, 
         choices=[('text', 'Text'), ('file', 'File'), ('link', 'Link')]
     )
+    attachment = models.ForeignKey(SharedFile, on_delete=models.PROTECT, related_name='messages', null=True, blank=True)
+    attachment_name = models.CharField(max_length=255, blank=True, default='')
+    attachment_type = models.CharField(max_length=100, blank=True, default='')
 
     class Meta:
         db_table = 'messages'
         # managed = False
 
+        indexes = [
+            models.Index(fields=['room_id', 'timestamp', 'id'], name='msg_room_timeline_idx'),
+        ]
+
     def __str__(self):
         return f'Message {self.message_id} in participation {self.participation_id}'
\ No newline at end of file
@@ -1,14 +1,32 @@
+from django.urls import reverse
 from rest_framework import serializers
 
 from .models import Message
 
 
+def attachment_data(message, request=None):
+    if message.attachment is None:
+        return None
+
+    url = reverse('shared_file', kwargs={'room_id': message.room_id_id, 'message_id': message.id})
+    return {
+        "name": message.attachment_name,
+        "size": message.attachment.size,
+        "content_type": message.attachment_type,
+        "url": request.build_absolute_uri(url) if request else url
+    }
+
+
 class MessageSerializer(serializers.ModelSerializer):
     user = serializers.SerializerMethodField()
+    attachment = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
-        fields = ['id', 'user', 'content', 'timestamp', 'type']
+        fields = ['id', 'user', 'content', 'timestamp', 'type', 'attachment']
 
     def get_user(self, obj):
-        return obj.participation_id.user_id.username
\ No newline at end of file
+        return obj.participation_id.user_id.username
+
+    def get_attachment(self, obj):
+        return attachment_data(obj, self.context.get('request'))
\ No newline at end of file
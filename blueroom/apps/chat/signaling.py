@@ -0,0 +1,96 @@
+"""
+Tín hiệu WebRTC (offer / answer / candidate) gửi thẳng tới channel của peer
+đích thay vì group_send cho cả phòng.
+
+Mỗi socket trong phòng đăng ký peer_id -> channel_name trong cache "shared"
+để mọi worker tra được. Candidate gửi tới cùng một peer được gom trong
+SIGNALING_CANDIDATE_WINDOW giây thành một frame "candidates".
+"""
+import asyncio
+import json
+
+import msgpack
+from django.conf import settings
+from django.core.cache import caches
+
+SIGNAL_TYPES = ('offer', 'answer', 'candidate')
+
+
+def peer_key(room_id, peer_id):
+    return f'signaling:{room_id}:{peer_id}'
+
+
+async def register_peer(room_id, peer_id, channel_name):
+    await caches['shared'].aset(peer_key(room_id, peer_id), channel_name, timeout=None)
+
+
+async def unregister_peer(room_id, peer_id, channel_name):
+    # Cùng user mở socket mới thì key đã trỏ sang channel khác, không xóa
+    key = peer_key(room_id, peer_id)
+    if await caches['shared'].aget(key) == channel_name:
+        await caches['shared'].adelete(key)
+
+
+async def peer_channel(room_id, peer_id):
+    return await caches['shared'].aget(peer_key(room_id, peer_id))
+
+
+def signal_event(payload, encode=False):
+    """
+    Event của channel layer mang một frame tín hiệu. Khi broadcast cho cả
+    group, encode=True để JSON chỉ được tạo một lần ở phía gửi.
+    """
+    event = {'type': 'signal.message', 'payload': payload}
+    if encode:
+        event['text'] = json.dumps(payload)
+    return event
+
+
+def decode_frame(text_data=None, bytes_data=None):
+    if bytes_data is not None:
+        return msgpack.unpackb(bytes_data)
+    return json.loads(text_data)
+
+
+def encode_frame(payload, binary, text=None):
+    if binary:
+        return {'bytes_data': msgpack.packb(payload)}
+    return {'text_data': text or json.dumps(payload)}
+
+
+class CandidateBatcher:
+    """
+    Gom candidate theo peer đích; sau `window` giây gọi send(target, candidates)
+    một lần cho cả lô.
+    """
+
+    def __init__(self, send, window=None):
+        self.send = send
+        self.window = window if window is not None else getattr(settings, 'SIGNALING_CANDIDATE_WINDOW', 0.05)
+        self._pending = {}
+        self._tasks = {}
+
+    async def add(self, target, candidate):
+        self._pending.setdefault(target, []).append(candidate)
+        if self.window <= 0:
+            await self.flush(target)
+        elif target not in self._tasks:
+            self._tasks[target] = asyncio.create_task(self._flush_later(target))
+
+    async def _flush_later(self, target):
+        await asyncio.sleep(self.window)
+        await self.flush(target)
+
+    async def flush(self, target):
+        task = self._tasks.pop(target, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        candidates = self._pending.pop(target, None)
+        if candidates:
+            await self.send(target, candidates)
+
+    def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._pending.clear()
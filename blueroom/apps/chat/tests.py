@@ -1,3 +1,627 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.db import OperationalError
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.urls import path
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from apps.rooms import presence
+from apps.rooms.models import Room, Participation
+from apps.rooms.tests import analyze
+from blueroom.channel_layers import build_channel_layers
+from blueroom.metrics import registry
+from .consumers import ChatConsumer
+from .files import HashingFileUploadHandler
+from .models import Message, SharedFile
+from .writer import MessageWriteBuffer, message_writer
+
+try:
+    from fakeredis import TcpFakeServer
+except ImportError:
+    TcpFakeServer = None
+
+
+def make_layer(config):
+    config = config['default']
+    return import_string(config['BACKEND'])(**config['CONFIG'])
+
+
+@unittest.skipUnless(TcpFakeServer, "fakeredis is not installed")
+class RedisChannelLayerTests(SimpleTestCase):
+    """
+    Hai instance channel layer đóng vai hai worker Daphne, dùng chung hai
+    shard Redis giả lập chạy trong process.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servers = []
+        for _ in range(2):
+            server = TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            cls.servers.append(server)
+        cls.hosts = [f'redis://127.0.0.1:{server.server_address[1]}/0' for server in cls.servers]
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+        super().tearDownClass()
+
+    def test_groups_are_sharded_across_hosts(self):
+        layer = make_layer(build_channel_layers('redis', self.hosts))
+
+        shards = {layer.consistent_hash(f'roomchat_{room_id}') for room_id in range(50)}
+        self.assertEqual(shards, {0, 1})
+
+    def test_group_send_reaches_every_worker(self):
+        config = build_channel_layers('redis', self.hosts, capacity=50, expiry=5)
+
+        async def run():
+            worker_a, worker_b = make_layer(config), make_layer(config)
+            channel_a = await worker_a.new_channel()
+            channel_b = await worker_b.new_channel()
+            for room_id in range(4):
+                await worker_a.group_add(f'roomchat_{room_id}', channel_a)
+                await worker_b.group_add(f'roomchat_{room_id}', channel_b)
+
+            received = []
+            for room_id in range(4):
+                await worker_a.group_send(f'roomchat_{room_id}', {'type': 'chat_message', 'room': room_id})
+                received.append(await asyncio.wait_for(worker_a.receive(channel_a), 5))
+                received.append(await asyncio.wait_for(worker_b.receive(channel_b), 5))
+
+            await worker_a.flush()
+            await worker_b.flush()
+            return received
+
+        received = asyncio.run(run())
+        self.assertEqual([message['room'] for message in received], [0, 0, 1, 1, 2, 2, 3, 3])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            build_channel_layers('kafka')
+
+
+class MessageIndexTests(TestCase):
+    """
+    Lịch sử chat lọc theo room_id (denormalized) và sắp xếp theo
+    (timestamp, id) phải đọc thẳng từ msg_room_timeline_idx, không sort.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [
+            User.objects.create(username=f'user{i}', email=f'user{i}@example.com', password='x') for i in range(20)
+        ]
+        cls.rooms = [Room.objects.create(title=f'room {i}', created_by=users[i]) for i in range(20)]
+        participations = [
+            Participation.objects.create(user_id=users[i], room_id=cls.rooms[i], time_in=now()) for i in range(20)
+        ]
+        Message.objects.bulk_create([
+            Message(participation_id=participations[i % 20], room_id=cls.rooms[i % 20], content='hi', type='text')
+            for i in range(10000)
+        ])
+        analyze('messages')
+
+    def test_history_page_uses_timeline_index(self):
+        queryset = Message.objects.filter(room_id=self.rooms[3]).order_by('-timestamp', '-id')[:51]
+        plan = queryset.explain()
+
+        self.assertIn('msg_room_timeline_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan.upper())
+        self.assertNotIn('FILESORT', plan.upper())
+
+
+@override_settings(CHAT_HISTORY_PAGE_SIZE=2, CHAT_HISTORY_MAX_PAGE_SIZE=3)
+class MessageHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', email='user@example.com', password='x')
+        cls.room = Room.objects.create(title='room', created_by=cls.user)
+        participation = Participation.objects.create(user_id=cls.user, room_id=cls.room, time_in=now())
+        cls.messages = Message.objects.bulk_create([
+            Message(participation_id=participation, room_id=cls.room, content=f'm{i}', type='text') for i in range(5)
+        ])
+        # m1..m3 cùng timestamp: thứ tự và cursor phải dựa vào id
+        same = now()
+        Message.objects.filter(id__in=[message.id for message in cls.messages[1:4]]).update(timestamp=same)
+        Message.objects.filter(id=cls.messages[0].id).update(timestamp=same - timedelta(seconds=1))
+        Message.objects.filter(id=cls.messages[4].id).update(timestamp=same + timedelta(seconds=1))
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/chat/{self.room.id}/messages/'
+
+    def page(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [message['content'] for message in response.data['messages']], response.data['next_cursor']
+
+    def test_pages_across_equal_timestamps(self):
+        contents, cursor = self.page()
+        self.assertEqual(contents, ['m3', 'm4'])
+
+        pages = [contents]
+        while cursor is not None:
+            contents, cursor = self.page(before_timestamp=cursor['timestamp'], before_id=cursor['id'])
+            pages.append(contents)
+        self.assertEqual(pages, [['m3', 'm4'], ['m1', 'm2'], ['m0']])
+
+    def test_last_page_has_no_cursor(self):
+        contents, cursor = self.page(limit=3)
+        self.assertEqual((contents, cursor['id']), (['m2', 'm3', 'm4'], self.messages[2].id))
+        self.assertEqual(self.page(limit=3, before_timestamp=cursor['timestamp'], before_id=cursor['id']),
+                         (['m0', 'm1'], None))
+
+    def test_limit_is_clamped(self):
+        self.assertEqual(len(self.page(limit=1000)[0]), 3)
+        self.assertEqual(len(self.page(limit=0)[0]), 1)
+        self.assertEqual(self.client.get(self.url, {'limit': 'all'}).status_code, 400)
+
+    def test_invalid_cursor(self):
+        for params in ({'before_timestamp': 'yesterday', 'before_id': 1},
+                       {'before_timestamp': now().isoformat()},
+                       {'before_id': 'x'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.data)
+
+    async def test_malformed_socket_cursor_keeps_the_socket_open(self):
+        communicator = WebsocketCommunicator(
+            URLRouter([path('ws/room/<int:room_id>/', ChatConsumer.as_asgi())]),
+            f'/ws/room/{self.room.id}/'
+        )
+        await communicator.connect()
+        initial = await communicator.receive_json_from()
+
+        for before in ('yesterday', [1, 2], 5, {'timestamp': 5, 'id': 1},
+                       {'timestamp': ['x'], 'id': 1}, {'timestamp': initial['next_cursor']['timestamp'], 'id': {'a': 1}},
+                       {'timestamp': initial['next_cursor']['timestamp'], 'id': True}, {'timestamp': '2024-13-45T00:00:00'}):
+            await communicator.send_json_to({'type': 'load_older', 'before': before})
+            frame = await communicator.receive_json_from()
+            self.assertEqual(frame['type'], 'error', before)
+
+        await communicator.send_json_to({'type': 'load_older', 'before': initial['next_cursor'], 'limit': 2})
+        frame = await communicator.receive_json_from()
+        self.assertEqual([message['message'] for message in frame['messages']], ['m1', 'm2'])
+        await communicator.disconnect()
+
+
+class HistoryQueryCountTests(TestCase):
+    """
+    Lịch sử (REST và khi socket connect) đọc tác giả bằng join: số query
+    không tăng theo số tin nhắn hay số người gửi.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create(username=f'user{i}', email=f'user{i}@example.com', password='x', avatar=f'avatars/user{i}.jpg')
+            for i in range(3)
+        ]
+        cls.room = Room.objects.create(title='room', created_by=cls.users[0], members=3)
+        participations = [Participation.objects.create(user_id=user, room_id=cls.room, time_in=now()) for user in cls.users]
+        Message.objects.bulk_create([
+            Message(participation_id=participations[i % 3], room_id=cls.room, content=f'm{i}', type='text') for i in range(9)
+        ])
+
+    def setUp(self):
+        caches['shared'].clear()
+
+    def test_rest_history(self):
+        client = APIClient()
+        client.force_authenticate(self.users[1])
+        for limit in (1, 9):
+            with self.assertNumQueries(2):
+                response = client.get(f'/api/chat/{self.room.id}/messages/', {'limit': limit})
+            self.assertEqual(len(response.data['messages']), limit)
+
+    async def test_socket_connect(self):
+        communicator = WebsocketCommunicator(
+            URLRouter([path('ws/room/<int:room_id>/', ChatConsumer.as_asgi())]),
+            f'/ws/room/{self.room.id}/'
+        )
+        communicator.scope['user'] = self.users[1]
+        # Consumer chạy query trong thread riêng: đếm bằng metrics của từng message socket
+        registry.reset()
+        await communicator.connect()
+        initial = await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'message', 'content': 'hi'})
+        frame = await communicator.receive_json_from()
+
+        metrics = registry.snapshot()
+        # participation của socket + một trang lịch sử; gửi tin không query
+        self.assertEqual(metrics['ws ChatConsumer.websocket.connect']['max_queries'], 2)
+        self.assertEqual(metrics['ws ChatConsumer.websocket.receive']['max_queries'], 0)
+        self.assertEqual({message['user']['username'] for message in initial['messages']}, {'user0', 'user1', 'user2'})
+        self.assertEqual(frame['user']['avatar'], initial['messages'][1]['user']['avatar'])
+        await communicator.disconnect()
+
+
+class MessagesConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', email='user@example.com', password='x')
+        cls.room = Room.objects.create(title='room', created_by=cls.user)
+        Participation.objects.create(user_id=cls.user, room_id=cls.room, time_in=now())
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/chat/{self.room.id}/messages/'
+
+    def test_not_modified_until_new_message(self):
+        response = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        self.client.post(f'/api/chat/{self.room.id}/send-messages/', {'message': 'hello'})
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.data['messages'][0]['content'], 'hello')
+
+
+class MessageWriteBufferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', email='user@example.com', password='x')
+        cls.room = Room.objects.create(title='room', created_by=cls.user)
+        cls.participation = Participation.objects.create(user_id=cls.user, room_id=cls.room, time_in=now())
+
+    def message(self, content):
+        return Message(participation_id=self.participation, room_id=self.room, content=content, type='text')
+
+    def writer(self, **kwargs):
+        writer = MessageWriteBuffer(**{'batch_size': 100, 'flush_interval': 60, 'max_pending': 100, **kwargs})
+        self.addCleanup(lambda: writer._task and writer._task.cancel())
+        return writer
+
+    async def contents(self):
+        return [message async for message in Message.objects.order_by('id').values_list('content', flat=True)]
+
+    async def test_full_batch_is_written_without_waiting(self):
+        writer = self.writer(batch_size=3)
+        for i in range(3):
+            await writer.put(self.message(f'm{i}'))
+        await asyncio.sleep(0.05)
+        self.assertEqual(await self.contents(), ['m0', 'm1', 'm2'])
+        self.assertEqual(len(writer), 0)
+
+    async def test_backpressure_flushes_before_accepting_more(self):
+        writer = self.writer(max_pending=2)
+        await writer.put(self.message('m0'))
+        await writer.put(self.message('m1'))
+        self.assertEqual(await self.contents(), [])
+
+        await writer.put(self.message('m2'))
+        self.assertEqual(await self.contents(), ['m0', 'm1'])
+        self.assertEqual(len(writer), 1)
+
+    async def test_bad_row_does_not_drop_the_batch(self):
+        writer = self.writer()
+        for content in ('good 1', None, 'good 2'):
+            await writer.put(self.message(content))
+        with self.assertLogs('apps.chat.writer', 'WARNING'):
+            await writer.flush()
+        self.assertEqual(await self.contents(), ['good 1', 'good 2'])
+        self.assertEqual(len(writer), 0)
+
+    async def test_transient_error_requeues_the_batch(self):
+        writer = self.writer()
+        await writer.put(self.message('m0'))
+        await writer.put(self.message('m1'))
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=OperationalError('locked')), \
+                mock.patch.object(Message, 'save', side_effect=OperationalError('locked')), \
+                self.assertLogs('apps.chat.writer', 'WARNING'):
+            await writer.flush()
+        self.assertEqual(await self.contents(), [])
+        self.assertEqual(len(writer), 2)
+
+        await writer.flush()
+        self.assertEqual(await self.contents(), ['m0', 'm1'])
+
+    async def test_socket_flushes_on_disconnect(self):
+        communicator = WebsocketCommunicator(
+            URLRouter([path('ws/room/<int:room_id>/', ChatConsumer.as_asgi())]),
+            f'/ws/room/{self.room.id}/'
+        )
+        communicator.scope['user'] = self.user
+        await communicator.connect()
+        await communicator.receive_from()
+
+        with mock.patch.object(message_writer, 'flush_interval', 60):
+            await communicator.send_json_to({'type': 'message'})
+            self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+            await communicator.send_json_to({'type': 'message', 'content': 'hello'})
+            self.assertEqual((await communicator.receive_json_from())['message'], 'hello')
+            self.assertEqual(await self.contents(), [])
+
+            await communicator.disconnect()
+        self.assertEqual(await self.contents(), ['hello'])
+
+
+class ChatSenderTests(TestCase):
+    """
+    Người gửi là user của socket; participation đã cache bị bỏ khi rời phòng,
+    bị chặn hoặc bị tắt quyền chat.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', email='owner@example.com', password='x')
+        cls.member = User.objects.create(username='member', email='member@example.com', password='x', is_busy=True)
+        cls.room = Room.objects.create(title='room', created_by=cls.owner, members=2)
+        for user in (cls.owner, cls.member):
+            Participation.objects.create(user_id=user, room_id=cls.room, time_in=now())
+
+    def setUp(self):
+        caches['shared'].clear()
+
+    async def connect(self, user=None):
+        communicator = WebsocketCommunicator(
+            URLRouter([path('ws/room/<int:room_id>/', ChatConsumer.as_asgi())]),
+            f'/ws/room/{self.room.id}/'
+        )
+        if user is not None:
+            communicator.scope['user'] = user
+        await communicator.connect()
+        await communicator.receive_from()
+        return communicator
+
+    async def say(self, communicator, content, **extra):
+        await communicator.send_json_to({'type': 'message', 'content': content, **extra})
+        return await communicator.receive_json_from()
+
+    async def as_owner(self, method, url, data):
+        def call():
+            client = APIClient()
+            client.force_authenticate(self.owner)
+            with self.captureOnCommitCallbacks(execute=True):
+                return getattr(client, method)(url, data)
+        response = await sync_to_async(call)()
+        self.assertEqual(response.status_code, 200)
+        # Để consumer xử lý event participation.changed trước frame tiếp theo
+        await asyncio.sleep(0.05)
+
+    async def test_username_field_is_ignored(self):
+        anonymous = await self.connect()
+        frame = await self.say(anonymous, 'hi', user='member')
+        self.assertEqual(frame['type'], 'error')
+        self.assertNotIn(self.member.id, presence.heartbeats(self.room.id))
+        await anonymous.disconnect()
+
+    async def test_chat_allow_revoked(self):
+        member = await self.connect(self.member)
+        self.assertEqual((await self.say(member, 'hi'))['user']['username'], 'member')
+
+        await self.as_owner('post', f'/api/rooms/room/{self.room.id}/edit-permissions/',
+                            {'user_id': self.member.id, 'chat_allow': False})
+        self.assertEqual(await self.say(member, 'hi'), {
+            'type': 'error', 'message': 'You are not allowed to chat in this room'
+        })
+        await member.disconnect()
+
+    async def test_blocked(self):
+        member = await self.connect(self.member)
+        await self.say(member, 'hi')
+
+        await self.as_owner('post', f'/api/rooms/{self.room.id}/block/', {'user_id': self.member.id})
+        self.assertEqual(await self.say(member, 'hi'), {
+            'type': 'error', 'message': 'You are not a participant of this room'
+        })
+        await member.disconnect()
+
+    async def test_left(self):
+        member = await self.connect(self.member)
+        await self.say(member, 'hi')
+
+        def leave():
+            client = APIClient()
+            client.force_authenticate(self.member)
+            return client.post(f'/api/rooms/room/{self.room.id}/leave/')
+        self.assertEqual((await sync_to_async(leave)()).status_code, 200)
+        await asyncio.sleep(0.05)
+        self.assertEqual(await self.say(member, 'hi'), {
+            'type': 'error', 'message': 'You are not a participant of this room'
+        })
+        await member.disconnect()
+
+
+@override_settings(SIGNALING_CANDIDATE_WINDOW=0.05)
+class SignalingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', email='user@example.com', password='x')
+        cls.room = Room.objects.create(title='room', created_by=cls.user)
+
+    def setUp(self):
+        caches['shared'].clear()
+
+    async def connect(self, query=''):
+        communicator = WebsocketCommunicator(
+            URLRouter([path('ws/room/<int:room_id>/', ChatConsumer.as_asgi())]),
+            f'/ws/room/{self.room.id}/{query}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        communicator.peer = json.loads(await communicator.receive_from())['peer']
+        return communicator
+
+    async def test_signals_reach_only_the_target_peer(self):
+        caller = await self.connect()
+        callee = await self.connect()
+        other = await self.connect('?format=msgpack')
+        self.assertEqual(json.loads(await caller.receive_from())['type'], 'peer_joined')
+        self.assertEqual(await callee.receive_json_from(), {'type': 'peer_joined', 'peer': other.peer})
+        await caller.receive_from()
+
+        await caller.send_json_to({'type': 'offer', 'target': callee.peer, 'offer': {'sdp': 'o'}})
+        for i in range(3):
+            await caller.send_json_to({'type': 'candidate', 'target': callee.peer, 'candidate': f'c{i}'})
+
+        self.assertEqual(await callee.receive_json_from(), {'type': 'offer', 'from': caller.peer, 'offer': {'sdp': 'o'}})
+        self.assertEqual(await callee.receive_json_from(), {
+            'type': 'candidates', 'from': caller.peer, 'candidates': ['c0', 'c1', 'c2']
+        })
+        self.assertTrue(await other.receive_nothing(0.1))
+
+        await callee.send_to(bytes_data=msgpack.packb({'type': 'answer', 'target': other.peer, 'answer': 'a'}))
+        frame = await other.receive_output()
+        self.assertEqual(msgpack.unpackb(frame['bytes']), {'type': 'answer', 'from': callee.peer, 'answer': 'a'})
+
+        await caller.send_json_to({'type': 'offer', 'target': 'missing', 'offer': {}})
+        self.assertEqual((await caller.receive_json_from())['type'], 'error')
+
+        for communicator in (caller, callee, other):
+            await communicator.disconnect()
+
+
+@override_settings(PRESENCE_HEARTBEAT_INTERVAL=0.05, PRESENCE_REAP_INTERVAL=0)
+class PresenceSocketTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', email='user@example.com', password='x')
+        cls.room = Room.objects.create(title='room', created_by=cls.user)
+        Participation.objects.create(user_id=cls.user, room_id=cls.room, time_in=now())
+
+    def setUp(self):
+        caches['shared'].clear()
+
+    async def test_socket_heartbeats_until_disconnect(self):
+        communicator = WebsocketCommunicator(
+            URLRouter([path('ws/room/<int:room_id>/', ChatConsumer.as_asgi())]),
+            f'/ws/room/{self.room.id}/'
+        )
+        communicator.scope['user'] = self.user
+        await communicator.connect()
+        await communicator.receive_from()
+
+        connected_at = presence.heartbeats(self.room.id)[self.user.id]
+        await asyncio.sleep(0.2)
+        self.assertGreater(presence.heartbeats(self.room.id)[self.user.id], connected_at)
+
+        await communicator.disconnect()
+        last_seen = presence.heartbeats(self.room.id)[self.user.id]
+        await asyncio.sleep(0.2)
+        self.assertEqual(presence.heartbeats(self.room.id)[self.user.id], last_seen)
+
+
+class SharedFileTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', email='user@example.com', password='x')
+        cls.rooms = [Room.objects.create(title=f'room {i}', created_by=cls.user) for i in range(2)]
+        for room in cls.rooms:
+            Participation.objects.create(user_id=cls.user, room_id=room, time_in=now())
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.media_root = media_root
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.content = b'lecture notes ' * 1000
+
+    def share(self, room, name='bai-giang.pdf', content_type='application/pdf'):
+        upload = SimpleUploadedFile(name, self.content, content_type=content_type)
+        response = self.client.post(f'/api/chat/{room.id}/share/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def test_same_content_is_stored_once(self):
+        first = self.share(self.rooms[0])
+        second = self.share(self.rooms[1], 'notes.txt', 'application/octet-stream')
+
+        shared = SharedFile.objects.get()
+        self.assertEqual(shared.sha256, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(Message.objects.filter(attachment=shared).count(), 2)
+        self.assertEqual(first['attachment']['size'], len(self.content))
+        self.assertNotEqual(first['attachment']['url'], second['attachment']['url'])
+        # Tên và kiểu file là của từng lần chia sẻ, không phải của người upload đầu tiên
+        self.assertEqual((first['attachment']['name'], first['attachment']['content_type']),
+                         ('bai-giang.pdf', 'application/pdf'))
+        self.assertEqual((second['attachment']['name'], second['attachment']['content_type']),
+                         ('notes.txt', 'text/plain'))
+        response = self.client.get(second['attachment']['url'])
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="notes.txt"')
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        stored = [name for _, _, names in os.walk(self.media_root) for name in names]
+        self.assertEqual(stored, [shared.sha256])
+
+    def test_oversized_upload_is_rejected_while_streaming(self):
+        with override_settings(SHARED_FILE_MAX_SIZE=len(self.content) - 1):
+            upload = SimpleUploadedFile('big.pdf', self.content, content_type='application/pdf')
+            response = self.client.post(f'/api/chat/{self.rooms[0].id}/share/', {'file': upload}, format='multipart')
+            self.assertEqual(response.status_code, 413)
+
+            # Content-Length không đủ để biết trước: dừng ở chunk vượt giới hạn
+            handler = HashingFileUploadHandler()
+            handler.new_file('file', 'big.pdf', 'application/pdf', None)
+            self.addCleanup(handler.file.close)
+            handler.receive_data_chunk(self.content[:100], 0)
+            with self.assertRaises(StopUpload):
+                handler.receive_data_chunk(self.content[100:], 100)
+            self.assertTrue(handler.too_large)
+        self.assertFalse(Message.objects.exists())
+        self.assertEqual([name for _, _, names in os.walk(self.media_root) for name in names], [])
+
+    async def test_download_supports_ranges(self):
+        url = (await sync_to_async(self.share)(self.rooms[0]))['attachment']['url']
+        # Client async: nội dung được đọc như khi chạy dưới Daphne
+        client = AsyncClient()
+        headers = {'Authorization': f'Token {self.token.key}'}
+
+        async def read(response):
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        response = await client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual(await read(response), self.content)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+        response = await client.get(url, headers={**headers, 'Range': 'bytes=2-9'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 2-9/{len(self.content)}')
+        self.assertEqual(await read(response), self.content[2:10])
+
+        response = await client.get(url, headers={**headers, 'Range': 'bytes=-4'})
+        self.assertEqual(await read(response), self.content[-4:])
+        response = await client.get(url, headers={**headers, 'Range': f'bytes={len(self.content)}-'})
+        self.assertEqual(response.status_code, 416)
+        etag = (await client.get(url, headers=headers))['ETag']
+        self.assertEqual((await client.get(url, headers={**headers, 'If-None-Match': etag})).status_code, 304)
+
+        outsider = await User.objects.acreate(username='outsider', email='outsider@example.com', password='x')
+        outsider_token = await Token.objects.acreate(user=outsider)
+        response = await client.get(url, headers={'Authorization': f'Token {outsider_token.key}'})
+        self.assertEqual(response.status_code, 404)
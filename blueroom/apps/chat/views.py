@@ -2,11 +2,17 @@ from rest_framework import status, serializers
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.utils.decorators import method_decorator
 
 from .models import Message, Participation
 from .serializers import MessageSerializer
+from .files import HashingFileUploadHandler, content_type_of, download_response, store
+from .history import get_history_page, parse_cursor
 from apps.rooms.serializers import FileShareSerializer
 from apps.rooms.models import Room
+from apps.rooms import stats
+from apps.rooms.invalidation import bump, messages_namespace
+from blueroom.caching import conditional
 
 # Create your views here.
 
@@ -25,30 +31,51 @@ class SendMessageView(APIView):
 
         message = Message(
             participation_id=participation,
+            room_id=room,
             content=request.data.get('message'),
             type='text',
         )
         message.save()
-        
+        stats.record(messages_sent=1)
+        bump(messages_namespace(room.id))
+
         return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
     
 
 class GetMessagesView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @method_decorator(conditional(lambda request, room_id: [messages_namespace(room_id)]))
     def get(self, request, room_id):
         try:
             room = Room.objects.get(id=room_id)
         except Room.DoesNotExist:
             return Response({'error': 'Room not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        messages = Message.objects.filter(participation_id__room_id=room.id).order_by('timestamp')
-        return Response(MessageSerializer(messages, many=True).data)
+        try:
+            before = parse_cursor(
+                request.query_params.get('before_timestamp'),
+                request.query_params.get('before_id'),
+            )
+            messages, next_cursor = get_history_page(room.id, before, request.query_params.get('limit'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'messages': MessageSerializer(messages, many=True, context={'request': request}).data,
+            'next_cursor': next_cursor,
+        })
     
 
 class ShareFileView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def initialize_request(self, request, *args, **kwargs):
+        # Phải gắn trước khi body được parse (kể cả lúc kiểm tra CSRF)
+        self.upload_handler = HashingFileUploadHandler(request)
+        request.upload_handlers = [self.upload_handler]
+        return super().initialize_request(request, *args, **kwargs)
+
     def post(self, request, room_id):
         try:
             room = Room.objects.get(id=room_id)
@@ -59,14 +86,39 @@ class ShareFileView(APIView):
             return Response({'error': 'Participation not found'}, status=status.HTTP_404_NOT_FOUND)
 
         file_serializer = FileShareSerializer(data=request.data)
+        if self.upload_handler.too_large:
+            return Response({'error': f'File is larger than {self.upload_handler.max_size} bytes'},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
         if file_serializer.is_valid():
             file = file_serializer.validated_data['file']
+            shared, _ = store(file)
             message = Message(
                 participation_id=participation,
+                room_id=room,
                 content=f'File shared: {file.name}',
                 type='file',
+                attachment=shared,
+                attachment_name=file.name[:255],
+                attachment_type=content_type_of(file),
             )
             message.save()
-            
-            return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
-        return Response(file_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            stats.record(messages_sent=1)
+            bump(messages_namespace(room.id))
+
+            return Response(MessageSerializer(message, context={'request': request}).data, status=status.HTTP_201_CREATED)
+        return Response(file_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class SharedFileView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, room_id, message_id):
+        if not Participation.objects.filter(room_id=room_id, user_id=request.user).exists():
+            return Response({'error': 'Participation not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            message = Message.objects.select_related('attachment').get(
+                id=message_id, room_id=room_id, attachment__isnull=False
+            )
+        except Message.DoesNotExist:
+            return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        return download_response(request, message)
@@ -0,0 +1,140 @@
+import asyncio
+import atexit
+import logging
+import threading
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, DataError, IntegrityError, transaction
+
+from .models import Message
+from apps.rooms import stats
+from apps.rooms.invalidation import bump, messages_namespace
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteBuffer:
+    """
+    Write-behind cho tin nhắn chat: consumer broadcast ngay, còn việc ghi DB
+    được gom lại và bulk_create theo lô (đủ batch_size hoặc sau flush_interval).
+
+    Khi số tin đang chờ đạt max_pending, put() tự flush trước khi nhận thêm
+    (backpressure) để bộ nhớ không tăng vô hạn khi DB chậm.
+
+    Lô bị lỗi được ghi lại từng dòng: dòng sai dữ liệu bị bỏ (và log), còn
+    lỗi tạm thời của DB thì phần chưa ghi được đưa lại vào đầu hàng đợi.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, max_pending=None):
+        self.batch_size = batch_size or getattr(settings, 'CHAT_WRITE_BATCH_SIZE', 100)
+        self.flush_interval = flush_interval or getattr(settings, 'CHAT_WRITE_FLUSH_INTERVAL', 0.05)
+        self.max_pending = max_pending or getattr(settings, 'CHAT_WRITE_MAX_PENDING', 5000)
+
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+        self._flush_lock = None
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = None
+
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush chat messages")
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def put(self, message):
+        self._bind_loop()
+
+        while len(self._pending) >= self.max_pending:
+            await self.flush()
+            if len(self._pending) >= self.max_pending:
+                # DB chưa nhận lô vừa rồi: chờ một chút thay vì quay vòng
+                await asyncio.sleep(self.flush_interval)
+
+        with self._pending_lock:
+            self._pending.append(message)
+            pending = len(self._pending)
+
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        self._bind_loop()
+
+        async with self._flush_lock:
+            batch = self._take()
+            if batch:
+                await database_sync_to_async(self._write)(batch)
+
+    def flush_sync(self):
+        batch = self._take()
+        if batch:
+            self._write(batch)
+
+    def _take(self):
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+        return batch
+
+    def _requeue(self, batch):
+        with self._pending_lock:
+            self._pending[:0] = batch
+
+    def _write(self, batch):
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(batch, batch_size=self.batch_size)
+            saved = batch
+        except DatabaseError:
+            logger.warning("Bulk insert of %s chat messages failed, retrying one by one", len(batch), exc_info=True)
+            saved = self._write_rows(batch)
+
+        if saved:
+            stats.record(messages_sent=len(saved))
+            bump(*[messages_namespace(room_id) for room_id in {message.room_id_id for message in saved}])
+
+    def _write_rows(self, batch):
+        saved = []
+        for index, message in enumerate(batch):
+            message.pk = None
+            try:
+                with transaction.atomic():
+                    message.save(force_insert=True)
+            except (IntegrityError, DataError):
+                logger.exception("Dropped chat message of participation %s", message.participation_id_id)
+            except DatabaseError:
+                # Mất kết nối, lock timeout...: ghi lại ở lượt flush sau
+                logger.exception("Requeued %s chat messages", len(batch) - index)
+                self._requeue(batch[index:])
+                break
+            else:
+                saved.append(message)
+        return saved
+
+
+message_writer = MessageWriteBuffer()
+
+atexit.register(message_writer.flush_sync)
@@ -0,0 +1,120 @@
+"""
+Vào / rời phòng là hai endpoint được gọi nhiều nhất, nên viết bằng view async:
+query qua async ORM (aget, acreate, aupdate) và gửi thông báo tới group của
+phòng và lobby ngay trong coroutine, không giữ một thread của pool sync.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.utils.timezone import now
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException, MethodNotAllowed, NotAuthenticated
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .models import Room, Participation
+from .closing import close_room
+from .events import aparticipation_changed
+from . import invalidation, lobby, presence, stats
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    return JsonResponse(data, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+async def authenticate(request):
+    # Dùng lại các lớp xác thực của DRF (token, session kèm kiểm tra CSRF)
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    user = await sync_to_async(lambda: drf_request.user)()
+    if not user.is_authenticated:
+        raise NotAuthenticated()
+    return user
+
+
+def room_action(view):
+    """
+    Bọc view async như một action POST của RoomViewSet: xác thực, lấy phòng
+    theo pk và trả lỗi theo định dạng của DRF.
+    """
+    @csrf_exempt
+    @wraps(view)
+    async def wrapper(request, pk):
+        try:
+            if request.method != 'POST':
+                raise MethodNotAllowed(request.method)
+            user = await authenticate(request)
+            try:
+                room = await Room.objects.aget(pk=pk)
+            except Room.DoesNotExist:
+                raise Http404
+            return await view(request, room, user)
+        except Http404:
+            return json_response({"detail": "No Room matches the given query."}, status=status.HTTP_404_NOT_FOUND)
+        except APIException as exc:
+            response = json_response({"detail": exc.detail}, status=exc.status_code)
+            if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+                response['WWW-Authenticate'] = api_settings.DEFAULT_AUTHENTICATION_CLASSES[0]().authenticate_header(request)
+            return response
+
+    return wrapper
+
+
+@room_action
+async def join_room(request, room, user):
+    if user.is_busy:
+        return json_response({"message": "Bạn đang tham gia phòng khác, không thể tham gia thêm phòng."},
+                             status=status.HTTP_400_BAD_REQUEST)
+
+    if not room.is_active:
+        return json_response({"message": "Phòng học đã kết thúc."},
+                             status=status.HTTP_400_BAD_REQUEST)
+
+    participation = await Participation.objects.filter(user_id=user, room_id=room).order_by('-time_out').afirst()
+
+    if participation and participation.is_blocked == room.id:
+        return json_response({"message": "Bạn đã bị cấm tham gia phòng này."},
+                             status=status.HTTP_403_FORBIDDEN)
+
+    participation = await Participation.objects.acreate(user_id=user, room_id=room, time_in=now())
+    user.is_busy = True
+    await user.asave(update_fields=['is_busy'])
+
+    await room.aadd_member()
+    await presence.aadd_member(participation)
+    await sync_to_async(stats.record)(joins=1)
+    await lobby.amembers_changed(room.id, room.members)
+    return json_response({"message": "Bạn đã tham gia phòng thành công."})
+
+
+@room_action
+async def leave_room(request, room, user):
+    try:
+        participation = await Participation.objects.aget(user_id=user, room_id=room, time_out__isnull=True)
+    except Participation.DoesNotExist:
+        return json_response({"message": "Bạn chưa tham gia phòng này."},
+                             status=status.HTTP_400_BAD_REQUEST)
+
+    await presence.aforget(room.id, user.id)
+
+    if room.created_by_id == user.id:
+        await sync_to_async(close_room)(room)
+        return json_response(
+            {"message": "Phòng đã đóng do chủ phòng rời khỏi. Tất cả người dùng đã bị văng khỏi phòng."}
+        )
+
+    # Chỉ trừ thành viên nếu request này thực sự đóng participation (tránh gửi leave 2 lần)
+    closed = await Participation.objects.filter(pk=participation.pk, time_out__isnull=True).aupdate(time_out=now())
+    await sync_to_async(invalidation.bump)(invalidation.members_namespace(room.id))
+
+    user.is_busy = False
+    await user.asave(update_fields=['is_busy'])
+
+    if closed:
+        await room.aremove_member()
+        await sync_to_async(stats.record)(leaves=1)
+    await lobby.amembers_changed(room.id, room.members)
+    await aparticipation_changed(room.id, user.id)
+
+    return json_response({"message": "Bạn đã rời khỏi phòng thành công."})
@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.utils.timezone import now
+
+from apps.accounts.models import User
+from .events import room_closed
+from .models import Participation, Room
+from . import invalidation, lobby, presence, stats
+
+
+def close_room(room):
+    """
+    Đóng phòng và cho mọi người đang trong phòng ra, với số câu SQL cố định
+    bất kể phòng đông bao nhiêu. is_busy được reset trước khi participation
+    bị đóng, vì sau đó không còn lọc được ai đang ở trong phòng.
+    Trả về False nếu phòng đã được đóng trước đó.
+    """
+    with transaction.atomic():
+        if not Room.objects.filter(pk=room.pk, is_active=True).update(is_active=False, members=1):
+            return False
+
+        participants = Participation.objects.filter(room_id=room.pk, time_out__isnull=True)
+        user_ids = list(participants.values_list('user_id', flat=True))
+        User.objects.filter(id__in=user_ids).update(is_busy=False)
+        left = participants.update(time_out=now())
+        stats.record(rooms_closed=1, private_rooms_closed=int(room.is_private), leaves=left)
+
+        lobby.room_closed(room.pk)
+        room_closed(room.pk)
+
+    room.is_active = False
+    room.members = 1
+    invalidation.bump(
+        invalidation.room_namespace(room.pk),
+        invalidation.members_namespace(room.pk),
+        *[invalidation.user_namespace(user_id) for user_id in user_ids]
+    )
+    presence.clear(room.pk)
+    return True
@@ -1,15 +1,15 @@
-from django.forms.models import model_to_dict
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
 
 import json
 
-from .models import Room, RoomSubject
-from .serializers import RoomSerializer
+from .snapshot import active_rooms
+from .lobby import LOBBY_GROUP
+from blueroom.metrics import ConsumerMetricsMixin
 
-class RoomConsumer(AsyncWebsocketConsumer):
+class RoomConsumer(ConsumerMetricsMixin, AsyncWebsocketConsumer):
     async def connect(self):
-        self.group_name = "rooms"
+        self.group_name = LOBBY_GROUP
 
         await self.channel_layer.group_add(
             self.group_name,
@@ -17,13 +17,7 @@ class RoomConsumer(AsyncWebsocketConsumer):
         )
 
         await self.accept()
-
-        data = await self.get_active_room()
-
-        await self.send(text_data=json.dumps({
-            'type': 'initial_rooms',
-            'messages': data
-        }))
+        await self.send_initial_rooms()
 
 
     async def disconnect(self, close_code):
@@ -34,50 +28,21 @@ class RoomConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
-        if text_data_json['type'] == 'new_room':
-            room_data = text_data_json['room']
 
-            print(room_data)
-            
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'send_room_update',
-                    'room': room_data
-                }
-            )
+        # Phòng mới / số thành viên do server tự phát delta, client chỉ cần resync khi lỡ seq
+        if text_data_json.get('type') == 'resync':
+            await self.send_initial_rooms()
 
-    async def send_room_update(self, event):
-        room_data = event['room']
-        
-        await self.send(text_data=json.dumps({
-            'type': 'new_room',
-            'room': room_data
-        }))
+    async def send_initial_rooms(self):
+        seq, rooms_json = await self.get_active_room()
 
+        await self.send(text_data='{"type": "initial_rooms", "seq": %d, "messages": %s}' % (seq, rooms_json))
 
-    @sync_to_async
-    def get_active_room(self):
-        rooms = Room.objects.filter(is_active=True).order_by('-created_at')
+    async def lobby_delta(self, event):
+        await self.send(text_data=event['text'])
 
-        print(rooms)
-        rooms_data = []
 
-        for room in rooms:
-            subjects = RoomSubject.objects.filter(room_id=room.id)
-            subject_data = [{
-                "id": subject.subject_id.id,
-                "name": subject.subject_id.name
-            } for subject in subjects]
-            rooms_data += [{
-                "id": room.id,
-                "title": room.title,
-                "description": room.description,
-                "created_by": room.created_by.username,
-                "created_at": str(room.created_at),
-                "members": room.members,
-                "background": str(room.background.bg),
-                "subjects": subject_data
-            }]
-
-        return rooms_data
+    @sync_to_async
+    def get_active_room(self):
+        # seq là seq của chính bản snapshot được gửi, không phải seq mới nhất
+        return active_rooms.lobby_state()
@@ -0,0 +1,37 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+
+def room_group_name(room_id):
+    return f'roomchat_{room_id}'
+
+
+def send_to_room(room_id, event):
+    async_to_sync(get_channel_layer().group_send)(room_group_name(room_id), event)
+
+
+def participation_changed(room_id, user_id=None):
+    """
+    Báo cho ChatConsumer trong phòng bỏ participation đã cache của user_id
+    (None = mọi user trong phòng), sau khi transaction commit.
+    """
+    transaction.on_commit(lambda: send_to_room(room_id, {
+        'type': 'participation.changed',
+        'user_id': user_id
+    }))
+
+
+async def aparticipation_changed(room_id, user_id=None):
+    await get_channel_layer().group_send(room_group_name(room_id), {
+        'type': 'participation.changed',
+        'user_id': user_id
+    })
+
+
+def room_closed(room_id):
+    # Một event cho cả phòng thay vì báo từng participation
+    transaction.on_commit(lambda: send_to_room(room_id, {
+        'type': 'room.closed',
+        'room_id': room_id
+    }))
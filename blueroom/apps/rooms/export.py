@@ -0,0 +1,80 @@
+import csv
+import json
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from .serializers import RoomSerializer
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+CSV_FIELDS = ['id', 'title', 'description', 'created_by', 'created_at', 'is_private',
+              'background', 'enable_mic', 'members', 'subjects', 'is_active']
+
+
+async def iterate_rooms(queryset, chunk_size=None):
+    """
+    Duyệt queryset theo từng lô id tăng dần. MySQLdb đọc toàn bộ kết quả vào
+    bộ nhớ kể cả với .iterator(), nên mỗi lô là một query riêng có LIMIT;
+    subjects được prefetch theo từng lô.
+
+    Là async generator: dưới ASGI, StreamingHttpResponse gom iterator sync
+    vào một list trước khi gửi, còn iterator async thì được gửi dần từng lô.
+    """
+    chunk_size = chunk_size or getattr(settings, 'REPORT_EXPORT_CHUNK_SIZE', 1000)
+    queryset = RoomSerializer.setup_eager_loading(queryset).order_by('id')
+
+    @sync_to_async
+    def fetch(last_id):
+        rooms = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        return (rooms[-1].id if rooms else None), RoomSerializer(rooms, many=True).data
+
+    last_id = 0
+    while True:
+        last_id, rows = await fetch(last_id)
+        if not rows:
+            return
+        for row in rows:
+            yield row
+
+
+async def aiterate(rows):
+    if hasattr(rows, '__aiter__'):
+        async for row in rows:
+            yield row
+    else:
+        for row in rows:
+            yield row
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+async def ndjson_lines(rows):
+    async for row in aiterate(rows):
+        yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+async def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_FIELDS)
+    async for row in aiterate(rows):
+        row = dict(row)
+        row['background'] = row['background']['bg'] if row['background'] else ''
+        row['subjects'] = ';'.join(subject['name'] for subject in row['subjects'])
+        yield writer.writerow([row[field] for field in CSV_FIELDS])
+
+
+def export_response(rows, export, filename):
+    lines = csv_lines(rows) if export == 'csv' else ndjson_lines(rows)
+    response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[export])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export}"'
+    return response
@@ -0,0 +1,69 @@
+"""
+Namespace version của tiered cache (blueroom/caching.py) và các signal tăng
+version khi model thay đổi. Các chỗ ghi bằng QuerySet.update() không phát
+signal nên gọi bump trực tiếp.
+"""
+from django.db.models.signals import post_delete, post_save
+
+from blueroom.caching import tiered_cache
+
+SUBJECTS = 'subjects'
+BACKGROUNDS = 'backgrounds'
+
+
+def room_namespace(room_id):
+    return f'room:{room_id}'
+
+
+def members_namespace(room_id):
+    return f'room:{room_id}:members'
+
+
+def messages_namespace(room_id):
+    return f'room:{room_id}:messages'
+
+
+def user_namespace(user_id):
+    return f'user:{user_id}'
+
+
+def bump(*namespaces):
+    tiered_cache.bump(*namespaces)
+
+
+def subject_changed(sender, instance, **kwargs):
+    bump(SUBJECTS)
+
+
+def background_changed(sender, instance, **kwargs):
+    bump(BACKGROUNDS)
+
+
+def room_changed(sender, instance, **kwargs):
+    bump(room_namespace(instance.pk))
+
+
+def room_subject_changed(sender, instance, **kwargs):
+    bump(room_namespace(instance.room_id_id))
+
+
+def participation_changed(sender, instance, **kwargs):
+    bump(members_namespace(instance.room_id_id))
+
+
+def user_changed(sender, instance, **kwargs):
+    bump(user_namespace(instance.pk))
+
+
+RECEIVERS = [
+    ('rooms.Subject', subject_changed),
+    ('rooms.Background', background_changed),
+    ('rooms.Room', room_changed),
+    ('rooms.RoomSubject', room_subject_changed),
+    ('rooms.Participation', participation_changed),
+    ('accounts.User', user_changed),
+]
+
+for model, receiver in RECEIVERS:
+    post_save.connect(receiver, sender=model, weak=False)
+    post_delete.connect(receiver, sender=model, weak=False)
@@ -0,0 +1,107 @@
+import json
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.core.cache import caches
+from django.db import transaction
+
+from .snapshot import SEQUENCE_KEY, active_rooms, put_room, set_members, top
+
+LOBBY_GROUP = 'rooms'
+DELTA_VERSION = 1
+LEADERBOARD_SIZE = 10
+
+
+def next_sequence():
+    # Cache "shared" để mọi worker dùng chung một dãy seq
+    cache = caches['shared']
+    try:
+        return cache.incr(SEQUENCE_KEY)
+    except ValueError:
+        cache.add(SEQUENCE_KEY, 0, timeout=None)
+        return cache.incr(SEQUENCE_KEY)
+
+
+def delta_event(kind, seq, payload):
+    delta = {'type': kind, 'v': DELTA_VERSION, 'seq': seq, **payload}
+    return {
+        'type': 'lobby.delta',
+        'text': json.dumps(delta)
+    }
+
+
+def update_snapshot(update, kind, payload):
+    """
+    Chạy update(state) trên snapshot và cấp seq cho các delta trong cùng lock
+    của snapshot, rồi đóng dấu snapshot bằng seq cuối. Trả về các event cần
+    gửi: `leaderboard` nếu top LEADERBOARD_SIZE phòng đông nhất đổi, rồi
+    delta `kind`.
+    """
+    def change(state):
+        before = top(state, LEADERBOARD_SIZE)
+        update(state)
+        after = top(state, LEADERBOARD_SIZE)
+
+        events = []
+        if after != before:
+            events.append(delta_event('leaderboard', next_sequence(), {'rooms': after}))
+        state['seq'] = next_sequence()
+        events.append(delta_event(kind, state['seq'], payload))
+        return events
+
+    return active_rooms.modify(change)
+
+
+def publish(update, kind, **payload):
+    """
+    Gửi một thay đổi nhỏ tới mọi socket trong lobby. Client dùng `seq` để
+    phát hiện bị lỡ delta và gửi `resync`.
+    """
+    for event in update_snapshot(update, kind, payload):
+        async_to_sync(get_channel_layer().group_send)(LOBBY_GROUP, event)
+
+
+async def apublish(update, kind, **payload):
+    # Snapshot có thể phải nạp từ DB nên chạy trong thread
+    for event in await sync_to_async(update_snapshot)(update, kind, payload):
+        await get_channel_layer().group_send(LOBBY_GROUP, event)
+
+
+def room_opened(room_id):
+    def on_commit():
+        entry = active_rooms.load_entry(room_id)
+        if entry is not None:
+            publish(lambda state: put_room(state, room_id, entry), 'room_opened', room=entry['lobby'])
+
+    transaction.on_commit(on_commit)
+
+
+def room_updated(room_id):
+    def on_commit():
+        entry = active_rooms.load_entry(room_id)
+        if entry is None:
+            # PATCH is_active=false: với lobby là phòng đã đóng
+            publish(lambda state: put_room(state, room_id, None), 'room_closed', room_id=room_id)
+        else:
+            publish(lambda state: put_room(state, room_id, entry), 'room_updated', room=entry['lobby'])
+
+    transaction.on_commit(on_commit)
+
+
+def members_changed(room_id, members):
+    transaction.on_commit(lambda: publish(
+        lambda state: set_members(state, room_id, members),
+        'members_changed', room_id=room_id, members=members
+    ))
+
+
+async def amembers_changed(room_id, members):
+    await apublish(lambda state: set_members(state, room_id, members), 'members_changed', room_id=room_id, members=members)
+
+
+def room_closed(room_id):
+    transaction.on_commit(lambda: publish(lambda state: put_room(state, room_id, None), 'room_closed', room_id=room_id))
+
+
+async def aroom_closed(room_id):
+    await apublish(lambda state: put_room(state, room_id, None), 'room_closed', room_id=room_id)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from apps.accounts.models import User
+from apps.rooms.models import Background
+from apps.rooms.thumbnails import generate
+
+
+class Command(BaseCommand):
+    help = (
+        "Tạo ảnh thu nhỏ (IMAGE_DERIVATIVES) cho avatar và background đã upload trước đó. "
+        "Mặc định chỉ tạo file còn thiếu; --force tạo lại tất cả (sau khi đổi kích thước hoặc chất lượng)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true')
+
+    def handle(self, *args, **options):
+        written = 0
+        # Nhiều user dùng chung một avatar (ảnh mặc định) nên chỉ xử lý mỗi file một lần
+        sources = [
+            ('avatar', User.objects.exclude(avatar='').exclude(avatar__isnull=True).values_list('avatar', flat=True)),
+            ('background', Background.objects.exclude(bg='').exclude(bg__isnull=True).values_list('bg', flat=True)),
+        ]
+        for kind, names in sources:
+            for name in sorted(set(names)):
+                written += generate(name, kind, options['force'])
+
+        self.stdout.write(f"Wrote {written} thumbnails")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from apps.rooms.presence import reap
+
+
+class Command(BaseCommand):
+    help = (
+        "Đóng các participation còn mở mà socket không báo còn sống quá PRESENCE_TIMEOUT giây. "
+        "Worker Daphne đã tự chạy việc này định kỳ; lệnh dùng khi tắt reaper trong process "
+        "(PRESENCE_REAP_INTERVAL = 0) để chạy bằng cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout', type=int, default=None)
+
+    def handle(self, *args, **options):
+        closed = reap(options['timeout'])
+        self.stdout.write(f"Closed {closed} stale participations")
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0004_alter_room_description'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='participation',
+            index=models.Index(fields=['room_id', 'time_out'], name='part_room_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='participation',
+            index=models.Index(fields=['user_id', 'room_id', 'time_out'], name='part_user_room_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='participation',
+            index=models.Index(fields=['user_id', 'time_in'], name='part_user_time_in_idx'),
+        ),
+    ]
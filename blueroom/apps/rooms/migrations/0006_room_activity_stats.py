@@ -0,0 +1,33 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0005_participation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomActivityStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(unique=True)),
+                ('rooms_created', models.PositiveIntegerField(default=0)),
+                ('rooms_closed', models.PositiveIntegerField(default=0)),
+                ('rooms_deleted', models.PositiveIntegerField(default=0)),
+                ('private_rooms_opened', models.PositiveIntegerField(default=0)),
+                ('private_rooms_closed', models.PositiveIntegerField(default=0)),
+                ('joins', models.PositiveIntegerField(default=0)),
+                ('leaves', models.PositiveIntegerField(default=0)),
+                ('messages_sent', models.PositiveIntegerField(default=0)),
+                ('accounts_created', models.PositiveIntegerField(default=0)),
+                ('accounts_deleted', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'room_activity_stats',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 20:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0006_room_activity_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roomactivitystat',
+            name='rooms_reopened',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,5 +1,9 @@
+from asgiref.sync import sync_to_async
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest
 from apps.accounts.models import User
+from .invalidation import bump, room_namespace
 
 
 # Create your models here.
@@ -36,6 +40,27 @@ class Room(models.Model):
     def __str__(self):
         return self.title
 
+    # Cập nhật bộ đếm bằng một câu UPDATE nguyên tử để không mất lượt khi nhiều người vào/ra cùng lúc
+    def add_member(self):
+        Room.objects.filter(pk=self.pk).update(members=F('members') + 1, members_max=F('members_max') + 1)
+        bump(room_namespace(self.pk))
+        self.refresh_from_db(fields=['members', 'members_max'])
+
+    def remove_member(self):
+        Room.objects.filter(pk=self.pk).update(members=Greatest(F('members') - 1, 0))
+        bump(room_namespace(self.pk))
+        self.refresh_from_db(fields=['members'])
+
+    async def aadd_member(self):
+        await Room.objects.filter(pk=self.pk).aupdate(members=F('members') + 1, members_max=F('members_max') + 1)
+        await sync_to_async(bump)(room_namespace(self.pk))
+        await self.arefresh_from_db(fields=['members', 'members_max'])
+
+    async def aremove_member(self):
+        await Room.objects.filter(pk=self.pk).aupdate(members=Greatest(F('members') - 1, 0))
+        await sync_to_async(bump)(room_namespace(self.pk))
+        await self.arefresh_from_db(fields=['members'])
+
 class Participation(models.Model):
     id = models.BigAutoField(primary_key=True)
     user_id = models.ForeignKey(User, on_delete=models.CASCADE, db_column='user_id', related_name='participations')
@@ -50,6 +75,15 @@ class Participation(models.Model):
         db_table = 'participations'
         # managed = False
 
+        indexes = [
+            # Thành viên đang ở trong phòng: room_id = ? AND time_out IS NULL
+            models.Index(fields=['room_id', 'time_out'], name='part_room_open_idx'),
+            # Participation đang mở của một user trong phòng
+            models.Index(fields=['user_id', 'room_id', 'time_out'], name='part_user_room_open_idx'),
+            # Lịch sử vào phòng của user
+            models.Index(fields=['user_id', 'time_in'], name='part_user_time_in_idx'),
+        ]
+
 class Subject(models.Model):
     id = models.BigAutoField(primary_key=True)
     name = models.CharField(max_length=100, unique=True)
@@ -69,4 +103,24 @@ class RoomSubject(models.Model):
         db_table = 'room_subjects'
         # managed = False
 
-        unique_together = ('room_id', 'subject_id')
\ No newline at end of file
+        unique_together = ('room_id', 'subject_id')
+class RoomActivityStat(models.Model):
+    # Bộ đếm theo từng giờ, cộng dồn từ các thao tác ghi; báo cáo chỉ cần SUM
+    bucket = models.DateTimeField(unique=True)
+    rooms_created = models.PositiveIntegerField(default=0)
+    rooms_reopened = models.PositiveIntegerField(default=0)
+    rooms_closed = models.PositiveIntegerField(default=0)
+    rooms_deleted = models.PositiveIntegerField(default=0)
+    private_rooms_opened = models.PositiveIntegerField(default=0)
+    private_rooms_closed = models.PositiveIntegerField(default=0)
+    joins = models.PositiveIntegerField(default=0)
+    leaves = models.PositiveIntegerField(default=0)
+    messages_sent = models.PositiveIntegerField(default=0)
+    accounts_created = models.PositiveIntegerField(default=0)
+    accounts_deleted = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'room_activity_stats'
+
+    def __str__(self):
+        return str(self.bucket)
@@ -0,0 +1,290 @@
+"""
+Registry những ai đang thực sự có mặt trong phòng, trên cache shared.
+
+- presence:<room_id>: "lần thấy cuối" của từng user, chỉ socket chat đã xác
+  thực (scope['user']) ghi vào: khi connect, định kỳ mỗi
+  PRESENCE_HEARTBEAT_INTERVAL giây (và khi client gửi "heartbeat"), và khi
+  disconnect. presence:rooms giữ danh sách phòng đang có heartbeat để reaper
+  chỉ duyệt registry, không quét bảng participation.
+- presence:<room_id>:members: thành viên đang trong phòng (dữ liệu của
+  members-in-room), ghi khi vào phòng, đổi quyền, rời phòng. Cache mất thì
+  dựng lại từ DB ở lần đọc kế tiếp.
+
+Người trong registry heartbeat quá PRESENCE_TIMEOUT giây không được thấy là
+phiên ma (client crash, mất mạng, worker chết): reaper đóng participation của
+họ theo lô như khi rời phòng. Người chỉ vào phòng qua REST, chưa từng mở
+socket có token, không có heartbeat nên không bị reaper đụng tới.
+"""
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils.timezone import now
+
+from apps.accounts.models import User
+from blueroom.caching import cache_lock
+from .events import participation_changed
+from .models import Participation, Room
+from .serializers import ParticipationSerializer
+from . import closing, invalidation, lobby, stats
+
+logger = logging.getLogger(__name__)
+
+
+ROOMS_KEY = 'presence:rooms'
+
+
+def presence_key(room_id):
+    return f'presence:{room_id}'
+
+
+def members_key(room_id):
+    return f'{presence_key(room_id)}:members'
+
+
+def presence_timeout():
+    return getattr(settings, 'PRESENCE_TIMEOUT', 90)
+
+
+class room_lock(cache_lock):
+    """
+    Lock theo phòng để các worker không ghi đè map của nhau; quá hạn thì
+    ghi luôn, cùng lắm mất một heartbeat.
+    """
+
+    def __init__(self, room_id):
+        super().__init__(f'lock:{presence_key(room_id)}')
+
+
+def _index(room_id, present):
+    # Gọi trong room_lock(room_id): thứ tự thêm / bỏ của cùng một phòng không bị đảo
+    cache = caches['shared']
+    with cache_lock(f'lock:{ROOMS_KEY}'):
+        rooms = cache.get(ROOMS_KEY) or set()
+        if present:
+            rooms.add(room_id)
+        else:
+            rooms.discard(room_id)
+        cache.set(ROOMS_KEY, rooms, timeout=None)
+
+
+def _update(room_id, change):
+    cache = caches['shared']
+    with room_lock(room_id):
+        heartbeats = cache.get(presence_key(room_id)) or {}
+        registered = bool(heartbeats)
+        change(heartbeats)
+        if heartbeats:
+            cache.set(presence_key(room_id), heartbeats, timeout=presence_timeout() * 10)
+        else:
+            cache.delete(presence_key(room_id))
+        if registered != bool(heartbeats):
+            _index(room_id, bool(heartbeats))
+
+
+def _update_members(room_id, change):
+    cache = caches['shared']
+    with room_lock(room_id):
+        entries = cache.get(members_key(room_id))
+        if entries is None:
+            # Chưa dựng: lần đọc kế tiếp sẽ lấy từ DB, đã gồm thay đổi này
+            return
+        change(entries)
+        cache.set(members_key(room_id), entries, timeout=presence_timeout() * 10)
+
+
+def touch(room_id, *user_ids):
+    seen = time.time()
+    _update(room_id, lambda heartbeats: heartbeats.update(dict.fromkeys(user_ids, seen)))
+
+
+def member_entry(participation):
+    # Avatar để tương đối, view ghép host của request khi trả về
+    return ParticipationSerializer(participation).data
+
+
+def add_member(participation):
+    entry = member_entry(participation)
+    _update_members(participation.room_id_id, lambda entries: entries.update({participation.user_id_id: entry}))
+
+
+def forget(room_id, *user_ids):
+    def change(entries):
+        for user_id in user_ids:
+            entries.pop(user_id, None)
+
+    _update(room_id, change)
+    _update_members(room_id, change)
+
+
+# Chỉ đụng tới cache nên không cần chạy trong thread của ORM
+atouch = sync_to_async(touch, thread_sensitive=False)
+aadd_member = sync_to_async(add_member, thread_sensitive=False)
+aforget = sync_to_async(forget, thread_sensitive=False)
+
+
+def clear(room_id):
+    cache = caches['shared']
+    with room_lock(room_id):
+        cache.delete_many([presence_key(room_id), members_key(room_id)])
+        _index(room_id, False)
+
+
+def heartbeats(room_id):
+    return caches['shared'].get(presence_key(room_id)) or {}
+
+
+def members(room_id):
+    """
+    Thành viên đang trong phòng theo thứ tự vào phòng, đọc từ registry.
+    """
+    cache = caches['shared']
+    entries = cache.get(members_key(room_id))
+    if entries is None:
+        with room_lock(room_id):
+            entries = cache.get(members_key(room_id))
+            if entries is None:
+                participations = (
+                    Participation.objects.filter(room_id=room_id, time_out__isnull=True)
+                    .select_related('user_id', 'room_id')
+                )
+                entries = {
+                    entry['user']['id']: entry
+                    for entry in ParticipationSerializer(participations, many=True).data
+                }
+                cache.set(members_key(room_id), entries, timeout=presence_timeout() * 10)
+    return sorted(entries.values(), key=lambda entry: (entry['time_in'], entry['id']))
+
+
+def close_participations(room_id, user_ids):
+    """
+    Đóng participation còn mở của user_ids trong phòng bằng vài câu UPDATE,
+    như thể họ vừa bấm rời phòng.
+    """
+    with transaction.atomic():
+        closed = (
+            Participation.objects
+            .filter(room_id=room_id, user_id__in=user_ids, time_out__isnull=True)
+            .update(time_out=now())
+        )
+        if not closed:
+            return 0
+        User.objects.filter(id__in=user_ids).update(is_busy=False)
+        Room.objects.filter(pk=room_id).update(members=Greatest(F('members') - closed, 0))
+        stats.record(leaves=closed)
+
+        members = Room.objects.filter(pk=room_id).values_list('members', flat=True).first()
+        lobby.members_changed(room_id, members)
+        participation_changed(room_id)
+
+    invalidation.bump(
+        invalidation.room_namespace(room_id),
+        invalidation.members_namespace(room_id),
+        *[invalidation.user_namespace(user_id) for user_id in user_ids]
+    )
+    return closed
+
+
+def reap(timeout=None):
+    """
+    Một lượt dọn: duyệt các phòng trong registry, đóng participation của
+    người có heartbeat quá hạn. Trả về số participation đã đóng.
+    """
+    cutoff = time.time() - (timeout or presence_timeout())
+    cache = caches['shared']
+
+    rooms = cache.get(ROOMS_KEY) or set()
+    found = cache.get_many([presence_key(room_id) for room_id in rooms])
+
+    stale = {}
+    for room_id in rooms:
+        seen = found.get(presence_key(room_id))
+        if not seen:
+            # Map đã hết hạn trên cache: bỏ phòng khỏi danh sách
+            with room_lock(room_id):
+                if not heartbeats(room_id):
+                    _index(room_id, False)
+            continue
+        users = [user_id for user_id, last_seen in seen.items() if last_seen < cutoff]
+        if users:
+            stale[room_id] = users
+    if not stale:
+        return 0
+
+    # Chỉ hỏi DB về những người quá hạn
+    open_users = {}
+    owners = {}
+    participations = (
+        Participation.objects
+        .filter(room_id__in=stale, user_id__in={user_id for users in stale.values() for user_id in users}, time_out__isnull=True)
+        .values_list('room_id', 'user_id', 'room_id__created_by')
+    )
+    for room_id, user_id, owner_id in participations:
+        if user_id in stale[room_id]:
+            open_users.setdefault(room_id, []).append(user_id)
+            owners[room_id] = owner_id
+
+    closed = 0
+    for room_id, users in stale.items():
+        # Đọc lại: socket có thể vừa kết nối lại sau get_many ở trên
+        fresh = heartbeats(room_id)
+        users = [user_id for user_id in users if fresh.get(user_id, cutoff) < cutoff]
+        if not users:
+            continue
+        in_room = [user_id for user_id in open_users.get(room_id, []) if user_id in users]
+        if owners.get(room_id) in in_room:
+            # Chủ phòng mất kết nối: đóng phòng như khi chủ phòng rời đi
+            room = Room.objects.get(pk=room_id)
+            members = room.members
+            if closing.close_room(room):
+                closed += members
+            continue
+        if in_room:
+            closed += close_participations(room_id, in_room)
+        # Người đã rời phòng hoặc chưa từng tham gia cũng bỏ khỏi registry
+        forget(room_id, *users)
+    return closed
+
+
+class PresenceReaper:
+    """
+    Task nền trong event loop của mỗi worker, chạy reap() mỗi
+    PRESENCE_REAP_INTERVAL giây. Một key trên cache shared bảo đảm mỗi
+    chu kỳ chỉ một worker quét.
+    """
+
+    LOCK_KEY = 'presence:reaper'
+
+    def __init__(self):
+        self._loop = None
+        self._task = None
+
+    def start(self):
+        interval = getattr(settings, 'PRESENCE_REAP_INTERVAL', 30)
+        if interval <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task.done():
+            self._loop = loop
+            self._task = loop.create_task(self._run(interval))
+
+    async def _run(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            if not await caches['shared'].aadd(self.LOCK_KEY, 1, timeout=interval):
+                continue
+            try:
+                closed = await sync_to_async(reap)()
+                if closed:
+                    logger.info("Closed %s stale participations", closed)
+            except Exception:
+                logger.exception("Failed to reap stale participations")
+
+
+presence_reaper = PresenceReaper()
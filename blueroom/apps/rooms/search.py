@@ -0,0 +1,88 @@
+import bisect
+import re
+import unicodedata
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    # Bỏ dấu tiếng Việt để "toán" và "toan" cùng khớp
+    text = unicodedata.normalize('NFD', (text or '').lower().replace('đ', 'd'))
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(normalize(text))
+
+
+class RoomSearchIndex:
+    """
+    Inverted index trên tiêu đề, mô tả và tên chủ đề của các phòng.
+
+    Mỗi từ của truy vấn khớp theo tiền tố với các từ đã index; phòng phải
+    khớp mọi từ của truy vấn. Điểm của phòng là tổng trọng số trường khớp
+    (tiêu đề > chủ đề > mô tả), khớp trọn từ được nhân đôi.
+    """
+
+    FIELD_WEIGHTS = {'title': 3, 'subjects': 2, 'description': 1}
+
+    def __init__(self):
+        self._postings = {}
+        self._tokens = []
+        self._documents = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, room_id, title, description, subjects):
+        self.remove(room_id)
+
+        weights = {}
+        fields = (('title', title), ('subjects', ' '.join(subjects)), ('description', description))
+        for field, text in fields:
+            for token in tokenize(text):
+                weights[token] = max(weights.get(token, 0), self.FIELD_WEIGHTS[field])
+
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                bisect.insort(self._tokens, token)
+            postings[room_id] = weight
+        self._documents[room_id] = list(weights)
+
+    def remove(self, room_id):
+        for token in self._documents.pop(room_id, ()):
+            postings = self._postings[token]
+            del postings[room_id]
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def _expand(self, prefix):
+        index = bisect.bisect_left(self._tokens, prefix)
+        while index < len(self._tokens) and self._tokens[index].startswith(prefix):
+            yield self._tokens[index]
+            index += 1
+
+    def search(self, query):
+        """
+        Trả về {room_id: điểm} của các phòng khớp mọi từ trong truy vấn.
+        """
+        scores = None
+        for term in dict.fromkeys(tokenize(query)):
+            term_scores = {}
+            for token in self._expand(term):
+                boost = 2 if token == term else 1
+                for room_id, weight in self._postings[token].items():
+                    if weight * boost > term_scores.get(room_id, 0):
+                        term_scores[room_id] = weight * boost
+
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {room_id: scores[room_id] + score for room_id, score in term_scores.items() if room_id in scores}
+            if not scores:
+                return {}
+
+        return scores or {}
@@ -1,13 +1,39 @@
 from rest_framework import serializers
 from django.utils.timezone import now
-from django.db.models import Count
+from django.db.models import Count, Manager, Prefetch
 
 from .models import Background, Subject, Room, RoomSubject, Participation
+from . import stats
+from .thumbnails import derivative_url, resolve_fields
+
+class ThumbnailListSerializer(serializers.ListSerializer):
+    """
+    Tra bản thu nhỏ của cả trang bằng một lần đọc cache trước khi serialize
+    từng phần tử; child khai báo image_fields(obj).
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, Manager) else data)
+        fields = [field for item in items for field in self.child.image_fields(item)]
+        self.context['thumbnails'] = {**self.context.get('thumbnails', {}), **resolve_fields(fields, 'sm')}
+        return super().to_representation(items)
 
 class BackgroundSerializer(serializers.ModelSerializer):
+    thumbnail = serializers.SerializerMethodField()
+
     class Meta:
         model = Background
-        fields = ['id', 'bg']
+        fields = ['id', 'bg', 'thumbnail']
+        list_serializer_class = ThumbnailListSerializer
+
+    @staticmethod
+    def image_fields(obj):
+        return [obj.bg]
+
+    def get_thumbnail(self, obj):
+        url = derivative_url(obj.bg, 'sm', generated=self.context.get('thumbnails'))
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if url and request else url
 
 class SubjectSerializer(serializers.ModelSerializer):
     class Meta:
@@ -29,9 +55,21 @@ class RoomSerializer(serializers.ModelSerializer):
         model = Room
         fields = ['id', 'title', 'description', 'created_by', 'created_at', 'is_private', 
                   'background', 'enable_mic', 'members', 'subjects', 'is_active']
+        list_serializer_class = ThumbnailListSerializer
+
+    @staticmethod
+    def image_fields(obj):
+        return [obj.background.bg] if obj.background else []
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # Serialize N phòng với 2 query: phòng + người tạo + background, và subjects
+        return queryset.select_related('created_by', 'background').prefetch_related(
+            Prefetch('subjects', queryset=RoomSubject.objects.select_related('subject_id').order_by('subject_id'))
+        )
 
     def get_subjects(self, obj):
-        subjects = Subject.objects.filter(rooms__room_id=obj)
+        subjects = [room_subject.subject_id for room_subject in obj.subjects.all()]
         return SubjectSerializer(subjects, many=True).data
 
 class EditRoomSerializer(serializers.ModelSerializer):
@@ -88,15 +126,24 @@ class EditPermissionSerializer(serializers.ModelSerializer):
         room = instance.room_id
         user = instance.user_id
 
-        if instance.is_blocked == 1:
-            instance.time_out = now()
-            room.members = max(0, room.members - 1)
-            room.save()
-
-            user.is_busy = False
-            user.save()
-
-        instance.save()
+        if instance.is_blocked == 1 and instance.time_out is None:
+            # Chỉ request thực sự đóng participation mới ghi time_out và trừ thành viên (như BlockUserView)
+            closed_at = now()
+            closed = (
+                Participation.objects.filter(pk=instance.pk, time_out__isnull=True)
+                .update(is_blocked=True, time_out=closed_at)
+            )
+            if closed:
+                instance.time_out = closed_at
+                room.remove_member()
+                stats.record(leaves=1)
+                user.is_busy = False
+                user.save(update_fields=['is_busy'])
+            else:
+                # Request khác đã đóng trước: giữ nguyên thời điểm đóng của nó
+                instance.time_out = Participation.objects.filter(pk=instance.pk).values_list('time_out', flat=True).first()
+
+        instance.save(update_fields=['mic_allow', 'chat_allow', 'is_blocked'])
         return instance
 
 class ParticipationSerializer(serializers.ModelSerializer):
@@ -106,20 +153,26 @@ class ParticipationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Participation
         fields = ['id', 'user', 'time_in', 'mic_allow', 'chat_allow', 'is_blocked', 'room_owner']
+        list_serializer_class = ThumbnailListSerializer
+
+    @staticmethod
+    def image_fields(obj):
+        return [obj.user_id.avatar]
 
     def get_user(self, obj):
+        url = derivative_url(obj.user_id.avatar, 'sm', generated=self.context.get('thumbnails'))
+        request = self.context.get('request')
         return {
             "id": obj.user_id.id,
             "username": obj.user_id.username,
-            "avatar": self.context['request'].build_absolute_uri(obj.user_id.avatar.url)
-            if obj.user_id.avatar else None
+            "avatar": request.build_absolute_uri(url) if url and request else url
         }
     
 
     def get_room_owner(self, obj):
         room = obj.room_id
 
-        return room.created_by.id,
+        return room.created_by_id,
                 
 
 class FileShareSerializer(serializers.Serializer):
@@ -0,0 +1,258 @@
+import bisect
+import hashlib
+import json
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from blueroom.caching import cache_lock
+
+from .models import Room
+from .search import RoomSearchIndex
+from .serializers import RoomSerializer
+from .thumbnails import resolve_fields, thumbnail_name
+
+
+def room_to_lobby(room, generated=None):
+    return {
+        "id": room.id,
+        "title": room.title,
+        "description": room.description,
+        "created_by": room.created_by.username,
+        "created_at": str(room.created_at),
+        "members": room.members,
+        "background": thumbnail_name(room.background.bg.name, 'sm', generated=generated) if room.background and room.background.bg else None,
+        "subjects": [{
+            "id": room_subject.subject_id.id,
+            "name": room_subject.subject_id.name
+        } for room_subject in room.subjects.all()]
+    }
+
+
+SNAPSHOT_KEY = 'lobby:snapshot'
+VERSION_KEY = 'lobby:snapshot:version'
+LEADERBOARD_KEY = 'lobby:leaderboard'
+SEQUENCE_KEY = 'lobby:seq'
+
+
+class ActiveRoomSnapshot:
+    """
+    Danh sách phòng đang hoạt động, đã serialize sẵn, giữ trên cache shared
+    để mọi worker thấy cùng một bản.
+
+    Mỗi thay đổi (phòng được tạo / sửa / có người vào, ra / đóng) đọc - sửa -
+    ghi snapshot trong một lock, cùng lúc lobby.py cấp seq cho delta, nên
+    snapshot luôn mang seq của delta cuối cùng đã áp dụng vào nó. Snapshot
+    hết hạn sau ACTIVE_ROOM_SNAPSHOT_TTL giây và được nạp lại từ DB với seq
+    lúc nạp. Bảng xếp hạng theo số thành viên (giữ sắp xếp bằng bisect) nằm
+    trong snapshot và được ghi thêm ra key riêng kèm version của nó. Mỗi
+    process chỉ giữ các view dẫn xuất (JSON cho lobby, danh sách cho API, chỉ
+    mục tìm kiếm) của version mới nhất nó đã đọc.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._local = None
+        self._index = RoomSearchIndex()
+        self._indexed = None
+
+    def _queryset(self):
+        return RoomSerializer.setup_eager_loading(Room.objects.filter(is_active=True))
+
+    def _entry(self, room, generated=None):
+        if generated is None:
+            generated = resolve_fields(RoomSerializer.image_fields(room), 'sm')
+        return {
+            'created_at': room.created_at,
+            'api': dict(RoomSerializer(room, context={'thumbnails': generated}).data),
+            'lobby': room_to_lobby(room, generated),
+        }
+
+    def load_entry(self, room_id):
+        # Đọc DB trước khi lấy lock của snapshot
+        room = self._queryset().filter(id=room_id).first()
+        return self._entry(room) if room else None
+
+    def _build(self):
+        cache = caches['shared']
+        active = list(self._queryset())
+        # Bản thu nhỏ của mọi phòng: một lần đọc cache
+        generated = resolve_fields([field for room in active for field in RoomSerializer.image_fields(room)], 'sm')
+        rooms = {room.id: self._entry(room, generated) for room in active}
+        return {
+            'seq': cache.get(SEQUENCE_KEY, 0),
+            'rooms': rooms,
+            # (-members, room_id) đã sắp xếp: phòng đông nhất đứng đầu
+            'ranking': sorted((-entry['api']['members'], room_id) for room_id, entry in rooms.items()),
+            'ranking_version': uuid.uuid4().hex,
+            'content': uuid.uuid4().hex,
+        }
+
+    def _save(self, state):
+        state['version'] = uuid.uuid4().hex
+        ttl = getattr(settings, 'ACTIVE_ROOM_SNAPSHOT_TTL', 60)
+        # Bảng xếp hạng có key riêng, nhỏ: đọc top phòng không cần tải cả snapshot
+        leaderboard = {'version': state['ranking_version'], 'ranking': state['ranking']}
+        caches['shared'].set_many({SNAPSHOT_KEY: state, VERSION_KEY: state['version'], LEADERBOARD_KEY: leaderboard}, timeout=ttl)
+
+    def modify(self, update):
+        """
+        Chạy update(state) trên snapshot trong lock của cache shared rồi ghi
+        lại. Trả về kết quả của update.
+        """
+        with cache_lock(f'lock:{SNAPSHOT_KEY}'):
+            state = caches['shared'].get(SNAPSHOT_KEY)
+            if state is None:
+                state = self._build()
+            result = update(state)
+            self._save(state)
+        return result
+
+    def _current(self):
+        cache = caches['shared']
+        version = cache.get(VERSION_KEY)
+        with self._lock:
+            if self._local is not None and version is not None and self._local['version'] == version:
+                return self._local
+
+        state = cache.get(SNAPSHOT_KEY)
+        if state is None:
+            # Hết hạn hoặc chưa có: nạp lại từ DB, mang seq hiện tại
+            state = self.modify(lambda state: state)
+
+        entries = sorted(state['rooms'].values(), key=lambda entry: entry['created_at'], reverse=True)
+        lobby = [entry['lobby'] for entry in entries]
+        api = [entry['api'] for entry in entries]
+        local = {
+            **state,
+            'api': api,
+            'lobby': lobby,
+            'lobby_json': json.dumps(lobby),
+            # Theo nội dung: các worker có cùng snapshot trả cùng ETag
+            'etag': '"%s"' % hashlib.md5(json.dumps(api, default=str).encode()).hexdigest(),
+        }
+        with self._lock:
+            self._local = local
+        return local
+
+    def api_rooms(self):
+        return self._current()['api']
+
+    def lobby_rooms(self):
+        return self._current()['lobby']
+
+    def etag(self):
+        return self._current()['etag']
+
+    def lobby_json(self):
+        return self._current()['lobby_json']
+
+    def lobby_state(self):
+        """
+        (seq, JSON danh sách phòng) của cùng một bản snapshot, cho initial_rooms.
+        """
+        local = self._current()
+        return local['seq'], local['lobby_json']
+
+    def search(self, query, limit, offset=0):
+        """
+        Trả về (tổng số phòng khớp, danh sách phòng của trang) theo điểm giảm
+        dần, cùng điểm thì phòng mới tạo trước.
+        """
+        local = self._current()
+        rooms = local['rooms']
+        with self._lock:
+            # Chỉ mục chỉ phụ thuộc tiêu đề, mô tả, chủ đề: số thành viên đổi thì không dựng lại
+            if self._indexed != local['content']:
+                self._index = RoomSearchIndex()
+                for room_id, entry in rooms.items():
+                    lobby = entry['lobby']
+                    self._index.add(room_id, lobby['title'], lobby['description'], [subject['name'] for subject in lobby['subjects']])
+                self._indexed = local['content']
+            scores = self._index.search(query)
+        scores = {room_id: score for room_id, score in scores.items() if room_id in rooms}
+        ranked = sorted(scores, key=lambda room_id: (rooms[room_id]['created_at'], room_id), reverse=True)
+        ranked.sort(key=scores.get, reverse=True)
+        return len(ranked), [rooms[room_id]['api'] for room_id in ranked[offset:offset + limit]]
+
+    def popular(self, n):
+        local = self._current()
+        return [local['rooms'][room_id]['api'] for _, room_id in local['ranking'][:n]]
+
+    def _leaderboard(self):
+        leaderboard = caches['shared'].get(LEADERBOARD_KEY)
+        if leaderboard is None:
+            # Nạp lại snapshot cũng ghi lại key này
+            local = self._current()
+            leaderboard = {'version': local['ranking_version'], 'ranking': local['ranking']}
+        return leaderboard
+
+    def leaderboard(self, n):
+        """
+        Top n phòng đông nhất, đọc từ bảng xếp hạng trên cache shared nên mọi
+        worker trả cùng một kết quả.
+        """
+        return top(self._leaderboard(), n)
+
+    def leaderboard_version(self):
+        return self._leaderboard()['version']
+
+    def refresh_room(self, room_id):
+        entry = self.load_entry(room_id)
+        self.modify(lambda state: put_room(state, room_id, entry))
+        return entry['lobby'] if entry else None
+
+    def set_members(self, room_id, members):
+        self.modify(lambda state: set_members(state, room_id, members))
+
+    def remove_room(self, room_id):
+        self.modify(lambda state: put_room(state, room_id, None))
+
+    def invalidate(self):
+        caches['shared'].delete_many([SNAPSHOT_KEY, VERSION_KEY, LEADERBOARD_KEY])
+        with self._lock:
+            self._local = None
+
+
+def _rank(state, room_id, old_members, new_members):
+    if old_members == new_members:
+        return
+    state['ranking_version'] = uuid.uuid4().hex
+    ranking = state['ranking']
+    if old_members is not None:
+        key = (-old_members, room_id)
+        index = bisect.bisect_left(ranking, key)
+        if index < len(ranking) and ranking[index] == key:
+            del ranking[index]
+    if new_members is not None:
+        bisect.insort(ranking, (-new_members, room_id))
+
+
+def put_room(state, room_id, entry):
+    """
+    Thêm / thay phòng trong snapshot, entry None thì bỏ phòng.
+    """
+    old = state['rooms'].pop(room_id, None)
+    if entry is not None:
+        state['rooms'][room_id] = entry
+    _rank(state, room_id, old['api']['members'] if old else None, entry['api']['members'] if entry else None)
+    if old is not None or entry is not None:
+        state['content'] = uuid.uuid4().hex
+
+
+def set_members(state, room_id, members):
+    entry = state['rooms'].get(room_id)
+    if entry is None:
+        return
+    _rank(state, room_id, entry['api']['members'], members)
+    entry['api']['members'] = members
+    entry['lobby']['members'] = members
+
+
+def top(state, n):
+    return [{'room_id': room_id, 'members': -members} for members, room_id in state['ranking'][:n]]
+
+
+active_rooms = ActiveRoomSnapshot()
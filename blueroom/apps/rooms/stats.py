@@ -0,0 +1,190 @@
+"""
+Bộ đếm hoạt động theo giờ (bảng room_activity_stats).
+
+record() không ghi DB ngay: mỗi lần cộng chỉ là một INCR trên cache shared,
+sau khi transaction commit. flush() dồn phần đang chờ vào dòng của từng giờ
+bằng một UPDATE ... SET x = x + n cho mỗi giờ; nó chạy trong record() tối
+đa một lần mỗi STATS_FLUSH_INTERVAL giây cho mọi worker, nên dòng của giờ
+hiện tại không còn bị mỗi thao tác ghi tranh nhau khóa.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from apps.accounts.models import User
+from blueroom.caching import cache_lock
+from .models import Participation, Room, RoomActivityStat
+
+COUNTERS = [
+    'rooms_created', 'rooms_reopened', 'rooms_closed', 'rooms_deleted', 'private_rooms_opened', 'private_rooms_closed',
+    'joins', 'leaves', 'messages_sent', 'accounts_created', 'accounts_deleted',
+]
+
+PENDING_KEY = 'stats:pending'
+FLUSH_KEY = 'stats:flush'
+
+
+def hour_bucket(value=None):
+    return (value or now()).replace(minute=0, second=0, microsecond=0)
+
+
+def pending_key(bucket, name):
+    return f'stats:{bucket:%Y%m%d%H}:{name}'
+
+
+def flush_interval():
+    return getattr(settings, 'STATS_FLUSH_INTERVAL', 5)
+
+
+def _incr(key, value):
+    cache = caches['shared']
+    try:
+        cache.incr(key, value)
+    except ValueError:
+        if not cache.add(key, value, timeout=None):
+            cache.incr(key, value)
+
+
+def _buffer(counters):
+    cache = caches['shared']
+    bucket = hour_bucket()
+    if bucket not in (cache.get(PENDING_KEY) or set()):
+        with cache_lock(f'lock:{PENDING_KEY}'):
+            buckets = cache.get(PENDING_KEY) or set()
+            buckets.add(bucket)
+            cache.set(PENDING_KEY, buckets, timeout=None)
+    for name, value in counters.items():
+        _incr(pending_key(bucket, name), value)
+
+    if cache.add(FLUSH_KEY, 1, timeout=flush_interval()):
+        flush()
+
+
+def record(**counters):
+    """
+    Cộng các bộ đếm vào giờ hiện tại, khi transaction hiện tại commit.
+    """
+    counters = {name: value for name, value in counters.items() if value}
+    if counters:
+        transaction.on_commit(lambda: _buffer(counters))
+
+
+def _write(bucket, counters):
+    # Tạo dòng nếu chưa có (hai worker cùng tạo thì worker thua cập nhật lại)
+    increments = {name: F(name) + value for name, value in counters.items()}
+    if RoomActivityStat.objects.filter(bucket=bucket).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            RoomActivityStat.objects.create(bucket=bucket, **counters)
+    except IntegrityError:
+        RoomActivityStat.objects.filter(bucket=bucket).update(**increments)
+
+
+def pending(bucket):
+    keys = {name: pending_key(bucket, name) for name in COUNTERS}
+    found = caches['shared'].get_many(keys.values())
+    return {name: found[key] for name, key in keys.items() if found.get(key)}
+
+
+def flush():
+    """
+    Ghi phần đang chờ trên cache vào bảng, mỗi giờ một UPDATE.
+    """
+    cache = caches['shared']
+    # Giờ trước vẫn có thể nhận record() đến muộn nên chỉ dọn key từ hai giờ trước
+    expired = hour_bucket() - timedelta(hours=1)
+    for bucket in sorted(cache.get(PENDING_KEY) or set()):
+        counters = pending(bucket)
+        for name, value in counters.items():
+            cache.decr(pending_key(bucket, name), value)
+        if counters:
+            try:
+                _write(bucket, counters)
+            except Exception:
+                for name, value in counters.items():
+                    _incr(pending_key(bucket, name), value)
+                raise
+        if bucket < expired:
+            cache.delete_many([pending_key(bucket, name) for name in COUNTERS])
+            with cache_lock(f'lock:{PENDING_KEY}'):
+                buckets = cache.get(PENDING_KEY) or set()
+                buckets.discard(bucket)
+                cache.set(PENDING_KEY, buckets, timeout=None)
+
+
+def report_figures():
+    """
+    Số liệu tại thời điểm hiện tại của các báo cáo admin, lấy từ bảng theo
+    giờ bằng một câu SUM, cộng phần của các giờ chưa flush còn trên cache.
+    """
+    totals = RoomActivityStat.objects.aggregate(**{name: Coalesce(Sum(name), 0) for name in COUNTERS})
+    for bucket in caches['shared'].get(PENDING_KEY) or set():
+        for name, value in pending(bucket).items():
+            totals[name] += value
+
+    return {
+        "total_account": totals['accounts_created'] - totals['accounts_deleted'],
+        "account_in_room": totals['joins'] - totals['leaves'],
+        "total_room": totals['rooms_created'] - totals['rooms_deleted'],
+        "total_room_active": totals['rooms_created'] + totals['rooms_reopened'] - totals['rooms_closed'],
+        "total_private_room": totals['private_rooms_opened'] - totals['private_rooms_closed'],
+    }
+
+
+def daily(start_date, end_date):
+    flush()
+    rows = (
+        RoomActivityStat.objects
+        .filter(bucket__gte=start_date, bucket__lt=end_date + timedelta(days=1))
+        .annotate(day=TruncDate('bucket'))
+        .values('day')
+        .annotate(**{f'total_{name}': Sum(name) for name in COUNTERS})
+        .order_by('day')
+    )
+    return [{'day': row['day'], **{name: row[f'total_{name}'] for name in COUNTERS}} for row in rows]
+
+
+# Xóa (kể cả xóa dây chuyền khi xóa user) không đi qua view nên được đếm bằng signal
+
+@receiver(post_delete, sender=Room)
+def room_deleted(sender, instance, **kwargs):
+    record(
+        rooms_deleted=1,
+        rooms_closed=int(instance.is_active),
+        private_rooms_closed=int(instance.is_active and instance.is_private)
+    )
+
+
+@receiver(post_delete, sender=Participation)
+def participation_deleted(sender, instance, **kwargs):
+    record(leaves=int(instance.time_out is None))
+
+
+@receiver(pre_save, sender=User)
+def account_saving(sender, instance, update_fields=None, **kwargs):
+    # Chỉ đọc lại khi is_admin có thể đổi (các lần lưu is_busy không tốn thêm query)
+    instance._was_admin = None
+    if instance.pk and (update_fields is None or 'is_admin' in update_fields):
+        instance._was_admin = User.objects.filter(pk=instance.pk).values_list('is_admin', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def account_saved(sender, instance, created, **kwargs):
+    if created:
+        record(accounts_created=int(not instance.is_admin))
+    elif getattr(instance, '_was_admin', None) not in (None, instance.is_admin):
+        # Thành admin thì ra khỏi số tài khoản, thôi làm admin thì được tính lại
+        record(accounts_created=int(not instance.is_admin), accounts_deleted=int(instance.is_admin))
+
+
+@receiver(post_delete, sender=User)
+def account_deleted(sender, instance, **kwargs):
+    record(accounts_deleted=int(not instance.is_admin))
@@ -1,3 +1,1149 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.db import IntegrityError, connection, connections, transaction
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils.timezone import now
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from PIL import Image
+
+from apps.accounts.models import User
+from blueroom.caching import TieredCache
+from blueroom.metrics import QueryBudgetExceeded, registry
+from .models import Background, Room, RoomActivityStat, RoomSubject, Participation, Subject
+from . import closing, lobby, presence, stats
+from .consumers import RoomConsumer
+from .events import room_group_name
+from .search import RoomSearchIndex
+from .serializers import BackgroundSerializer, EditPermissionSerializer, ParticipationSerializer, RoomSerializer
+from .snapshot import ActiveRoomSnapshot, active_rooms
+from .thumbnails import derivative_name, derivative_url
+from .views import DASHBOARD_CACHE_KEY
+
+
+def analyze(*tables):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute('ANALYZE TABLE %s' % ', '.join(tables))
+        else:
+            cursor.execute('ANALYZE')
+
+
+class ParticipationIndexTests(TestCase):
+    """
+    Các truy vấn nóng trên participations phải đi qua composite index,
+    không quét cả bảng, kể cả khi bảng đã có nhiều dòng.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # bulk_create không trả về id trên MySQL nên các dòng được tham chiếu tạo từng cái
+        cls.users = [
+            User.objects.create(username=f'user{i}', email=f'user{i}@example.com', password='x') for i in range(200)
+        ]
+        cls.rooms = [Room.objects.create(title=f'room {i}', created_by=cls.users[i]) for i in range(50)]
+        cls.now = now()
+        Participation.objects.bulk_create([
+            Participation(
+                user_id=cls.users[i % 200],
+                room_id=cls.rooms[i % 50],
+                time_in=cls.now - timedelta(minutes=i),
+                time_out=None if i % 10 == 0 else cls.now,
+            ) for i in range(5000)
+        ])
+        analyze('participations')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_open_members_of_room(self):
+        queryset = Participation.objects.filter(room_id=self.rooms[3], time_out__isnull=True)
+        self.assertUsesIndex(queryset, 'part_room_open_idx')
+
+    def test_open_participation_of_user(self):
+        queryset = Participation.objects.filter(user_id=self.users[3], room_id=self.rooms[3], time_out__isnull=True)
+        self.assertUsesIndex(queryset, 'part_user_room_open_idx')
+
+    def test_user_history(self):
+        queryset = Participation.objects.filter(user_id=self.users[3], time_in__gte=self.now - timedelta(hours=24))
+        self.assertUsesIndex(queryset, 'part_user_time_in_idx')
+
+
+class MemberCounterConcurrencyTests(TransactionTestCase):
+    """
+    Nhiều user vào / ra cùng một phòng song song: bộ đếm members và
+    members_max không được mất lượt cập nhật.
+    """
+
+    joins = 40
+    leaves = 15
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("SQLite in-memory test DB khóa cả bảng khi ghi song song")
+
+        self.owner = User.objects.create(username='owner', email='owner@example.com', password='x')
+        self.room = Room.objects.create(title='busy room', created_by=self.owner)
+        Participation.objects.create(user_id=self.owner, room_id=self.room, time_in=now())
+        self.users = [
+            User.objects.create(username=f'member{i}', email=f'member{i}@example.com', password='x')
+            for i in range(self.joins)
+        ]
+
+    def run_parallel(self, action, users):
+        barrier = threading.Barrier(len(users))
+
+        def call(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                return client.post(f'/api/rooms/room/{self.room.id}/{action}/').status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=len(users)) as executor:
+            return list(executor.map(call, users))
+
+    def test_parallel_joins_and_leaves(self):
+        statuses = self.run_parallel('join', self.users)
+        self.assertEqual(statuses, [200] * self.joins)
+
+        # Mỗi user gửi leave hai lần cùng lúc: chỉ một lần được trừ thành viên
+        leaving = self.users[:self.leaves]
+        statuses = self.run_parallel('leave', leaving + leaving)
+        self.assertTrue(set(statuses) <= {200, 400})
+
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.members, 1 + self.joins - self.leaves)
+        self.assertEqual(self.room.members_max, 1 + self.joins)
+        self.assertEqual(
+            Participation.objects.filter(room_id=self.room, time_out__isnull=True).count(),
+            self.room.members
+        )
+
+
+class BlockMemberTests(TestCase):
+    """
+    Chặn cùng một người hai lần (hai request đọc participation trước khi
+    request kia ghi) chỉ được trừ thành viên một lần.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', email='owner@example.com', password='x', is_busy=True)
+        cls.member = User.objects.create(username='member', email='member@example.com', password='x', is_busy=True)
+        cls.room = Room.objects.create(title='room', created_by=cls.owner, members=2, members_max=2)
+        for user in (cls.owner, cls.member):
+            Participation.objects.create(user_id=user, room_id=cls.room, time_in=now())
+
+    def setUp(self):
+        caches['shared'].clear()
+
+    def assertBlockedOnce(self):
+        self.room.refresh_from_db()
+        self.member.refresh_from_db()
+        self.assertEqual(self.room.members, 1)
+        self.assertFalse(self.member.is_busy)
+        stats.flush()
+        self.assertEqual(RoomActivityStat.objects.get().leaves, 1)
+        self.assertFalse(Participation.objects.filter(user_id=self.member, time_out__isnull=True).exists())
+
+    def test_edit_permissions_block(self):
+        stale = [Participation.objects.get(user_id=self.member, time_out__isnull=True) for _ in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            for participation in stale:
+                EditPermissionSerializer().update(participation, {'is_blocked': 1})
+        self.assertBlockedOnce()
+
+        # Sửa tiếp trên bản cũ không dời thời điểm đóng
+        closed_at = Participation.objects.get(user_id=self.member).time_out
+        self.assertEqual(stale[1].time_out, closed_at)
+        EditPermissionSerializer().update(stale[0], {'is_blocked': 1, 'mic_allow': 0})
+        EditPermissionSerializer().update(stale[1], {'mic_allow': 1})
+        self.assertEqual(Participation.objects.get(user_id=self.member).time_out, closed_at)
+        self.assertBlockedOnce()
+
+    def test_block_view(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        url = f'/api/rooms/{self.room.id}/block/'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.post(url, {'user_id': self.member.id}).status_code, 200)
+            self.assertEqual(client.post(url, {'user_id': self.member.id}).status_code, 404)
+        self.assertBlockedOnce()
+        self.assertTrue(Participation.objects.get(user_id=self.member).is_blocked)
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', email='admin@example.com', password='x', is_admin=True)
+        cls.user = User.objects.create(username='user', email='user@example.com', password='x')
+        cls.room = Room.objects.create(title='room', created_by=cls.user)
+
+    def setUp(self):
+        registry.reset()
+        active_rooms.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_room_active_within_budget(self):
+        response = self.client.get('/api/rooms/room/room-active/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-Query-Count', response)
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    @override_settings(QUERY_BUDGETS={'GET room-list-Room-Active': 0})
+    def test_over_budget_raises(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get('/api/rooms/room/room-active/')
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/rooms/room/room-active/')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        endpoints = self.client.get('/api/metrics/').data['endpoints']
+        self.assertEqual(endpoints['GET room-list-Room-Active']['count'], 1)
+
+
+class RoomSerializerQueryTests(TestCase):
+    """
+    Số query khi serialize danh sách phòng không phụ thuộc số phòng.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subjects = [Subject.objects.create(name=f'subject {i}') for i in range(5)]
+        background = Background.objects.create(bg='room-backgrounds/bg.jpg')
+        for i in range(30):
+            user = User.objects.create(username=f'owner{i}', email=f'owner{i}@example.com', password='x')
+            room = Room.objects.create(title=f'room {i}', created_by=user, background=background, members=i)
+            RoomSubject.objects.create(room_id=room, subject_id=cls.subjects[i % 5])
+            RoomSubject.objects.create(room_id=room, subject_id=cls.subjects[(i + 1) % 5])
+        cls.user = user
+
+    def setUp(self):
+        active_rooms.invalidate()
+
+    def test_serializer_uses_prefetch(self):
+        with self.assertNumQueries(2):
+            data = RoomSerializer(RoomSerializer.setup_eager_loading(Room.objects.all()), many=True).data
+        self.assertEqual(len(data), 30)
+        self.assertEqual(data[0]['subjects'], [
+            {'id': self.subjects[0].id, 'name': 'subject 0'},
+            {'id': self.subjects[1].id, 'name': 'subject 1'},
+        ])
+        self.assertEqual(data[0]['created_by'], 'owner0')
+
+    def test_room_list_endpoints(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(client.get('/api/rooms/room/').status_code, 200)
+        # Lần tìm đầu tiên nạp snapshot: phòng + subjects
+        with self.assertNumQueries(2):
+            response = client.get('/api/rooms/room/room-active/', {'query': 'subject 3'})
+        self.assertEqual(len(response.data), 12)
+
+
+class RoomSearchIndexTests(TestCase):
+    def setUp(self):
+        self.index = RoomSearchIndex()
+        self.index.add(1, 'Ôn thi Toán cao cấp', 'Giải tích và đại số', ['Toán'])
+        self.index.add(2, 'English speaking club', 'Practice math vocabulary', ['English'])
+        self.index.add(3, 'Mathematics marathon', 'Late night study', ['Math', 'Physics'])
+
+    def test_prefix_and_accents(self):
+        self.assertEqual(set(self.index.search('toan')), {1})
+        self.assertEqual(set(self.index.search('đại')), {1})
+        self.assertEqual(set(self.index.search('mat')), {2, 3})
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(set(self.index.search('math physics')), {3})
+        self.assertEqual(self.index.search('math chemistry'), {})
+        self.assertEqual(self.index.search('  '), {})
+
+    def test_title_ranks_above_description(self):
+        scores = self.index.search('math')
+        self.assertGreater(scores[3], scores[2])
+
+    def test_remove(self):
+        self.index.remove(3)
+        self.assertEqual(set(self.index.search('math')), {2})
+        self.index.remove(2)
+        self.assertEqual(self.index.search('math'), {})
+        self.assertEqual(len(self.index), 1)
+
+
+class RoomSearchEndpointTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner', email='owner@example.com', password='x')
+        cls.rooms = [
+            Room.objects.create(title=f'Physics group {i}', description='mechanics', created_by=cls.user)
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        active_rooms.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **params):
+        return self.client.get('/api/rooms/room/room-active/', params)
+
+    def test_limit_offset(self):
+        response = self.search(query='physics', limit=2, offset=1)
+        self.assertEqual(response['X-Total-Count'], '5')
+        # Cùng điểm: phòng mới tạo trước
+        self.assertEqual([room['id'] for room in response.data], [self.rooms[3].id, self.rooms[2].id])
+        self.assertEqual(self.search(query='physics', limit='x').status_code, 400)
+
+    def test_index_follows_room_changes(self):
+        self.assertEqual(len(self.search(query='physics').data), 5)
+
+        self.rooms[0].title = 'Chemistry'
+        self.rooms[0].save()
+        active_rooms.refresh_room(self.rooms[0].id)
+        self.assertEqual(self.search(query='chem').data[0]['id'], self.rooms[0].id)
+
+        active_rooms.remove_room(self.rooms[1].id)
+        self.assertEqual(self.search(query='physics')['X-Total-Count'], '3')
+
+
+@override_settings(REPORT_EXPORT_CHUNK_SIZE=3)
+@override_settings(REPORT_EXPORT_CHUNK_SIZE=3)
+class ReportExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', email='admin@example.com', password='x', is_admin=True)
+        cls.token = Token.objects.create(user=cls.admin)
+        subject = Subject.objects.create(name='Toán')
+        cls.rooms = []
+        for i in range(7):
+            room = Room.objects.create(title=f'room {i}', created_by=cls.admin, members=i)
+            RoomSubject.objects.create(room_id=room, subject_id=subject)
+            cls.rooms.append(room)
+
+    def setUp(self):
+        active_rooms.invalidate()
+        # Client async: response được đọc như khi chạy dưới Daphne
+        self.client = AsyncClient()
+        self.headers = {'Authorization': f'Token {self.token.key}'}
+        self.today = now().strftime('%Y-%m-%d')
+
+    async def export(self, export):
+        return await self.client.post('/api/rooms/admin/reports/room-created-report/', {
+            'start_date': self.today, 'end_date': self.today, 'export': export
+        }, headers=self.headers)
+
+    async def read(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    async def test_ndjson(self):
+        response = await self.export('ndjson')
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in (await self.read(response)).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [room.id for room in self.rooms])
+        self.assertEqual(rows[0]['subjects'], [{'id': rows[0]['subjects'][0]['id'], 'name': 'Toán'}])
+
+    async def test_rows_are_sent_chunk_by_chunk(self):
+        response = await self.export('ndjson')
+        lines = aiter(response.streaming_content)
+        self.assertEqual(json.loads(await anext(lines))['id'], self.rooms[0].id)
+
+        # Lô sau chỉ được query khi tới lượt gửi, nên thấy cả phòng vừa tạo
+        late = await Room.objects.acreate(title='late', created_by=self.admin)
+        rest = [json.loads(line)['id'] async for line in lines]
+        self.assertEqual(rest, [room.id for room in self.rooms[1:]] + [late.id])
+
+    async def test_csv(self):
+        response = await self.export('csv')
+        rows = list(csv.DictReader(io.StringIO(await self.read(response))))
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[6]['title'], 'room 6')
+        self.assertEqual(rows[6]['subjects'], 'Toán')
+
+    async def test_json_and_unknown_format(self):
+        response = await self.export('')
+        self.assertEqual(response.json()['total_rooms_created'], 7)
+        self.assertEqual((await self.export('xml')).status_code, 400)
+
+    async def test_popular_export(self):
+        response = await self.client.get('/api/rooms/admin/reports/room-popular-report/', {'n': 2, 'export': 'ndjson'},
+                                         headers=self.headers)
+        rows = [json.loads(line) for line in (await self.read(response)).splitlines()]
+        self.assertEqual([row['members'] for row in rows], [6, 5])
+
+
+class RoomActivityStatTests(TestCase):
+    """
+    Báo cáo đọc từ bảng thống kê theo giờ phải khớp với COUNT trực tiếp.
+    """
+
+    def setUp(self):
+        caches['shared'].clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin = User.objects.create(username='admin', email='admin@example.com', password='x', is_admin=True)
+            self.users = [User.objects.create(username=f'u{i}', email=f'u{i}@example.com', password='x') for i in range(4)]
+
+    def call(self, user, method, url, data=None):
+        # Bộ đếm chỉ được cộng khi transaction commit
+        client = APIClient()
+        client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return getattr(client, method)(url, data)
+
+    def reports(self):
+        data = {}
+        for report in ('account-report', 'type-room-report', 'room-active-report'):
+            data.update(self.call(self.admin, 'get', f'/api/rooms/admin/reports/{report}/').data)
+        return data
+
+    def expected(self):
+        return {
+            'total_account': User.objects.filter(is_admin=False).count(),
+            'account_in_room': Participation.objects.filter(time_out__isnull=True).values('user_id').distinct().count(),
+            'total_room_active': Room.objects.filter(is_active=True).count(),
+            'total_private_room': Room.objects.filter(is_active=True, is_private=True).count(),
+            'total_room': Room.objects.count(),
+        }
+
+    def create_room(self, user, **data):
+        response = self.call(user, 'post', '/api/rooms/room/', {'title': 'room', **data})
+        self.assertEqual(response.status_code, 201)
+        return Room.objects.filter(created_by=user).latest('id')
+
+    def test_counters_follow_write_paths(self):
+        owner, member, other, deleted = self.users
+        room = self.create_room(owner, is_private=True)
+        self.call(member, 'post', f'/api/rooms/room/{room.id}/join/')
+        self.call(other, 'post', f'/api/rooms/room/{room.id}/join/')
+        self.call(member, 'post', f'/api/chat/{room.id}/send-messages/', {'message': 'hi'})
+        self.call(member, 'post', f'/api/rooms/room/{room.id}/leave/')
+        self.assertEqual(self.reports(), self.expected())
+
+        self.call(owner, 'post', f'/api/rooms/room/{room.id}/leave/')
+        second = self.create_room(member)
+        self.call(deleted, 'post', f'/api/rooms/room/{second.id}/join/')
+        with self.captureOnCommitCallbacks(execute=True):
+            deleted.delete()
+        self.assertEqual(self.reports(), self.expected())
+        self.assertEqual(self.expected()['total_private_room'], 0)
+        stats.flush()
+        self.assertEqual(RoomActivityStat.objects.get().messages_sent, 1)
+
+        self.call(member, 'delete', f'/api/rooms/room/{second.id}/')
+        self.assertEqual(self.reports(), self.expected())
+
+    def test_untracked_state_changes_are_counted(self):
+        room = self.create_room(self.users[0], is_private=True)
+        self.call(self.users[0], 'patch', f'/api/rooms/room/{room.id}/', {'is_active': False})
+        self.assertEqual(self.reports(), self.expected())
+        self.assertEqual(self.reports()['total_room_active'], 0)
+        self.call(self.users[0], 'patch', f'/api/rooms/room/{room.id}/', {'is_active': True})
+        self.assertEqual(self.reports()['total_private_room'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[2].is_admin = True
+            self.users[2].save()
+        self.assertEqual(self.reports(), self.expected())
+        self.assertEqual(self.reports()['total_account'], 3)
+
+    def test_figures_read_one_aggregate_and_unflushed_increments(self):
+        room = self.create_room(self.users[0])
+        stats.flush()
+        # Trong STATS_FLUSH_INTERVAL, record() chỉ cộng trên cache
+        with self.assertNumQueries(0):
+            with self.captureOnCommitCallbacks(execute=True):
+                stats.record(joins=1)
+        self.assertEqual(RoomActivityStat.objects.get().joins, 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(stats.report_figures()['account_in_room'], 2)
+
+        stats.flush()
+        self.assertEqual(RoomActivityStat.objects.get().joins, 2)
+        self.assertEqual(stats.report_figures()['account_in_room'], 2)
+
+    def test_rolled_back_write_is_not_counted(self):
+        try:
+            with transaction.atomic():
+                stats.record(joins=1)
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        with self.captureOnCommitCallbacks(execute=True):
+            pass
+        self.assertEqual(stats.report_figures()['account_in_room'], 0)
+
+    def test_backfill(self):
+        room = self.create_room(self.users[0])
+        self.call(self.users[1], 'post', f'/api/rooms/room/{room.id}/join/')
+        self.create_room(self.users[2], is_private=True)
+        self.call(self.users[0], 'post', f'/api/rooms/room/{room.id}/leave/')
+        before = self.reports()
+
+        stats.flush()
+        RoomActivityStat.objects.all().delete()
+        call_command('backfill_room_stats', stdout=io.StringIO())
+        self.assertEqual(self.reports(), before)
+        self.assertEqual(before, self.expected())
+
+        today = now().strftime('%Y-%m-%d')
+        days = self.call(
+            self.admin, 'get', '/api/rooms/admin/reports/activity-report/', {'start_date': today, 'end_date': today}
+        ).data['days']
+        self.assertEqual(days[0]['rooms_created'], 2)
+        self.assertEqual(days[0]['joins'], 3)
+
+
+    def test_backfill_keeps_live_counters_of_current_hour(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            stats.record(joins=5)
+        call_command('backfill_room_stats', stdout=io.StringIO())
+        stats.flush()
+        self.assertEqual(RoomActivityStat.objects.get(bucket=stats.hour_bucket()).joins, 5)
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            admin = User.objects.create(username='admin', email='admin@example.com', password='x', is_admin=True)
+            owner = User.objects.create(username='owner', email='owner@example.com', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/rooms/room/', {'title': 'room', 'is_private': True})
+        self.client.force_authenticate(admin)
+
+    def test_counted_once_then_cached(self):
+        url = '/api/rooms/admin/reports/dashboard/'
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.data, {
+            'total_account': 1, 'account_in_room': 1, 'total_room': 1,
+            'total_room_active': 1, 'total_private_room': 1,
+        })
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_cache_miss_is_one_aggregate(self):
+        url = '/api/rooms/admin/reports/dashboard/'
+        first = self.client.get(url)
+        member_client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            member = User.objects.create(username='member', email='member@example.com', password='x')
+            member_client.force_authenticate(member)
+            member_client.post(f'/api/rooms/room/{Room.objects.get().id}/join/')
+
+        caches['shared'].delete(DASHBOARD_CACHE_KEY)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(len(queries), 1)
+        self.assertIn('SUM(', queries[0]['sql'].upper())
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual((response.data['total_account'], response.data['account_in_room']), (2, 2))
+
+
+class LobbyDeltaTests(TestCase):
+    """
+    Socket lobby nhận delta có `seq` tăng liên tục theo từng thay đổi, và
+    `resync` trả lại snapshot kèm seq hiện tại.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', email='owner@example.com', password='x')
+        cls.member = User.objects.create(username='member', email='member@example.com', password='x')
+        cls.room = Room.objects.create(title='existing', created_by=cls.owner)
+
+    def setUp(self):
+        active_rooms.invalidate()
+        caches['shared'].clear()
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(
+            URLRouter([path('ws/rooms/', RoomConsumer.as_asgi())]), '/ws/rooms/'
+        )
+        await communicator.connect()
+        initial = await communicator.receive_json_from()
+        self.assertEqual(initial['type'], 'initial_rooms')
+        return communicator, initial
+
+    async def deltas(self, communicator):
+        frames = []
+        while not await communicator.receive_nothing(0.05):
+            frames.append(await communicator.receive_json_from())
+        return frames
+
+    async def as_user(self, user, url, data=None):
+        def call():
+            client = APIClient()
+            client.force_authenticate(user)
+            with self.captureOnCommitCallbacks(execute=True):
+                return client.post(url, data or {})
+        response = await sync_to_async(call)()
+        self.assertIn(response.status_code, (200, 201))
+        return response
+
+    async def test_deltas_follow_write_paths(self):
+        communicator, initial = await self.connect()
+        self.assertEqual([room['id'] for room in initial['messages']], [self.room.id])
+
+        await self.as_user(self.owner, '/api/rooms/room/', {'title': 'new room'})
+        room = await Room.objects.aget(title='new room')
+        await self.as_user(self.member, f'/api/rooms/room/{room.id}/join/')
+        await self.as_user(self.owner, f'/api/rooms/room/{room.id}/leave/')
+        frames = await self.deltas(communicator)
+
+        self.assertEqual({frame['v'] for frame in frames}, {lobby.DELTA_VERSION})
+        self.assertEqual([frame['seq'] for frame in frames],
+                         list(range(initial['seq'] + 1, initial['seq'] + 1 + len(frames))))
+        changes = [frame for frame in frames if frame['type'] != 'leaderboard']
+        self.assertEqual([frame['type'] for frame in changes], ['room_opened', 'members_changed', 'room_closed'])
+        self.assertEqual(changes[0]['room']['id'], room.id)
+        self.assertEqual((changes[1]['room_id'], changes[1]['members']), (room.id, 2))
+        self.assertEqual(changes[2]['room_id'], room.id)
+        await communicator.disconnect()
+
+    async def test_resync_returns_snapshot_at_current_seq(self):
+        communicator, initial = await self.connect()
+
+        def change_members():
+            with self.captureOnCommitCallbacks(execute=True):
+                lobby.members_changed(self.room.id, 4)
+        await sync_to_async(change_members)()
+        last = (await self.deltas(communicator))[-1]
+        self.assertEqual(last['type'], 'members_changed')
+        self.assertGreater(last['seq'], initial['seq'])
+
+        # Client phát hiện lỡ delta thì xin lại toàn bộ
+        await communicator.send_json_to({'type': 'resync'})
+        resynced = await communicator.receive_json_from()
+        self.assertEqual((resynced['type'], resynced['seq']), ('initial_rooms', last['seq']))
+        self.assertEqual(resynced['messages'][0]['members'], 4)
+
+        other, other_initial = await self.connect()
+        self.assertEqual(other_initial['seq'], last['seq'])
+        for socket in (communicator, other):
+            await socket.disconnect()
+
+    def test_snapshot_is_shared_and_stamped_with_its_seq(self):
+        # Một worker khác: cùng cache shared, không chung bộ nhớ process
+        other_worker = ActiveRoomSnapshot()
+        self.assertEqual(other_worker.lobby_rooms()[0]['members'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lobby.members_changed(self.room.id, 6)
+        seq, rooms_json = other_worker.lobby_state()
+        self.assertEqual(json.loads(rooms_json)[0]['members'], 6)
+        self.assertEqual(seq, active_rooms.lobby_state()[0])
+
+        # seq chung đã tăng nhưng thay đổi chưa vào snapshot: initial_rooms vẫn gửi seq của snapshot
+        lobby.next_sequence()
+        self.assertEqual(other_worker.lobby_state()[0], seq)
+
+
+class LeaderboardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', email='admin@example.com', password='x', is_admin=True)
+        cls.rooms = [
+            Room.objects.create(title=f'room {i}', created_by=cls.admin, members=members)
+            for i, members in enumerate([3, 8, 5, 1])
+        ]
+
+    def setUp(self):
+        active_rooms.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def popular(self, n):
+        return self.client.get('/api/rooms/admin/reports/room-popular-report/', {'n': n}).data['rooms']
+
+    def test_served_from_snapshot(self):
+        self.assertEqual([room['members'] for room in self.popular(3)], [8, 5, 3])
+        with self.assertNumQueries(0):
+            self.popular(2)
+
+    def test_rank_changes_are_pushed(self):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(lobby.LOBBY_GROUP, channel)
+        active_rooms.popular(1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lobby.members_changed(self.rooms[3].id, 9)
+
+        leaderboard = json.loads(async_to_sync(layer.receive)(channel)['text'])
+        self.assertEqual(leaderboard['type'], 'leaderboard')
+        self.assertEqual(leaderboard['rooms'][:2], [
+            {'room_id': self.rooms[3].id, 'members': 9},
+            {'room_id': self.rooms[1].id, 'members': 8},
+        ])
+        self.assertEqual(json.loads(async_to_sync(layer.receive)(channel)['text'])['type'], 'members_changed')
+        self.assertEqual(self.popular(1)[0]['id'], self.rooms[3].id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lobby.room_closed(self.rooms[3].id)
+        self.assertEqual(json.loads(async_to_sync(layer.receive)(channel)['text'])['type'], 'leaderboard')
+        self.assertEqual(self.popular(1)[0]['id'], self.rooms[1].id)
+        async_to_sync(layer.group_discard)(lobby.LOBBY_GROUP, channel)
+
+    def test_workers_share_one_leaderboard(self):
+        workers = [active_rooms, ActiveRoomSnapshot()]
+        version = workers[1].leaderboard_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lobby.members_changed(self.rooms[0].id, 3)
+        self.assertEqual(workers[1].leaderboard_version(), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lobby.members_changed(self.rooms[3].id, 9)
+        boards = [worker.leaderboard(2) for worker in workers]
+        self.assertEqual(boards[0], boards[1])
+        self.assertEqual(boards[1][0], {'room_id': self.rooms[3].id, 'members': 9})
+        self.assertNotEqual(workers[1].leaderboard_version(), version)
+        with self.assertNumQueries(0):
+            self.assertEqual(workers[1].popular(1)[0]['id'], self.rooms[3].id)
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+        self.cache = TieredCache()
+
+    def test_versions_invalidate(self):
+        values = iter(range(10))
+        self.assertEqual(self.cache.get_or_set('key', lambda: next(values), versions=['ns']), 0)
+        self.assertEqual(self.cache.get_or_set('key', lambda: next(values), versions=['ns']), 0)
+        self.cache.bump('ns')
+        self.assertEqual(self.cache.get_or_set('key', lambda: next(values), versions=['ns']), 1)
+        self.assertEqual(self.cache.get_or_set('key', lambda: next(values), versions=['other']), 2)
+
+    def test_single_flight(self):
+        calls = []
+        barrier = threading.Barrier(8)
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'value'
+
+        def call(_):
+            barrier.wait()
+            return self.cache.get_or_set('slow', compute, versions=['ns'])
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(call, range(8)))
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(len(calls), 1)
+
+
+class CachedEndpointTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', email='owner@example.com', password='x')
+        cls.member = User.objects.create(username='member', email='member@example.com', password='x')
+        cls.room = Room.objects.create(title='room', created_by=cls.owner)
+        Participation.objects.create(user_id=cls.owner, room_id=cls.room, time_in=now())
+        Subject.objects.create(name='Toán')
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.member)
+
+    def test_subject_list(self):
+        self.assertEqual(len(self.client.get('/api/rooms/subjects/').data), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get('/api/rooms/subjects/').data), 1)
+
+        Subject.objects.create(name='Lý')
+        self.assertEqual(len(self.client.get('/api/rooms/subjects/').data), 2)
+
+    def test_room_detail_and_profile_follow_join(self):
+        url = f'/api/rooms/room/{self.room.id}/'
+        self.assertEqual(self.client.get(url).data['members'], 1)
+        self.assertFalse(self.client.get('/api/accounts/users/profile/').data['is_busy'])
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        self.client.post(f'/api/rooms/room/{self.room.id}/join/')
+        self.assertEqual(self.client.get(url).data['members'], 2)
+        self.member.refresh_from_db()
+        self.client.force_authenticate(self.member)
+        self.assertTrue(self.client.get('/api/accounts/users/profile/').data['is_busy'])
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', email='owner@example.com', password='x')
+        cls.member = User.objects.create(username='member', email='member@example.com', password='x')
+        cls.room = Room.objects.create(title='room', created_by=cls.owner)
+        Participation.objects.create(user_id=cls.owner, room_id=cls.room, time_in=now())
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+        active_rooms.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.member)
+
+    def assertNotModified(self, url, response):
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_subjects(self):
+        url = '/api/rooms/subjects/'
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        self.assertNotModified(url, response)
+
+        Subject.objects.create(name='Hóa')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_members_in_room(self):
+        url = f'/api/rooms/room/{self.room.id}/members-in-room/'
+        response = self.client.get(url)
+        self.assertNotModified(url, response)
+
+        self.client.post(f'/api/rooms/room/{self.room.id}/join/')
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(len(changed.data), 2)
+
+        self.client.post(f'/api/rooms/room/{self.room.id}/leave/')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=changed['ETag']).status_code, 200)
+
+    def test_room_active(self):
+        url = '/api/rooms/room/room-active/'
+        response = self.client.get(url)
+        self.assertNotModified(url, response)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/rooms/room/{self.room.id}/join/')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class AsyncJoinLeaveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', email='owner@example.com', password='x')
+        cls.member = User.objects.create(username='member', email='member@example.com', password='x')
+        cls.room = Room.objects.create(title='room', created_by=cls.owner)
+        Participation.objects.create(user_id=cls.owner, room_id=cls.room, time_in=now())
+
+    def setUp(self):
+        active_rooms.invalidate()
+        caches['shared'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.member)
+
+    def test_errors(self):
+        url = f'/api/rooms/room/{self.room.id}/join/'
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.assertEqual(self.client.post('/api/rooms/room/0/join/').status_code, 404)
+        self.assertEqual(APIClient().post(url).status_code, 401)
+
+        token = Token.objects.create(user=self.member)
+        self.client.force_authenticate()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(self.client.post(f'/api/rooms/room/{self.room.id}/leave/').json()['message'],
+                         "Bạn chưa tham gia phòng này.")
+
+    def test_join_and_leave_notify_groups(self):
+        layer = get_channel_layer()
+        lobby_channel = async_to_sync(layer.new_channel)()
+        room_channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(lobby.LOBBY_GROUP, lobby_channel)
+        async_to_sync(layer.group_add)(room_group_name(self.room.id), room_channel)
+        active_rooms.popular(1)
+
+        response = self.client.post(f'/api/rooms/room/{self.room.id}/join/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['message'], "Bạn đã tham gia phòng thành công.")
+        deltas = [json.loads(async_to_sync(layer.receive)(lobby_channel)['text']) for _ in range(2)]
+        self.assertEqual(deltas[-1], {
+            'type': 'members_changed', 'v': lobby.DELTA_VERSION, 'seq': deltas[-1]['seq'],
+            'room_id': self.room.id, 'members': 2
+        })
+
+        self.assertEqual(self.client.post(f'/api/rooms/room/{self.room.id}/leave/').status_code, 200)
+        self.assertEqual(async_to_sync(layer.receive)(room_channel),
+                         {'type': 'participation.changed', 'user_id': self.member.id})
+        self.member.refresh_from_db()
+        self.room.refresh_from_db()
+        self.assertFalse(self.member.is_busy)
+        self.assertEqual((self.room.members, self.room.members_max), (1, 2))
+
+        async_to_sync(layer.group_discard)(lobby.LOBBY_GROUP, lobby_channel)
+        async_to_sync(layer.group_discard)(room_group_name(self.room.id), room_channel)
+
+
+class PresenceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', email='owner@example.com', password='x')
+        cls.member = User.objects.create(username='member', email='member@example.com', password='x')
+        cls.room = Room.objects.create(title='room', created_by=cls.owner)
+        Participation.objects.create(user_id=cls.owner, room_id=cls.room, time_in=now())
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['shared'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.member)
+
+    def test_members_in_room_served_from_registry(self):
+        url = f'/api/rooms/room/{self.room.id}/members-in-room/'
+        self.assertEqual(len(self.client.get(url).data), 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.client.get(url).data), 1)
+
+        self.client.post(f'/api/rooms/room/{self.room.id}/join/')
+        # Vào phòng qua REST không ghi heartbeat, chỉ socket mới ghi
+        self.assertNotIn(self.member.id, presence.heartbeats(self.room.id))
+        with self.assertNumQueries(1):
+            data = self.client.get(url).data
+        self.assertEqual([member['user']['id'] for member in data], [self.owner.id, self.member.id])
+
+        self.client.post(f'/api/rooms/room/{self.room.id}/leave/')
+        self.assertEqual([member['user']['id'] for member in self.client.get(url).data], [self.owner.id])
+
+    def test_reaper_closes_stale_participations(self):
+        self.client.post(f'/api/rooms/room/{self.room.id}/join/')
+        presence.touch(self.room.id, self.owner.id)
+        caches['shared'].set(presence.presence_key(self.room.id), {
+            **presence.heartbeats(self.room.id), self.member.id: time.time() - 1000
+        })
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(presence.reap(), 1)
+
+        self.member.refresh_from_db()
+        self.room.refresh_from_db()
+        self.assertFalse(self.member.is_busy)
+        self.assertEqual(self.room.members, 1)
+        self.assertFalse(Participation.objects.filter(user_id=self.member, time_out__isnull=True).exists())
+        self.assertEqual(list(presence.heartbeats(self.room.id)), [self.owner.id])
+        self.assertEqual(len(self.client.get(f'/api/rooms/room/{self.room.id}/members-in-room/').data), 1)
+
+    def test_reaper_ignores_rest_only_participants(self):
+        # Chủ phòng và thành viên chỉ dùng REST, không mở socket có token
+        self.client.post(f'/api/rooms/room/{self.room.id}/join/')
+
+        for _ in range(2):
+            self.assertEqual(presence.reap(timeout=0.001), 0)
+            time.sleep(0.01)
+        self.room.refresh_from_db()
+        self.assertTrue(self.room.is_active)
+        self.assertEqual(Participation.objects.filter(room_id=self.room, time_out__isnull=True).count(), 2)
+
+    def test_reaper_reads_only_the_registry_when_nothing_is_stale(self):
+        self.client.post(f'/api/rooms/room/{self.room.id}/join/')
+        presence.touch(self.room.id, self.owner.id, self.member.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(presence.reap(), 0)
+
+        presence.forget(self.room.id, self.owner.id, self.member.id)
+        self.assertEqual(caches['shared'].get(presence.ROOMS_KEY), set())
+
+
+class CloseRoomTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', email='owner@example.com', password='x', is_busy=True)
+        cls.members = [
+            User.objects.create(username=f'member{i}', email=f'member{i}@example.com', password='x', is_busy=True)
+            for i in range(12)
+        ]
+
+    def setUp(self):
+        active_rooms.invalidate()
+        caches['shared'].clear()
+
+    def open_room(self, size):
+        room = Room.objects.create(title='room', created_by=self.owner, members=size + 1)
+        for user in [self.owner, *self.members[:size]]:
+            Participation.objects.create(user_id=user, room_id=room, time_in=now())
+        return room
+
+    def test_owner_leave_frees_every_member(self):
+        room = self.open_room(3)
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(room_group_name(room.id), channel)
+
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.post(f'/api/rooms/room/{room.id}/leave/').status_code, 200)
+
+        self.assertFalse(User.objects.filter(id__in=[self.owner.id, *[user.id for user in self.members[:3]]], is_busy=True).exists())
+        self.assertFalse(Participation.objects.filter(room_id=room, time_out__isnull=True).exists())
+        self.assertEqual(async_to_sync(layer.receive)(channel), {'type': 'room.closed', 'room_id': room.id})
+        self.assertEqual(RoomActivityStat.objects.get().leaves, 4)
+        self.assertFalse(closing.close_room(room))
+        async_to_sync(layer.group_discard)(room_group_name(room.id), channel)
+
+    def test_query_count_does_not_grow_with_room_size(self):
+        counts = []
+        for size in (1, 12):
+            room = self.open_room(size)
+            with CaptureQueriesContext(connection) as queries:
+                closing.close_room(room)
+            counts.append(len(queries))
+            User.objects.update(is_busy=True)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_reaper_closes_room_of_stale_owner(self):
+        room = self.open_room(2)
+        presence.touch(room.id, self.owner.id, *[user.id for user in self.members[:2]])
+        caches['shared'].set(presence.presence_key(room.id), {
+            **presence.heartbeats(room.id), self.owner.id: time.time() - 1000
+        })
+
+        self.assertEqual(presence.reap(), 3)
+        room.refresh_from_db()
+        self.assertFalse(room.is_active)
+        self.assertFalse(User.objects.filter(is_busy=True).exclude(id__in=[user.id for user in self.members[2:]]).exists())
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        active_rooms.invalidate()
+        caches['default'].clear()
+        caches['shared'].clear()
+
+    def image(self, name, size, mode='RGB'):
+        buffer = io.BytesIO()
+        Image.new(mode, size, 'red').save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_derivatives_created_on_upload(self):
+        user = User.objects.create(username='owner', email='owner@example.com', password='x',
+                                   avatar=self.image('me.png', (800, 600), 'RGBA'))
+        background = Background.objects.create(bg=self.image('sea.png', (3000, 2000)))
+
+        for name, size in [(derivative_name(user.avatar.name, 'sm', 'webp'), (96, 96)),
+                           (derivative_name(user.avatar.name, 'md', 'jpg'), (256, 256)),
+                           (derivative_name(background.bg.name, 'lg', 'webp'), (1280, 720))]:
+            with default_storage.open(name) as file, Image.open(file) as image:
+                self.assertEqual(image.size, size)
+
+        room = Room.objects.create(title='room', created_by=user, background=background)
+        Participation.objects.create(user_id=user, room_id=room, time_in=now())
+        client = APIClient()
+        client.force_authenticate(user)
+
+        members = client.get(f'/api/rooms/room/{room.id}/members-in-room/').data
+        self.assertTrue(members[0]['user']['avatar'].endswith('.sm.webp'))
+        self.assertTrue(client.get(f'/api/rooms/room/{room.id}/').data['background']['thumbnail'].endswith('.sm.webp'))
+        self.assertEqual(active_rooms.lobby_rooms()[0]['background'], derivative_name(background.bg.name, 'sm'))
+
+    def test_missing_thumbnails_fall_back_to_original(self):
+        background = Background.objects.create(bg=self.image('old.png', (640, 480)))
+        for size in ('sm', 'lg'):
+            for ext in ('webp', 'jpg'):
+                default_storage.delete(derivative_name(background.bg.name, size, ext))
+        caches['shared'].clear()
+        with self.assertLogs('apps.rooms.thumbnails', 'WARNING'):
+            broken = User.objects.create(username='broken', email='broken@example.com', password='x',
+                                         avatar=SimpleUploadedFile('broken.png', b'not an image', content_type='image/png'))
+
+        self.assertEqual(BackgroundSerializer(background).data['thumbnail'], background.bg.url)
+        self.assertEqual(derivative_url(broken.avatar, 'sm'), broken.avatar.url)
+
+        with self.assertLogs('apps.rooms.thumbnails', 'WARNING'):
+            call_command('generate_thumbnails', stdout=io.StringIO())
+        self.assertTrue(BackgroundSerializer(background).data['thumbnail'].endswith('.sm.webp'))
+        self.assertEqual(derivative_url(broken.avatar, 'sm'), broken.avatar.url)
+
+    def test_page_resolved_with_one_cache_read(self):
+        owner = User.objects.create(username='owner', email='owner@example.com', password='x')
+        room = Room.objects.create(title='room', created_by=owner)
+        for i in range(3):
+            user = User.objects.create(username=f'user{i}', email=f'user{i}@example.com', password='x',
+                                       avatar=self.image(f'user{i}.png', (200, 200)))
+            Participation.objects.create(user_id=user, room_id=room, time_in=now())
+        participations = list(Participation.objects.select_related('user_id', 'room_id'))
+
+        shared = caches['shared']
+        with mock.patch('apps.rooms.thumbnails.is_generated') as is_generated, \
+                mock.patch.object(shared, 'get_many', wraps=shared.get_many) as get_many, \
+                mock.patch.object(default_storage, 'exists', wraps=default_storage.exists) as exists:
+            data = ParticipationSerializer(participations, many=True).data
+
+        self.assertTrue(all(entry['user']['avatar'].endswith('.sm.webp') for entry in data))
+        self.assertEqual(get_many.call_count, 1)
+        is_generated.assert_not_called()
+        exists.assert_not_called()
+
+    def test_storage_checked_only_when_the_image_changes(self):
+        user = User.objects.create(username='owner', email='owner@example.com', password='x',
+                                   avatar=self.image('me.png', (200, 200)))
+        with mock.patch.object(default_storage, 'exists', wraps=default_storage.exists) as exists:
+            user.is_busy = True
+            user.save()
+            User.objects.get(pk=user.pk).save()
+        exists.assert_not_called()
+
+        user.avatar = self.image('new.png', (200, 200))
+        user.save()
+        self.assertTrue(default_storage.exists(derivative_name(user.avatar.name, 'sm')))
+
+        other = User.objects.create(username='other', email='other@example.com', password='x')
+        other.avatar = user.avatar.name
+        other.save()
+        with mock.patch('apps.rooms.thumbnails.generate') as generate:
+            other.save()
+            generate.assert_not_called()
+            other.avatar = self.image('third.png', (200, 200))
+            other.save(update_fields=['is_busy'])
+            generate.assert_not_called()
+
+    def test_backfill_command(self):
+        background = Background.objects.create(bg=self.image('old.png', (640, 480)))
+        default_storage.delete(derivative_name(background.bg.name, 'sm'))
+
+        out = io.StringIO()
+        call_command('generate_thumbnails', stdout=out)
+        self.assertIn('Wrote 1 thumbnails', out.getvalue())
+        self.assertTrue(default_storage.exists(derivative_name(background.bg.name, 'sm')))
@@ -0,0 +1,186 @@
+"""
+Ảnh thu nhỏ cố định kích thước cho avatar và background, tạo lúc upload.
+
+Mỗi kích thước được lưu cạnh ảnh gốc dưới dạng WebP và JPEG:
+avatars/abc.jpg -> avatars/abc.sm.webp, avatars/abc.sm.jpg. Bản thu nhỏ đã
+tạo được ghi nhận trên cache shared và được tra theo lô cho mỗi response
+(resolve); ảnh chưa có bản thu nhỏ (upload trước khi có tính năng này, hoặc
+tạo lỗi) thì serializer trả về ảnh gốc cho tới khi chạy generate_thumbnails.
+"""
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models.signals import post_save, pre_save
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+
+# Bản thu nhỏ chưa có được hỏi lại storage sau số giây này
+MISSING_TIMEOUT = 60
+
+# (model, field, loại ảnh trong IMAGE_DERIVATIVES)
+SOURCES = [
+    ('accounts.User', 'avatar', 'avatar'),
+    ('rooms.Background', 'bg', 'background'),
+]
+
+
+def sizes(kind):
+    return getattr(settings, 'IMAGE_DERIVATIVES', {}).get(kind, {})
+
+
+def derivative_name(name, size, ext='webp'):
+    stem, _ = os.path.splitext(name)
+    return f'{stem}.{size}.{ext}'
+
+
+def generated_key(name):
+    return f'thumbnail:{name}'
+
+
+def mark_generated(*names):
+    caches['shared'].set_many({generated_key(name): True for name in names}, timeout=None)
+
+
+def resolve(names):
+    """
+    {tên: đã tạo hay chưa} cho cả lô tên bản thu nhỏ: một get_many trên cache
+    shared, storage chỉ được hỏi cho những tên chưa ghi nhận (ảnh cũ, hoặc
+    cache bị xoá) rồi nhớ lại.
+    """
+    cache = caches['shared']
+    names = set(names)
+    found = cache.get_many([generated_key(name) for name in names])
+    generated = {name: found[generated_key(name)] for name in names if generated_key(name) in found}
+
+    missing = names - generated.keys()
+    if missing:
+        checked = {name: default_storage.exists(name) for name in missing}
+        if existing := [name for name, exists in checked.items() if exists]:
+            mark_generated(*existing)
+        if absent := [name for name, exists in checked.items() if not exists]:
+            cache.set_many({generated_key(name): False for name in absent}, timeout=MISSING_TIMEOUT)
+        generated.update(checked)
+    return generated
+
+
+def is_generated(name):
+    return resolve([name])[name]
+
+
+def resolve_fields(fields, size, ext='webp'):
+    """
+    resolve() cho bản thu nhỏ cỡ `size` của các ImageField (bỏ qua field trống),
+    để serialize cả trang mà chỉ đọc cache một lần.
+    """
+    return resolve(derivative_name(field.name, size, ext) for field in fields if field)
+
+
+def thumbnail_name(name, size, ext='webp', generated=None):
+    """
+    Tên bản thu nhỏ nếu đã được tạo, ngược lại là tên ảnh gốc. `generated` là
+    kết quả resolve() đã đọc sẵn cho cả lô, nếu có.
+    """
+    derivative = derivative_name(name, size, ext)
+    found = (generated or {}).get(derivative)
+    if found is None:
+        found = is_generated(derivative)
+    return derivative if found else name
+
+
+def derivative_url(field, size, ext='webp', generated=None):
+    """
+    URL bản thu nhỏ của một ImageField, hoặc của ảnh gốc nếu chưa có bản thu
+    nhỏ (None nếu field trống).
+    """
+    if not field:
+        return None
+    return default_storage.url(thumbnail_name(field.name, size, ext, generated))
+
+
+def render(image, box, image_format):
+    image = ImageOps.fit(image, box, Image.LANCZOS)
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG không có kênh alpha: đặt lên nền trắng
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+
+    buffer = io.BytesIO()
+    quality = getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', 80)
+    if image_format == 'JPEG':
+        image.save(buffer, image_format, quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, image_format, quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def generate(name, kind, force=False):
+    """
+    Tạo mọi bản thu nhỏ còn thiếu của ảnh `name` trong storage. Trả về số file đã ghi.
+    """
+    targets = [
+        (derivative_name(name, size, ext), box, image_format)
+        for size, box in sizes(kind).items()
+        for ext, image_format in FORMATS.items()
+    ]
+    if not force:
+        existing = [target[0] for target in targets if default_storage.exists(target[0])]
+        if existing:
+            mark_generated(*existing)
+        targets = [target for target in targets if target[0] not in existing]
+    if not targets:
+        return 0
+
+    try:
+        with default_storage.open(name, 'rb') as source, Image.open(source) as image:
+            # JPEG lớn được giải mã ở độ phân giải thấp hơn, đủ cho bản lớn nhất
+            largest = max(box for _, box, _ in targets)
+            image.draft('RGB', (largest[0] * 2, largest[1] * 2))
+            image = ImageOps.exif_transpose(image)
+            image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+
+            for target, box, image_format in targets:
+                if default_storage.exists(target):
+                    default_storage.delete(target)
+                default_storage.save(target, ContentFile(render(image, box, image_format)))
+                mark_generated(target)
+    except (OSError, UnidentifiedImageError) as e:
+        logger.warning("Cannot create thumbnails for %s: %s", name, e)
+        return 0
+    return len(targets)
+
+
+def image_saving(sender, instance, update_fields=None, **kwargs):
+    # Ghi nhận field ảnh nào thực sự đổi, để các lần lưu khác không phải hỏi storage
+    instance._changed_images = set()
+    for model, field_name, _ in SOURCES:
+        if sender._meta.label != model or (update_fields is not None and field_name not in update_fields):
+            continue
+        field = getattr(instance, field_name)
+        if not field:
+            continue
+        if not field._committed or not instance.pk:
+            # File vừa upload, hoặc bản ghi mới
+            instance._changed_images.add(field_name)
+        elif sender._default_manager.filter(pk=instance.pk).values_list(field_name, flat=True).first() != field.name:
+            instance._changed_images.add(field_name)
+
+
+def image_saved(sender, instance, **kwargs):
+    changed = getattr(instance, '_changed_images', ())
+    for model, field_name, kind in SOURCES:
+        if sender._meta.label == model and field_name in changed:
+            generate(getattr(instance, field_name).name, kind)
+
+
+for model, _, _ in SOURCES:
+    pre_save.connect(image_saving, sender=model, weak=False, dispatch_uid=f'thumbnails:{model}')
+    post_save.connect(image_saved, sender=model, weak=False, dispatch_uid=f'thumbnails:{model}')
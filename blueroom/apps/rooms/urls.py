@@ -2,7 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from django.conf import settings
 from django.conf.urls.static import static
-from . import views
+from . import views, async_views
 
 router = DefaultRouter()
 router.register(r'subjects', views.SubjectViewSet)
@@ -11,6 +11,9 @@ router.register(r'room', views.RoomViewSet)
 router.register(r'admin/reports', views.ReportViewSet, basename="reports")
 
 urlpatterns = [
+    # Đặt trước router: vào / rời phòng dùng view async thay cho action của RoomViewSet
+    path('room/<int:pk>/join/', async_views.join_room, name='room-join-room'),
+    path('room/<int:pk>/leave/', async_views.leave_room, name='room-leave-room'),
     path('', include(router.urls)),
     path('<int:room_id>/mic/', views.ToggleMicView.as_view(), name='toggle_mic'),
     path('<int:room_id>/block/', views.BlockUserView.as_view(), name='block_user'),
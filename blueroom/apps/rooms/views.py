@@ -6,25 +6,50 @@ from rest_framework.viewsets import ModelViewSet
 from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags, quote_etag
+from django.views.decorators.http import condition
 from django.utils.timezone import now, timezone
 from django.core.exceptions import PermissionDenied
 from django.db.models import Count, Sum
 from django.http import HttpResponse, StreamingHttpResponse
 
 from datetime import datetime
+import hashlib
+import json
 
 from apps.accounts.models import User
-from .serializers import SubjectSerializer, BackgroundSerializer, RoomSerializer, EditRoomSerializer, EditPermissionSerializer, ParticipationSerializer
+from .serializers import SubjectSerializer, BackgroundSerializer, RoomSerializer, EditRoomSerializer, EditPermissionSerializer
 from .permissions import IsAdminUser, IsRoomOwner
 from .models import Subject, Background, Room, Participation, User, RoomSubject
+from .snapshot import active_rooms
+from .export import EXPORT_FORMATS, export_response, iterate_rooms
+from blueroom.caching import conditional, tiered_cache
+from . import invalidation, lobby, presence, stats
+from .events import participation_changed
 
 class SubjectViewSet(viewsets.ModelViewSet):
     queryset = Subject.objects.all()
     serializer_class = SubjectSerializer
 
+    @method_decorator(conditional(lambda request, *args, **kwargs: [invalidation.SUBJECTS]))
+    def list(self, request, *args, **kwargs):
+        data = tiered_cache.get_or_set(
+            'subject-list',
+            lambda: self.get_serializer(self.get_queryset(), many=True).data,
+            versions=[invalidation.SUBJECTS]
+        )
+        return Response(data)
+
     def perform_create(self, serializer):
         serializer.save()
 
+    def perform_update(self, serializer):
+        serializer.save()
+        active_rooms.invalidate()
+
     def destroy(self, request, *args, **kwargs):
         subject_id = self.kwargs.get('pk')
 
@@ -40,6 +65,20 @@ class BackgroundViewSet(viewsets.ModelViewSet):
     queryset = Background.objects.all()
     serializer_class = BackgroundSerializer
 
+    @method_decorator(conditional(lambda request, *args, **kwargs: [invalidation.BACKGROUNDS]))
+    def list(self, request, *args, **kwargs):
+        # URL ảnh là tuyệt đối nên key gồm cả host
+        data = tiered_cache.get_or_set(
+            f'background-list:{request.build_absolute_uri("/")}',
+            lambda: self.get_serializer(self.get_queryset(), many=True).data,
+            versions=[invalidation.BACKGROUNDS]
+        )
+        return Response(data)
+
+    def perform_update(self, serializer):
+        serializer.save()
+        active_rooms.invalidate()
+
     def destroy(self, request, *args, **kwargs):
         background = self.get_object()
 
@@ -60,22 +99,38 @@ class RoomViewSet(ModelViewSet):
             return EditRoomSerializer
         return RoomSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            queryset = RoomSerializer.setup_eager_loading(queryset)
+        return queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs['pk']
+        data = tiered_cache.get_or_set(
+            f'room-detail:{pk}:{request.build_absolute_uri("/")}',
+            lambda: self.get_serializer(self.get_object()).data,
+            versions=[invalidation.room_namespace(pk), invalidation.SUBJECTS, invalidation.BACKGROUNDS]
+        )
+        return Response(data)
+
     def perform_create(self, serializer):
         if self.request.user.is_busy:
                 raise ValidationError("Bạn đang trong phòng, không thể tạo phòng mới.")
 
         room = serializer.save(created_by=self.request.user)
 
-        Participation.objects.create(
+        participation = Participation.objects.create(
             user_id=self.request.user,
             room_id=room,
             time_in=now()
         )
+        presence.add_member(participation)
         
         self.request.user.is_busy = True
-        self.request.user.save()
-        room.members = 1
-        room.save()
+        self.request.user.save(update_fields=['is_busy'])
+        stats.record(rooms_created=1, private_rooms_opened=int(room.is_private), joins=1)
+        lobby.room_opened(room.id)
 
         return Response({'room_id': room.id}, status=status.HTTP_201_CREATED)
 
@@ -83,139 +138,59 @@ class RoomViewSet(ModelViewSet):
         room = self.get_object()  
         if room.created_by != self.request.user:
             raise PermissionDenied("Chỉ chủ phòng mới có quyền cập nhật thông tin phòng.")
-        serializer.save()
+        updated = serializer.save()
+        # Số liệu báo cáo suy ra từ bộ đếm nên PATCH is_active cũng phải được đếm
+        if updated.is_active and not room.is_active:
+            stats.record(rooms_reopened=1, private_rooms_opened=int(updated.is_private))
+        elif room.is_active and not updated.is_active:
+            stats.record(rooms_closed=1, private_rooms_closed=int(room.is_private))
+        elif room.is_active and updated.is_private != room.is_private:
+            stats.record(private_rooms_opened=int(updated.is_private), private_rooms_closed=int(room.is_private))
+        lobby.room_updated(room.id)
+
+    def perform_destroy(self, instance):
+        room_id = instance.id
+        instance.delete()
+        lobby.room_closed(room_id)
 
     @action(detail=False, methods=['get'], url_path='room-active')
+    @method_decorator(condition(etag_func=lambda request, *args, **kwargs: active_rooms.etag()))
     def list_Room_Active(self, request):
-        active_rooms = Room.objects.filter(is_active=True).order_by('-created_at')
-
         query = request.query_params.get('query', None) 
-        if query:
-            active_rooms_title = active_rooms.filter(title__icontains=query)
-            
-            if active_rooms_title.exists():
-                active_rooms = active_rooms_title
-            else:
-                room_subjects = RoomSubject.objects.filter(subject_id__name__icontains=query)
-                
-                active_rooms = active_rooms.filter(id__in=room_subjects.values('room_id'))
-            
-        serializer = RoomSerializer(active_rooms, many=True)
-        return Response(serializer.data)
+        if not query:
+            return Response(active_rooms.api_rooms())
+
+        try:
+            limit = min(int(request.query_params.get('limit', settings.ROOM_SEARCH_PAGE_SIZE)), settings.ROOM_SEARCH_MAX_PAGE_SIZE)
+            offset = int(request.query_params.get('offset', 0))
+        except ValueError:
+            return Response({"error": "Parameters 'limit' and 'offset' must be integers."}, status=400)
+        if limit < 1 or offset < 0:
+            return Response({"error": "Parameters 'limit' and 'offset' must be positive."}, status=400)
+
+        total, rooms = active_rooms.search(query, limit, offset)
+        return Response(rooms, headers={'X-Total-Count': str(total)})
 
 
     @action(detail=True, methods=['get'], url_path='members-in-room')
+    @method_decorator(conditional(lambda request, pk=None: [invalidation.members_namespace(pk)]))
     def list_members_in_room(self, request, pk=None):
         room = self.get_object()
 
-        participations = Participation.objects.filter(room_id=room, time_out__isnull=True)
-
-        serializer = ParticipationSerializer(participations, many=True, context={'request': request})
-
-        return Response(serializer.data)
+        data = []
+        for member in presence.members(room.pk):
+            avatar = member['user']['avatar']
+            if avatar:
+                member['user']['avatar'] = request.build_absolute_uri(avatar)
+            data.append(member)
+        return Response(data)
         
     
-    @action(detail=True, methods=['post'], url_path='join')
-    def join_room(self, request, pk=None):
-        room = self.get_object()
-        user = request.user
-        
-        
-        if user.is_busy:
-            return Response({"message": "Bạn đang tham gia phòng khác, không thể tham gia thêm phòng."},
-                            status=status.HTTP_400_BAD_REQUEST)
-        
-        if not room.is_active:
-            return Response({"message": "Phòng học đã kết thúc."},
-                            status=status.HTTP_400_BAD_REQUEST)
-
-        participation = Participation.objects.filter(user_id=user, room_id=room).order_by('-time_out').first()
-
-        if participation and participation.is_blocked == room.id:
-            return Response(
-                {"message": "Bạn đã bị cấm tham gia phòng này."},
-                status=status.HTTP_403_FORBIDDEN
-            )
-        else:
-            participation = Participation.objects.create(
-                user_id=user,
-                room_id=room,
-                time_in=now()  
-            )
-            user.is_busy = True
-            user.save()
-
-            room.members += 1
-            room.members_max += 1
-            room.save()
-            return Response({"message": "Bạn đã tham gia phòng thành công."}, status=status.HTTP_200_OK)
-        # Kiểm tra nếu phòng là riêng tư
-        # if room.is_private:
-        #     return Response({"message": "Phòng riêng tư, chờ xác nhận từ chủ phòng."},
-        #                     status=status.HTTP_202_ACCEPTED)
-
-        
-
-        # if participation:
-        #     participation.time_in = now() 
-        #     participation.time_out = None 
-        #     participation.save()  
-
-        #     user.is_busy = True
-        #     user.save()
-
-        #     room.members += 1
-        #     room.save()
-        #     return Response({"message": "Bạn đã tham gia lại phòng này."}, status=status.HTTP_200_OK)
-        
-
-    @action(detail=True, methods=['post'], url_path='leave')
-    def leave_room(self, request, pk=None):
-        room = self.get_object()
-        user = request.user
-
-        try:
-            participation = Participation.objects.get(user_id=user, room_id=room, time_out__isnull=True)
-        except Participation.DoesNotExist:
-            return Response({"message": "Bạn chưa tham gia phòng này."},
-                            status=status.HTTP_400_BAD_REQUEST)
-
-        if room.created_by == user:
-            room.is_active = False
-            room.members = 1
-            room.save()
-
-            other_participants = Participation.objects.filter(room_id=room, time_out__isnull=True)
-
-            other_participants.update(time_out=now())
-            other_participants_user_ids = other_participants.values_list('user_id', flat=True)
-
-            User.objects.filter(id__in=other_participants_user_ids).update(is_busy=False)
-
-            return Response(
-                {"message": "Phòng đã đóng do chủ phòng rời khỏi. Tất cả người dùng đã bị văng khỏi phòng."},
-                status=status.HTTP_200_OK
-            )
-        
-        participation.time_out = now()
-        participation.save()
-
-        user.is_busy = False
-        user.save()
-
-        room.members -= 1
-        room.save()
-
-        return Response({"message": "Bạn đã rời khỏi phòng thành công."}, status=status.HTTP_200_OK)
-
     @action(detail=True, methods=['post'], url_path='edit-permissions')
     def edit_permissions(self, request, pk=None):
         room = self.get_object()
         user = request.user
 
-        print(user)
-        print(room.created_by)
-
         if room.created_by != user:
             return Response(
                 {"message": "Bạn không có quyền chỉnh sửa quyền của người dùng khác trong phòng này."},
@@ -226,6 +201,13 @@ class RoomViewSet(ModelViewSet):
         if serializer.is_valid():
             participation = Participation.objects.get(user_id=request.data['user_id'], room_id=room, time_out__isnull=True)
             updated_participation = serializer.update(participation, serializer.validated_data)
+            if updated_participation.time_out is None:
+                presence.add_member(updated_participation)
+            else:
+                presence.forget(room.id, updated_participation.user_id_id)
+            participation_changed(room.id, participation.user_id.id)
+            if updated_participation.is_blocked == 1:
+                lobby.members_changed(room.id, updated_participation.room_id.members)
 
             return Response(
                 EditPermissionSerializer(updated_participation).data,
@@ -235,43 +217,70 @@ class RoomViewSet(ModelViewSet):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+DASHBOARD_CACHE_KEY = 'reports:dashboard'
+
+
 class ReportViewSet(viewsets.ViewSet):
     permission_classes = [IsAdminUser]
 
     @action(detail=False, methods=['get'], url_path="account-report")
     def reports(self, request, *args, **kwargs):
-        total_account = User.objects.filter(is_admin=False).count()
-        total_account_in_room = Participation.objects.filter(time_out__isnull=True).values('user_id').distinct().count()
+        figures = stats.report_figures()
 
         data = {
-            "total_account": total_account,
-            "account_in_room": total_account_in_room
+            "total_account": figures['total_account'],
+            "account_in_room": figures['account_in_room']
         }
         return Response(data)
     
     @action(detail=False, methods=["get"], url_path="type-room-report")
     def type_room(self, request, *args, **kwargs):
-        total_room_active = Room.objects.filter(is_active=True).count()
-        total_private_active = Room.objects.filter(is_active=True, is_private=True).count()
+        figures = stats.report_figures()
 
         data = {
-            "total_room_active": total_room_active,
-            "total_private_room": total_private_active
+            "total_room_active": figures['total_room_active'],
+            "total_private_room": figures['total_private_room']
         }
 
         return Response(data)
     
     @action(detail=False, methods=["get"], url_path="room-active-report")
     def room_active(self, request, *args, **kwargs):
-        total_room = Room.objects.all().count()
-        total_room_active = Room.objects.filter(is_active=True).count()
+        figures = stats.report_figures()
 
         data = {
-            "total_room": total_room,
-            "total_room_active": total_room_active
+            "total_room": figures['total_room'],
+            "total_room_active": figures['total_room_active']
         }
 
         return Response(data)
+
+    @action(detail=False, methods=["get"], url_path="dashboard")
+    def dashboard(self, request, *args, **kwargs):
+        # Gộp account-report, type-room-report và room-active-report (một câu aggregate); cache ngắn + ETag
+        cache = caches['shared']
+        cached = cache.get(DASHBOARD_CACHE_KEY)
+        if cached is None:
+            figures = stats.report_figures()
+            etag = quote_etag(hashlib.md5(json.dumps(figures, sort_keys=True).encode()).hexdigest())
+            cached = {'data': figures, 'etag': etag}
+            cache.set(DASHBOARD_CACHE_KEY, cached, settings.DASHBOARD_CACHE_TTL)
+
+        headers = {'ETag': cached['etag'], 'Cache-Control': f'private, max-age={settings.DASHBOARD_CACHE_TTL}'}
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if cached['etag'] in if_none_match or '*' in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(cached['data'], headers=headers)
+
+    @action(detail=False, methods=["get"], url_path="activity-report")
+    def activity(self, request, *args, **kwargs):
+        try:
+            start_date = datetime.strptime(request.query_params.get("start_date"), "%Y-%m-%d")
+            end_date = datetime.strptime(request.query_params.get("end_date"), "%Y-%m-%d")
+        except (TypeError, ValueError):
+            return Response({"error": "Invalid date format. Use 'YYYY-MM-DD'."}, status=400)
+
+        return Response({"days": stats.daily(start_date, end_date)})
     
     @action(detail=False, methods=["post"], url_path="room-created-report")
     def room_created(self, request, *args, **kwargs):
@@ -284,13 +293,22 @@ class ReportViewSet(viewsets.ViewSet):
         except (TypeError, ValueError):
             return Response({"error": "Invalid date format. Use 'YYYY-MM-DD'."}, status=400)
 
+        export = request.data.get("export") or request.query_params.get("export")
+        if export and export not in EXPORT_FORMATS:
+            return Response({"error": "Parameter 'export' must be one of: %s." % ', '.join(EXPORT_FORMATS)}, status=400)
+
         rooms = Room.objects.filter(created_at__date__gte=start_date, created_at__date__lte=end_date)
 
-        serializer = RoomSerializer(rooms, many=True)
+        if export:
+            filename = f"rooms-created-{start_date:%Y-%m-%d}-{end_date:%Y-%m-%d}"
+            return export_response(iterate_rooms(rooms), export, filename)
+
+        serializer = RoomSerializer(RoomSerializer.setup_eager_loading(rooms), many=True)
+        rooms_created = serializer.data
 
         data = {
-            "total_rooms_created": rooms.count(),
-            "rooms_created": serializer.data
+            "total_rooms_created": len(rooms_created),
+            "rooms_created": rooms_created
         }
         return Response(data)
         
@@ -301,16 +319,18 @@ class ReportViewSet(viewsets.ViewSet):
         except ValueError:
             return Response({"error": "Parameter 'n' must be an integer."}, status=400)
 
-        popular_rooms = (
-            Room.objects.filter(is_active=True)
-            .order_by('-members')[:n_rooms]
-        )
+        export = request.query_params.get("export")
+        if export and export not in EXPORT_FORMATS:
+            return Response({"error": "Parameter 'export' must be one of: %s." % ', '.join(EXPORT_FORMATS)}, status=400)
 
-        serializer = RoomSerializer(popular_rooms, many=True)
+        popular_rooms = active_rooms.popular(max(n_rooms, 0))
+
+        if export:
+            return export_response(popular_rooms, export, f"rooms-popular-{n_rooms}")
 
         data = {
             "total_rooms": len(popular_rooms),
-            "rooms": serializer.data
+            "rooms": popular_rooms
         }
         return Response(data)
 
@@ -361,9 +381,22 @@ class BlockUserView(APIView):
         except Participation.DoesNotExist:
             return Response({'error': 'User is not a participant in this room'}, status=status.HTTP_404_NOT_FOUND)
 
-        participation.is_blocked = True
-        participation.time_out = timezone.now()
-        participation.save()
+        # Chỉ request thực sự đóng participation mới trừ thành viên
+        closed = (
+            Participation.objects.filter(pk=participation.pk, time_out__isnull=True)
+            .update(is_blocked=True, time_out=now())
+        )
+        if not closed:
+            return Response({'error': 'User is not a participant in this room'}, status=status.HTTP_404_NOT_FOUND)
+
+        room.remove_member()
+        stats.record(leaves=1)
+        user_to_block.is_busy = False
+        user_to_block.save(update_fields=['is_busy'])
+        presence.forget(room.id, user_to_block.id)
+        invalidation.bump(invalidation.members_namespace(room.id))
+        lobby.members_changed(room.id, room.members)
+        participation_changed(room.id, user_to_block.id)
 
         return Response({'message': f'User {user_to_block.username} has been blocked and logged out of the room'},
                         status=status.HTTP_200_OK)
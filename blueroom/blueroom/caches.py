@@ -0,0 +1,39 @@
+"""
+Cache configuration.
+
+"default" là cache L1 trong từng process. "shared" là cache L2 dùng chung
+giữa các worker (Redis); với backend "memory" nó chỉ là một LocMemCache
+riêng, đủ cho một process và cho test.
+"""
+
+BACKENDS = {
+    'memory': 'django.core.cache.backends.locmem.LocMemCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+
+
+def build_caches(backend='memory', location=None, timeout=300, prefix='blueroom'):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown cache backend '{backend}'. Use one of {sorted(BACKENDS)}.")
+
+    if backend == 'memory':
+        shared = {
+            'BACKEND': BACKENDS[backend],
+            'LOCATION': 'blueroom-shared',
+        }
+    else:
+        shared = {
+            'BACKEND': BACKENDS[backend],
+            'LOCATION': location or 'redis://127.0.0.1:6379/1',
+            'KEY_PREFIX': prefix,
+        }
+    shared['TIMEOUT'] = timeout
+
+    return {
+        'default': {
+            'BACKEND': BACKENDS['memory'],
+            'LOCATION': 'blueroom-local',
+            'TIMEOUT': timeout,
+        },
+        'shared': shared,
+    }
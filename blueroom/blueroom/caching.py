@@ -0,0 +1,170 @@
+"""
+Cache hai tầng cho dữ liệu đã tính sẵn (danh sách subject, background, chi
+tiết phòng, profile).
+
+Mỗi giá trị phụ thuộc vào một hoặc nhiều "namespace" có số version lưu ở
+cache shared. Signal của model (apps/rooms/invalidation.py) tăng version,
+nên key cũ không bao giờ được đọc lại và tự hết hạn. Khi key chưa có, chỉ
+một request tính lại (single-flight): trong process bằng lock, giữa các
+worker bằng cache.add() trên cache shared.
+"""
+import hashlib
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition
+
+MISSING = object()
+
+
+class TieredCache:
+    def __init__(self, local_alias='default', shared_alias='shared', stripes=64):
+        self.local_alias = local_alias
+        self.shared_alias = shared_alias
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    @property
+    def local(self):
+        return caches[self.local_alias]
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _lock(self, key):
+        return self._locks[zlib.crc32(key.encode()) % len(self._locks)]
+
+    def _state(self, namespaces):
+        keys = [f'{kind}:{namespace}' for namespace in namespaces for kind in ('version', 'modified')]
+        found = self.shared.get_many(keys)
+
+        missing = [namespace for namespace in namespaces if f'version:{namespace}' not in found]
+        if missing:
+            # Version khởi tạo bằng thời gian (ms) chứ không phải 0, để key / ETag
+            # không trùng với trước khi cache bị xóa hoặc key hết hạn
+            started = time.time()
+            timeout = getattr(settings, 'CACHE_VERSION_TIMEOUT', 86400)
+            for namespace in missing:
+                self.shared.add(f'version:{namespace}', int(started * 1000), timeout=timeout)
+                self.shared.add(f'modified:{namespace}', started, timeout=timeout)
+            found.update(self.shared.get_many([f'{kind}:{namespace}' for namespace in missing for kind in ('version', 'modified')]))
+
+        return [(found.get(f'version:{namespace}', 0), found.get(f'modified:{namespace}')) for namespace in namespaces]
+
+    def versions(self, namespaces):
+        return [version for version, _ in self._state(namespaces)]
+
+    def state(self, namespaces):
+        """
+        (ETag, thời điểm thay đổi gần nhất) của các namespace, cho conditional GET.
+        """
+        state = self._state(namespaces)
+        tag = ','.join(f'{namespace}@{version}' for namespace, (version, _) in zip(namespaces, state))
+        modified = max((modified for _, modified in state if modified is not None), default=None)
+        return (
+            quote_etag(hashlib.md5(tag.encode()).hexdigest()),
+            datetime.fromtimestamp(modified, tz=timezone.utc) if modified else None,
+        )
+
+    def bump(self, *namespaces):
+        timeout = getattr(settings, 'CACHE_VERSION_TIMEOUT', 86400)
+        for namespace in namespaces:
+            key = f'version:{namespace}'
+            try:
+                self.shared.incr(key)
+            except ValueError:
+                if not self.shared.add(key, int(time.time() * 1000), timeout=timeout):
+                    self.shared.incr(key)
+            self.shared.set(f'modified:{namespace}', time.time(), timeout=timeout)
+
+    def make_key(self, key, namespaces):
+        if not namespaces:
+            return key
+        versions = self.versions(namespaces)
+        return '%s:%s' % (key, ','.join(f'{namespace}@{version}' for namespace, version in zip(namespaces, versions)))
+
+    def get_or_set(self, key, compute, timeout=None, versions=()):
+        timeout = timeout or getattr(settings, 'CACHE_DEFAULT_TIMEOUT', 300)
+        local_timeout = min(timeout, getattr(settings, 'CACHE_LOCAL_TIMEOUT', 60))
+        full_key = self.make_key(key, versions)
+
+        value = self.local.get(full_key, MISSING)
+        if value is not MISSING:
+            return value
+
+        with self._lock(full_key):
+            value = self.local.get(full_key, MISSING)
+            if value is MISSING:
+                value = self.shared.get(full_key, MISSING)
+            if value is MISSING:
+                value = self._compute(full_key, compute, timeout)
+            self.local.set(full_key, value, local_timeout)
+        return value
+
+    def _compute(self, full_key, compute, timeout):
+        lock_key = f'lock:{full_key}'
+        lock_timeout = getattr(settings, 'CACHE_LOCK_TIMEOUT', 5)
+
+        if not self.shared.add(lock_key, 1, timeout=lock_timeout):
+            # Worker khác đang tính: chờ kết quả, quá hạn thì tự tính
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.02)
+                value = self.shared.get(full_key, MISSING)
+                if value is not MISSING:
+                    return value
+            return compute()
+
+        try:
+            value = compute()
+            self.shared.set(full_key, value, timeout)
+            return value
+        finally:
+            self.shared.delete(lock_key)
+
+
+tiered_cache = TieredCache()
+
+
+class cache_lock:
+    """
+    Lock giữa các worker bằng cache.add() trên cache shared, cho các đoạn
+    đọc - sửa - ghi một key. Lock của worker đã chết thì quá
+    CACHE_LOCK_TIMEOUT giây được bỏ qua.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.timeout = getattr(settings, 'CACHE_LOCK_TIMEOUT', 5)
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while not caches['shared'].add(self.key, 1, timeout=self.timeout):
+            if time.monotonic() > deadline:
+                break
+            time.sleep(0.005)
+
+    def __exit__(self, *exc):
+        caches['shared'].delete(self.key)
+
+
+def conditional(namespaces_func):
+    """
+    condition() với ETag / Last-Modified lấy từ version của các namespace mà
+    namespaces_func(request, *args, **kwargs) trả về. Client gửi lại ETag cũ
+    khi dữ liệu chưa đổi sẽ nhận 304 mà view không chạy.
+    """
+    def state(request, *args, **kwargs):
+        if not hasattr(request, '_cache_state'):
+            request._cache_state = tiered_cache.state(namespaces_func(request, *args, **kwargs))
+        return request._cache_state
+
+    return condition(
+        etag_func=lambda request, *args, **kwargs: state(request, *args, **kwargs)[0],
+        last_modified_func=lambda request, *args, **kwargs: state(request, *args, **kwargs)[1],
+    )
@@ -0,0 +1,51 @@
+"""
+Channel layer configuration.
+
+"memory" chỉ hoạt động trong một process Daphne. Khi chạy nhiều worker phải
+dùng "redis" hoặc "redis-pubsub" để group_send tới được mọi socket.
+"""
+
+BACKENDS = {
+    'memory': 'channels.layers.InMemoryChannelLayer',
+    'redis': 'channels_redis.core.RedisChannelLayer',
+    'redis-pubsub': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+}
+
+
+def build_channel_layers(backend='memory', hosts=None, capacity=1000, expiry=30,
+                         group_expiry=86400, prefix='blueroom'):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown channel layer backend '{backend}'. Use one of {sorted(BACKENDS)}.")
+
+    if backend == 'memory':
+        return {
+            'default': {
+                'BACKEND': BACKENDS[backend],
+                'CONFIG': {
+                    'capacity': capacity,
+                    'expiry': expiry,
+                    'group_expiry': group_expiry,
+                },
+            }
+        }
+
+    # Nhiều host => channels_redis chia group/channel theo consistent hash
+    hosts = [host.strip() for host in (hosts or ['redis://127.0.0.1:6379/0']) if host.strip()]
+    config = {
+        'hosts': hosts,
+        'prefix': prefix,
+        'serializer_format': 'msgpack',
+    }
+    if backend == 'redis':
+        config.update({
+            'capacity': capacity,
+            'expiry': expiry,
+            'group_expiry': group_expiry,
+        })
+
+    return {
+        'default': {
+            'BACKEND': BACKENDS[backend],
+            'CONFIG': config,
+        }
+    }
@@ -0,0 +1,239 @@
+"""
+Đo số query, thời gian DB, thời gian render (serialize) và tổng thời gian cho
+từng endpoint HTTP và từng handler của consumer WebSocket.
+
+Số liệu giữ trong process, xem qua GET /api/metrics/ (admin).
+QUERY_BUDGETS trong settings giới hạn số query của từng endpoint; khi
+QUERY_BUDGET_STRICT = True (dùng trong test) vượt ngân sách sẽ raise.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from apps.rooms.permissions import IsAdminUser
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('blueroom_metrics', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class Record:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.render_started = None
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    record = _current.get()
+    if record is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record.queries += 1
+        record.db_time += time.perf_counter() - started
+
+
+def _attach(sender=None, connection=None, **kwargs):
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+def install():
+    connection_created.connect(_attach, dispatch_uid='blueroom.metrics')
+    for connection in connections.all(initialized_only=True):
+        _attach(connection=connection)
+
+
+class EndpointStats:
+    def __init__(self, sample_size):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.over_budget = 0
+        self.samples = deque(maxlen=sample_size)
+
+    def as_dict(self):
+        samples = sorted(self.samples)
+
+        def percentile(fraction):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))] * 1000
+
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total_time / self.count * 1000, 3),
+            'p50_ms': round(percentile(0.50), 3),
+            'p99_ms': round(percentile(0.99), 3),
+            'max_ms': round(self.max_time * 1000, 3),
+            'avg_queries': round(self.queries / self.count, 2),
+            'max_queries': self.max_queries,
+            'avg_db_ms': round(self.db_time / self.count * 1000, 3),
+            'avg_render_ms': round(self.render_time / self.count * 1000, 3),
+            'over_budget': self.over_budget,
+        }
+
+
+class MetricsRegistry:
+    def __init__(self, sample_size=1000):
+        self.sample_size = sample_size
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, total_time, record):
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(endpoint)
+        over_budget = budget is not None and record.queries > budget
+
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats(self.sample_size)
+            stats.count += 1
+            stats.total_time += total_time
+            stats.max_time = max(stats.max_time, total_time)
+            stats.queries += record.queries
+            stats.max_queries = max(stats.max_queries, record.queries)
+            stats.db_time += record.db_time
+            stats.render_time += record.render_time
+            stats.samples.append(total_time)
+            if over_budget:
+                stats.over_budget += 1
+
+        if over_budget:
+            message = f"{endpoint} ran {record.queries} queries, budget is {budget}"
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: stats.as_dict() for endpoint, stats in sorted(self._endpoints.items())}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+registry = MetricsRegistry()
+
+
+def endpoint_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return f"{request.method} {match.view_name if match else 'unresolved'}"
+
+
+class QueryMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        record = Record()
+        token = _current.set(record)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, record, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        # View async (join/leave) không bị đẩy vào thread pool vì middleware này
+        record = Record()
+        token = _current.set(record)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, record, time.perf_counter() - started)
+
+    def finish(self, request, response, record, total_time):
+        response['Server-Timing'] = (
+            f'db;dur={record.db_time * 1000:.1f}, '
+            f'render;dur={record.render_time * 1000:.1f}, '
+            f'total;dur={total_time * 1000:.1f}'
+        )
+        response['X-Query-Count'] = str(record.queries)
+        registry.record(endpoint_name(request), total_time, record)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF Response được render sau view: đo riêng phần serialize ra bytes
+        record = _current.get()
+        if record is not None:
+            record.render_started = time.perf_counter()
+
+            def rendered(response):
+                record.render_time = time.perf_counter() - record.render_started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+class ConsumerMetricsMixin:
+    """
+    Đặt trước AsyncWebsocketConsumer: mỗi message (connect, receive, event
+    của group) được đo như một endpoint "ws <Consumer>.<type>".
+    """
+
+    async def dispatch(self, message):
+        record = Record()
+        token = _current.set(record)
+        started = time.perf_counter()
+        try:
+            await super().dispatch(message)
+        finally:
+            _current.reset(token)
+            registry.record(
+                f"ws {self.__class__.__name__}.{message['type']}",
+                time.perf_counter() - started,
+                record
+            )
+
+
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'budgets': getattr(settings, 'QUERY_BUDGETS', {}),
+            'endpoints': registry.snapshot(),
+        })
+
+    def delete(self, request):
+        registry.reset()
+        return Response(status=204)
+
+
+install()
@@ -13,6 +13,9 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 import os
 from pathlib import Path
 
+from .caches import build_caches
+from .channel_layers import build_channel_layers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -51,6 +54,7 @@ INSTALLED_APPS = [
     'apps.accounts',
     'apps.rooms',
     'apps.chat',
+    'apps.benchmarks',
 ]
 
 REST_FRAMEWORK = {
@@ -70,6 +74,7 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 MIDDLEWARE = [
+    'blueroom.metrics.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -175,8 +180,83 @@ ASGI_APPLICATION = 'blueroom.asgi.application'
 #     },
 # }
 
-CHANNEL_LAYERS = {
-    'default': {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
-    }
+# BLUEROOM_CACHE: memory | redis. Cache "shared" (L2) phải là redis khi chạy nhiều worker
+CACHES = build_caches(
+    backend=os.environ.get('BLUEROOM_CACHE', 'memory'),
+    location=os.environ.get('BLUEROOM_CACHE_URL', 'redis://127.0.0.1:6379/1'),
+)
+
+# blueroom/caching.py: TTL mặc định, TTL tối đa của L1, thời gian giữ lock khi tính lại, TTL của version
+CACHE_DEFAULT_TIMEOUT = 300
+CACHE_LOCAL_TIMEOUT = 60
+CACHE_LOCK_TIMEOUT = 5
+CACHE_VERSION_TIMEOUT = 86400
+
+# BLUEROOM_CHANNEL_LAYER: memory | redis | redis-pubsub
+# BLUEROOM_REDIS_HOSTS: danh sách redis://host:port/db, cách nhau bởi dấu phẩy (mỗi host là một shard)
+CHANNEL_LAYERS = build_channel_layers(
+    backend=os.environ.get('BLUEROOM_CHANNEL_LAYER', 'memory'),
+    hosts=os.environ.get('BLUEROOM_REDIS_HOSTS', 'redis://127.0.0.1:6379/0').split(','),
+    capacity=int(os.environ.get('BLUEROOM_CHANNEL_CAPACITY', 1000)),
+    expiry=int(os.environ.get('BLUEROOM_CHANNEL_EXPIRY', 30)),
+    group_expiry=int(os.environ.get('BLUEROOM_CHANNEL_GROUP_EXPIRY', 86400)),
+)
+
+# Số tin nhắn gửi khi client kết nối / mỗi lần load_older
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+
+# Danh sách phòng đang hoạt động được giữ trên cache shared, nạp lại từ DB sau số giây này
+ACTIVE_ROOM_SNAPSHOT_TTL = 60
+
+# Ghi tin nhắn chat theo lô (apps/chat/writer.py)
+CHAT_WRITE_BATCH_SIZE = 100
+CHAT_WRITE_FLUSH_INTERVAL = 0.05
+CHAT_WRITE_MAX_PENDING = 5000
+
+# Presence (apps/rooms/presence.py): socket chat báo còn sống mỗi HEARTBEAT_INTERVAL giây,
+# participation không được thấy quá TIMEOUT giây bị đóng bởi reaper chạy mỗi REAP_INTERVAL giây (0 = tắt)
+PRESENCE_HEARTBEAT_INTERVAL = 20
+PRESENCE_TIMEOUT = 90
+PRESENCE_REAP_INTERVAL = 30
+
+# File chia sẻ trong chat (apps/chat/files.py): dung lượng tối đa và kích thước chunk khi đọc
+SHARED_FILE_MAX_SIZE = 100 * 1024 * 1024
+SHARED_FILE_CHUNK_SIZE = 64 * 1024
+
+# Ảnh thu nhỏ (apps/rooms/thumbnails.py), tạo khi upload dưới dạng WebP và JPEG: tên -> (rộng, cao)
+IMAGE_DERIVATIVES = {
+    'avatar': {'sm': (96, 96), 'md': (256, 256)},
+    'background': {'sm': (480, 270), 'lg': (1280, 720)},
+}
+IMAGE_DERIVATIVE_QUALITY = 80
+
+# Candidate WebRTC gửi tới cùng một peer được gom trong khoảng này (giây), 0 = gửi ngay
+SIGNALING_CANDIDATE_WINDOW = 0.05
+
+# Số query tối đa của mỗi endpoint ("<METHOD> <view_name>" hoặc "ws <Consumer>.<type>"),
+# xem số liệu thực tế tại /api/metrics/. STRICT = True thì vượt ngân sách sẽ raise (dùng trong test)
+QUERY_BUDGETS = {
+    'GET room-list-Room-Active': 10,
+    'GET room-list-members-in-room': 30,
+    'POST room-join-room': 10,
+    'POST room-leave-room': 10,
+    'GET get_messages': 5,
+    'ws ChatConsumer.websocket.connect': 4,
+    'ws ChatConsumer.websocket.receive': 3,
+    'ws RoomConsumer.websocket.connect': 9,
 }
+QUERY_BUDGET_STRICT = False
+
+# Tìm phòng (room-active?query=): số phòng mặc định / tối đa mỗi trang
+ROOM_SEARCH_PAGE_SIZE = 50
+ROOM_SEARCH_MAX_PAGE_SIZE = 200
+
+# Bộ đếm báo cáo theo giờ (apps/rooms/stats.py): cộng dồn trên cache shared, ghi xuống DB mỗi bấy nhiêu giây
+STATS_FLUSH_INTERVAL = 5
+
+# Xuất báo cáo dạng stream (?export=ndjson|csv): số phòng đọc mỗi lô
+REPORT_EXPORT_CHUNK_SIZE = 1000
+
+# /api/rooms/admin/reports/dashboard/ được cache bao nhiêu giây
+DASHBOARD_CACHE_TTL = 10
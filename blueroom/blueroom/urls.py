@@ -17,9 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from .metrics import MetricsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/accounts/', include('apps.accounts.urls')),
     path('api/rooms/', include('apps.rooms.urls')),
     path('api/chat/', include('apps.chat.urls')),
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
 ]